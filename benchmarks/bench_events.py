@@ -0,0 +1,77 @@
+"""
+Микробенчмарк разбора SSE-эвентов в BaseDispatcherEvent.
+
+    PYTHONPATH=src python benchmarks/bench_events.py [--events 50000]
+
+Печатает число эвентов в секунду и объем памяти на один эвент
+для пути через SSEEventParser и для прямого пути parse_event().
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from cba.consumers import ServerSentEvent, SSEEventParser, SSEStreamParser
+
+try:
+    from cba.consumers import parse_event
+except ImportError:  # До появления прямого пути разбора
+    parse_event = None
+
+
+EVENT = (
+    b"event: slave\r\n"
+    b'data: {"command": "HumanCallableArgs", '
+    b'"target": {"target_type": "user", "target_name": "172698654"}, '
+    b'"behavior": "user", "args": {"arg1": "321", "arg2": "qwerty"}}\r\n\r\n'
+)
+
+
+def via_parser(sse: ServerSentEvent):
+    return SSEEventParser.from_sse(sse)()
+
+
+def measure(name: str, to_event, events_count: int):
+    stream = EVENT * events_count
+    chunk_size = 64 * 1024
+
+    gc.collect()
+    started = time.perf_counter()
+    parser = SSEStreamParser()
+    produced = 0
+    for i in range(0, len(stream), chunk_size):
+        for sse in parser.feed(stream[i : i + chunk_size]):
+            to_event(sse)
+            produced += 1
+    elapsed = time.perf_counter() - started
+
+    sse_events = SSEStreamParser().feed(EVENT * 1000)
+    gc.collect()
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    events = [to_event(sse) for sse in sse_events]
+    allocated = sum(
+        stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, "filename")
+    )
+    tracemalloc.stop()
+    del events
+
+    print(
+        f"{name:<16} {produced / elapsed:>12,.0f} events/s "
+        f"{allocated / len(sse_events):>8,.0f} bytes/event"
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--events", type=int, default=50000)
+    args = arg_parser.parse_args()
+
+    measure("SSEEventParser", via_parser, args.events)
+    if parse_event is not None:
+        measure("parse_event", parse_event, args.events)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Микробенчмарк ответа на getAvailableMethods (Introduce).
+
+    PYTHONPATH=src python benchmarks/bench_introduce.py [--repeat 20]
+
+Сравнивает построение описания команд заново на каждый запрос
+с готовым описанием CommandsDispatcher.commands_catalog().
+"""
+
+import argparse
+import time
+
+from cba.commands import HumanCallableCommandWithArgs, arguments
+from cba.dispatcher import CommandsDispatcher, Introduce
+from cba.helpers import ClientInfo
+
+
+def build_dispatcher(commands_count: int) -> CommandsDispatcher:
+    dispatcher = CommandsDispatcher()
+    dispatcher.introduce(ClientInfo("bench"))
+    for i in range(commands_count):
+        attrs = {
+            "CMD": f"cmd{i}",
+            "__doc__": f">>WARNING<< Generated command {i}",
+            "ARGS": (arguments.Integer("count", "how many", minimum=1, maximum=100),),
+        }
+        dispatcher.register_callable_command(
+            type(f"Cmd{i}", (HumanCallableCommandWithArgs,), attrs)
+        )
+    return dispatcher
+
+
+def measure(func, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    for commands_count in (10, 100, 1000, 5000):
+        dispatcher = build_dispatcher(commands_count)
+        rebuilt = measure(
+            lambda: Introduce.describe_commands(dispatcher.callable_commands, "bench"),
+            args.repeat,
+        )
+        dispatcher.commands_catalog()  # Описание строится один раз после регистрации
+        cached = measure(dispatcher.commands_catalog, args.repeat)
+        print(
+            f"{commands_count:>6} commands {rebuilt * 1000:>10.3f} ms (rebuilt) "
+            f"{cached * 1000:>10.3f} ms (catalog)"
+        )
+
+
+if __name__ == "__main__":
+    main()
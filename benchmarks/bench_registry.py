@@ -0,0 +1,64 @@
+"""
+Микробенчмарк поиска команды в диспетчере по CMD.
+
+    PYTHONPATH=src python benchmarks/bench_registry.py [--lookups 100000]
+
+Сравнивает прежний линейный поиск по спискам команд с индексом диспетчера
+для 10, 100, 1000 и 10000 зарегистрированных команд.
+"""
+
+import argparse
+import time
+
+from cba.commands import BaseCommand
+from cba.dispatcher import CommandsDispatcher
+
+
+def linear_lookup(dispatcher: CommandsDispatcher, command: str, behavior: str):
+    """Поиск команды в том виде, в каком он был до индекса"""
+    all_commands = dispatcher.callable_commands + dispatcher.service_commands
+    cmd_type = list(filter(lambda x: x.CMD == command, all_commands))[0]
+    if behavior == "admin":
+        cmd_type = cmd_type.behavior__admin
+    return cmd_type
+
+
+def indexed_lookup(dispatcher: CommandsDispatcher, command: str, behavior: str):
+    return dispatcher._find_command(command, behavior)
+
+
+def build_dispatcher(commands_count: int) -> CommandsDispatcher:
+    dispatcher = CommandsDispatcher()
+    for i in range(commands_count):
+        dispatcher.register_callable_command(type(f"Cmd{i}", (BaseCommand,), {"CMD": f"cmd{i}"}))
+    return dispatcher
+
+
+def measure(lookup, dispatcher: CommandsDispatcher, names: list, lookups: int) -> float:
+    started = time.perf_counter()
+    for i in range(lookups):
+        lookup(dispatcher, names[i % len(names)], "user")
+    return lookups / (time.perf_counter() - started)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--lookups", type=int, default=100000)
+    args = arg_parser.parse_args()
+
+    for commands_count in (10, 100, 1000, 10000):
+        dispatcher = build_dispatcher(commands_count)
+        # Последние команды - худший случай для линейного поиска
+        names = [f"cmd{i}" for i in range(max(0, commands_count - 10), commands_count)]
+        # Линейный поиск на больших каталогах слишком медленный для полного прогона
+        linear_lookups = max(100, args.lookups * 10 // commands_count)
+        linear = measure(linear_lookup, dispatcher, names, min(args.lookups, linear_lookups))
+        indexed = measure(indexed_lookup, dispatcher, names, args.lookups)
+        print(
+            f"{commands_count:>6} commands {linear:>14,.0f} lookups/s (linear) "
+            f"{indexed:>14,.0f} lookups/s (indexed)"
+        )
+
+
+if __name__ == "__main__":
+    main()
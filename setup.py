@@ -36,6 +36,8 @@ setup(
         "aioamqp==0.14.0",
     ],
     extras_require={
+        "orjson": ["orjson"],
+        "ujson": ["ujson"],
         "dev": [
             "pydantic==1.7.3",
             "pytest==6.2.2",
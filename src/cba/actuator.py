@@ -1,16 +1,27 @@
 import asyncio
 import logging
+import signal
 
-from typing import List, Union
+from typing import Callable, Iterable, List, Optional, Union
 
-from cba.consumers import SSEConsumer
+from cba.codecs import get_codec, JSONCodec
+from cba.consumers import AMQPConsumer, SSEConsumer
 from cba.dispatcher import CommandsDispatcher
 from cba.helpers import ClientInfo
+from cba.metrics import MetricsServer, REGISTRY
 from cba.publishers import BasePublisher
+from cba.queues import EventsQueue, OverloadPolicy, PriorityEventsQueue
+from cba.tracing import Tracer
+from cba.workers import WorkerPool
 
 
 _LOGGER = logging.getLogger(__name__)
 
+_QUEUE_DEPTH = REGISTRY.gauge(
+    "cba_events_waiting", "Events waiting to be dispatched", ("actuator",)
+)
+_IN_FLIGHT = REGISTRY.gauge("cba_events_in_flight", "Events being dispatched", ("actuator",))
+
 
 class Actuator:
     """Класс для связывания получаетеля команд и их диспетчера"""
@@ -19,42 +30,259 @@ class Actuator:
         self,
         name: str,
         *,
-        consumer: SSEConsumer,
+        consumer: Union[SSEConsumer, AMQPConsumer],
         dispatcher: CommandsDispatcher,
         publishers: Union[BasePublisher, List[BasePublisher], None] = None,
         verbose_name="",
         hide_name=False,
+        queue_maxsize: int = 0,
+        overload_policy: OverloadPolicy = OverloadPolicy.BLOCK,
+        json_codec: Union[JSONCodec, str, None] = None,
+        prioritized: bool = False,
+        priority_aging: float = 5.0,
+        shutdown_timeout: float = 30.0,
+        metrics_port: Optional[int] = None,
+        tracer: Optional[Tracer] = None,
     ):
+        """
+        :param queue_maxsize: сколько эвентов может ожидать и выполняться одновременно
+        :param overload_policy: что делать с эвентами сверх queue_maxsize.
+            DROP_OLDEST несовместим с CommandsDispatcher(ordered_targets=True)
+        :param json_codec: JSON-кодек ("orjson", "ujson", "json" или экземпляр JSONCodec).
+            По-умолчанию - самый быстрый из установленных.
+        :param prioritized: отдавать диспетчеру первыми эвенты с большим PRIORITY команды
+            (имеет смысл вместе с CommandsDispatcher(max_concurrency=...)).
+            Несовместим с CommandsDispatcher(ordered_targets=True)
+        :param priority_aging: за сколько секунд ожидания приоритет эвента растет на единицу
+        :param shutdown_timeout: сколько секунд при остановке ждать выполняющиеся команды
+        :param metrics_port: порт HTTP-сервера с метриками Prometheus (GET /metrics).
+            Реестр метрик общий, поэтому в процессе достаточно одного актуатора с портом
+        :param tracer: трассировка эвентов от разбора до отправки сообщений (cba.tracing)
+        """
+        if dispatcher.ordered_targets and (
+            prioritized or overload_policy is OverloadPolicy.DROP_OLDEST
+        ):
+            # Очереди адресатов сразу забирают все эвенты из очереди актуатора:
+            # выбрасывать и переупорядочивать в ней было бы нечего
+            raise ValueError("ordered_targets can't be used with prioritized or DROP_OLDEST")
         self.client_info = ClientInfo(name, verbose_name, hide_name)
         self.consumer = consumer
         self.publishers = publishers
         self.dispatcher = dispatcher
+        self.queue_maxsize = queue_maxsize
+        self.overload_policy = overload_policy
+        self.prioritized = prioritized
+        self.priority_aging = priority_aging
+        self.shutdown_timeout = shutdown_timeout
+        self.metrics_server = MetricsServer(metrics_port) if metrics_port is not None else None
+        self.events_queue = None
+        self.worker_pool: Optional[WorkerPool] = None
+        self.tasks = []
         self._running = False
+        self._reader_task: Optional[asyncio.Task] = None
+        self._consumer_task: Optional[asyncio.Task] = None
+        self._shutdown: Optional[asyncio.Future] = None
 
         self.dispatcher.introduce(self.client_info)
         if publishers:
             self.dispatcher.set_publishers(publishers)
+        if json_codec is not None:
+            self.set_json_codec(json_codec)
+        if tracer is not None:
+            self.set_tracer(tracer)
+
+    def set_tracer(self, tracer: Tracer):
+        self.consumer.tracer = tracer
+        self.dispatcher.tracer = tracer
+
+    def set_json_codec(self, json_codec: Union[JSONCodec, str]):
+        if isinstance(json_codec, str):
+            json_codec = get_codec(json_codec)
+        self.consumer.codec = json_codec
+        self.dispatcher.json_codec = json_codec
+        for publisher in self.dispatcher.publishers:
+            publisher.codec = json_codec
 
-    def run(self, loop=None):
+    def run(self, loop=None, workers: int = 0):
+        """
+        :param workers: число процессов, выполняющих команды (cba.workers).
+            0 - команды выполняются в этом процессе
+        """
         if not loop:
             loop = asyncio.get_event_loop()
         loop.set_exception_handler(self.exception_handler)
-        queue = asyncio.Queue()
-
-        loop.create_task(self._set_running())
-        loop.create_task(self.dispatcher.events_reader(events_queue=queue))
-        loop.create_task(self.consumer.listen(events_queue=queue))
+        self.start(loop, workers=workers)
+        _add_signal_handlers(loop, [self])
 
         loop.run_forever()
 
+    def start(self, loop=None, workers: int = 0):
+        """Запускает задачи актуатора на event loop, не блокируя его"""
+        if not loop:
+            loop = asyncio.get_event_loop()
+        queue = self.events_queue = self.create_events_queue()
+        if workers:
+            # Здесь эвенты только ждут отправки воркеру, выполняющиеся считают воркеры
+            self.worker_pool = WorkerPool(self, workers)
+            self.set_gauges(queue.qsize, lambda: 0)
+            reader = self.worker_pool.serve(queue)
+        else:
+            self.set_gauges(lambda: self.dispatcher.waiting, lambda: self.dispatcher.in_flight)
+            reader = self.dispatcher.events_reader(events_queue=queue)
+
+        self._reader_task = loop.create_task(reader)
+        self._consumer_task = loop.create_task(self.consumer.listen(events_queue=queue))
+        self.tasks = [
+            loop.create_task(self._set_running()),
+            self._reader_task,
+            self._consumer_task,
+        ]
+        if self.metrics_server is not None:
+            self.tasks.append(loop.create_task(self.metrics_server.start()))
+        return self.tasks
+
+    def create_events_queue(self, maxsize: Optional[int] = None) -> EventsQueue:
+        """Очередь эвентов с настройками актуатора (воркеры создают свою, без ограничения)"""
+        queue_kwargs = dict(
+            overload_policy=self.overload_policy,
+            on_reject=self.dispatcher.reject,
+            on_drop=self.dispatcher.drop,
+        )
+        maxsize = self.queue_maxsize if maxsize is None else maxsize
+        if self.prioritized:
+            return PriorityEventsQueue(
+                maxsize,
+                priority=self.dispatcher.event_priority,
+                aging=self.priority_aging,
+                **queue_kwargs,
+            )
+        return EventsQueue(maxsize, **queue_kwargs)
+
+    def set_gauges(self, waiting: Callable[[], int], in_flight: Callable[[], int]):
+        """Откуда метрики берут число ожидающих и выполняющихся эвентов"""
+        name = self.client_info.name
+        _QUEUE_DEPTH.labels(name).set_function(waiting)
+        _IN_FLIGHT.labels(name).set_function(in_flight)
+
+    async def shutdown(self, timeout: Optional[float] = None):
+        """
+        Плавная остановка:
+        1. консьюмер перестает принимать эвенты;
+        2. принятые эвенты выполняются, но не дольше timeout секунд, остальные отменяются;
+        3. паблишеры закрывают соединения (все сообщения выполненных команд уже отправлены);
+        4. консьюмер закрывает соединения.
+        Повторные вызовы ждут ту же остановку.
+        """
+        if self._shutdown is None:
+            timeout = self.shutdown_timeout if timeout is None else timeout
+            self._shutdown = asyncio.ensure_future(self._shutdown_stages(timeout))
+        await asyncio.shield(self._shutdown)
+
+    @property
+    def shutting_down(self) -> bool:
+        return self._shutdown is not None
+
+    async def _shutdown_stages(self, timeout: float):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        _LOGGER.info("Stopping actuator %s...", self.client_info.name)
+
+        await self.consumer.stop()
+        await _cancel(self._consumer_task)
+
+        if self.events_queue is not None and self.events_queue.unfinished:
+            try:
+                await asyncio.wait_for(self.events_queue.join(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                _LOGGER.warning(
+                    "%d events were not processed in %.1f s, cancel them",
+                    self.events_queue.unfinished,
+                    timeout,
+                )
+        await _cancel(self._reader_task)
+        if self.worker_pool is not None:
+            await self.worker_pool.stop(max(0.0, deadline - loop.time()))
+        await self.dispatcher.cancel_pending()
+        self.dispatcher.executors.shutdown(wait=False)
+
+        for publisher in self.dispatcher.publishers:
+            try:
+                await publisher.close()
+            except Exception:
+                _LOGGER.warning("Can't close publisher %r", publisher, exc_info=True)
+
+        await self.consumer.close()
+        if self.dispatcher.tracer is not None:
+            await self.dispatcher.tracer.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        _LOGGER.info("Actuator %s stopped", self.client_info.name)
+
     def exception_handler(self, loop, context):
         if self._running:
             self._running = False
             exc = context["exception"]
             exc_info = (type(exc), exc, exc.__traceback__)
             _LOGGER.critical(exc, exc_info=exc_info)
-            loop.stop()
+            loop.create_task(_shutdown_and_stop(loop, [self]))
 
     async def _set_running(self):
         self._running = True
         _LOGGER.info("Telegram lever started")
+
+
+async def _cancel(task: Optional[asyncio.Task]):
+    if task is None:
+        return
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def _shutdown_and_stop(loop, actuators: List[Actuator]):
+    try:
+        await asyncio.gather(*(actuator.shutdown() for actuator in actuators))
+    finally:
+        loop.stop()
+
+
+def _add_signal_handlers(loop, actuators: List[Actuator]):
+    """SIGTERM и SIGINT запускают плавную остановку, повторный сигнал - немедленную"""
+
+    def on_signal(signame: str):
+        if any(actuator.shutting_down for actuator in actuators):
+            _LOGGER.warning("Got %s again, stop immediately", signame)
+            loop.stop()
+            return
+        _LOGGER.info("Got %s, shutting down", signame)
+        loop.create_task(_shutdown_and_stop(loop, actuators))
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, on_signal, signum.name)
+        except (NotImplementedError, RuntimeError):  # Windows или не главный поток
+            pass
+
+
+def run_actuators(actuators: Iterable[Actuator], loop=None):
+    """
+    Запускает несколько актуаторов в одном процессе на одном event loop.
+    Удобно использовать вместе с cba.consumers.SSEConsumerPool.
+    """
+    actuators = list(actuators)
+    if not loop:
+        loop = asyncio.get_event_loop()
+
+    def exception_handler(loop_, context):
+        if any(actuator._running for actuator in actuators):
+            for actuator in actuators:
+                actuator._running = False
+            exc = context["exception"]
+            _LOGGER.critical(exc, exc_info=(type(exc), exc, exc.__traceback__))
+            loop_.create_task(_shutdown_and_stop(loop_, actuators))
+
+    loop.set_exception_handler(exception_handler)
+    for actuator in actuators:
+        actuator.start(loop)
+    _add_signal_handlers(loop, actuators)
+
+    loop.run_forever()
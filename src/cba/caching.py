@@ -0,0 +1,177 @@
+"""
+Повторное использование ответов команд.
+
+ResultCache: команда с CACHE_TTL выполняется один раз, а ее сообщения запоминаются
+и до истечения CACHE_TTL секунд пересылаются новым адресатам без вызова _execute.
+
+SingleFlight: пока команда выполняется, такие же команды (COALESCE) не запускаются,
+а ждут ее и получают те же сообщения.
+"""
+
+import asyncio
+import logging
+import time
+
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Union
+
+from cba.messages import TelegramMessage
+from cba.publishers import BasePublisher
+
+
+__all__ = ["ResultCache", "SingleFlight"]
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _CacheEntry:
+
+    __slots__ = ("cmd", "messages", "result", "expires_at")
+
+    def __init__(self, cmd: str, messages: List[TelegramMessage], result, expires_at: float):
+        self.cmd = cmd
+        self.messages = messages
+        self.result = result
+        self.expires_at = expires_at
+
+
+class _RecordingPublisher(BasePublisher):
+    """Запоминает сообщения, которые команда отправляет настоящим паблишерам"""
+
+    METRICS = False
+
+    def __init__(self):
+        self.messages = []
+
+    async def publish_message(self, message: TelegramMessage):
+        self.messages.append(message)
+
+
+async def _replay(messages: List[TelegramMessage], cmd):
+    """Пересылает сообщения другой команды адресату cmd"""
+    for message in messages:
+        message = message.retarget(cmd.target, str(cmd.id))
+        for publisher in cmd.publishers:
+            await publisher.publish_message(message)
+
+
+async def _record(cmd, execute: Callable[[object], Awaitable]):
+    """Выполняет команду и возвращает ее результат и отправленные сообщения"""
+    publishers = cmd.publishers
+    recorder = _RecordingPublisher()
+    cmd.publishers = [recorder, *publishers]
+    try:
+        result = await execute(cmd)
+    finally:
+        cmd.publishers = publishers
+    return result, recorder.messages
+
+
+class ResultCache:
+    """LRU-кэш с временем жизни записей. Ключ записи - BaseCommand.cache_key()"""
+
+    def __init__(self, max_entries: int = 1000, clock: Callable[[], float] = time.monotonic):
+        """
+        :param max_entries: сколько ответов хранить. Лишние вытесняются по LRU
+        """
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: Dict[Hashable, _CacheEntry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def run(self, cmd, execute: Callable[[object], Awaitable]):
+        """Отвечает из кэша или выполняет команду через execute и запоминает ее сообщения"""
+        key = cmd.cache_key()
+        entry = self._get(key)
+        if entry is not None:
+            self.hits += 1
+            _LOGGER.debug("Command %s answered from cache", cmd.CMD)
+            await _replay(entry.messages, cmd)
+            return entry.result
+
+        self.misses += 1
+        result, messages = await _record(cmd, execute)
+        # Сообщения другим адресатам - побочный эффект, повторять его из кэша нельзя
+        if all(message.target == cmd.target for message in messages):
+            expires_at = self.clock() + cmd.CACHE_TTL
+            self._put(key, _CacheEntry(cmd.CMD, messages, result, expires_at))
+        return result
+
+    def invalidate(self, *commands: Union[str, type]) -> int:
+        """
+        Удаляет ответы перечисленных команд (CMD или классы), без аргументов - все.
+        Возвращает число удаленных записей.
+        """
+        if not commands:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+        names = {cmd if isinstance(cmd, str) else cmd.CMD for cmd in commands}
+        keys = [key for key, entry in self._entries.items() if entry.cmd in names]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def _get(self, key: Hashable) -> Optional[_CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: Hashable, entry: _CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SingleFlight:
+    """Объединяет одинаковые (по BaseCommand.cache_key()) одновременно выполняющиеся команды"""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0  # Сколько команд получили ответ чужого выполнения
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def run(self, cmd, execute: Callable[[object], Awaitable]):
+        """Выполняет команду через execute или дожидается такой же и пересылает ее сообщения"""
+        key = cmd.cache_key()
+        flight = self._flights.get(key)
+        if flight is not None:
+            # shield: отмена ожидающей команды не должна отменять общее выполнение
+            outcome = await asyncio.shield(flight)
+            if outcome is None:
+                # Выполнение было отменено - выполняем команду сами
+                return await self.run(cmd, execute)
+            result, messages, target, error = outcome
+            self.coalesced += 1
+            if error is not None:
+                raise error
+            # Сообщения другим адресатам уже отправлены выполнившей командой
+            await _replay([message for message in messages if message.target == target], cmd)
+            return result
+
+        flight = self._flights[key] = asyncio.get_event_loop().create_future()
+        try:
+            result, messages = await _record(cmd, execute)
+        except asyncio.CancelledError:
+            flight.set_result(None)
+            raise
+        except BaseException as err:
+            flight.set_result((None, [], cmd.target, err))
+            raise
+        finally:
+            del self._flights[key]
+        flight.set_result((result, messages, cmd.target, None))
+        return result
@@ -0,0 +1,99 @@
+"""
+JSON-кодеки.
+Используется самый быстрый из установленных: orjson, ujson или стандартный json.
+Все кодеки принимают на вход и str, и bytes, а кодируют сразу в bytes,
+чтобы между сетью и словарями не было лишних преобразований в строку.
+"""
+
+import json
+
+from typing import Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+__all__ = [
+    "JSONCodec",
+    "OrjsonCodec",
+    "UjsonCodec",
+    "DecodeError",
+    "available_codecs",
+    "get_codec",
+    "default_codec",
+]
+
+# Исключения всех кодеков при разборе невалидного JSON - подклассы ValueError
+DecodeError = ValueError
+
+
+class JSONCodec:
+    """Стандартный json"""
+
+    name = "json"
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    def loads(self, data: Union[bytes, str]):
+        return json.loads(data)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}>"
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data: Union[bytes, str]):
+        return orjson.loads(data)
+
+
+class UjsonCodec(JSONCodec):
+    name = "ujson"
+
+    def dumps(self, obj) -> bytes:
+        return ujson.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    def loads(self, data: Union[bytes, str]):
+        return ujson.loads(data)
+
+
+_CODECS = {
+    "orjson": (OrjsonCodec, orjson),
+    "ujson": (UjsonCodec, ujson),
+    "json": (JSONCodec, json),
+}
+
+
+def available_codecs() -> list:
+    """Имена кодеков, для которых установлены библиотеки, от быстрого к медленному"""
+    return [name for name, (_, module) in _CODECS.items() if module is not None]
+
+
+def get_codec(name: Optional[str] = None) -> JSONCodec:
+    """
+    :param name: "orjson", "ujson" или "json". По-умолчанию - самый быстрый из установленных
+    """
+    if name is None:
+        name = available_codecs()[0]
+    try:
+        codec_type, module = _CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown JSON codec: {name}")
+    if module is None:
+        raise ImportError(f"JSON codec {name} is not installed")
+    return codec_type()
+
+
+default_codec = get_codec()
@@ -18,24 +18,46 @@ CommandsDispatcher
 команд инстанцированием класса Arg
 """
 
+import asyncio
 import datetime
 import logging
+import time
 import uuid
 
 from abc import ABC, abstractmethod
+from enum import IntEnum
 from typing import List, Tuple, Type, Optional
 
 from cba import exceptions
+from cba.codecs import default_codec, JSONCodec
 from cba.commands.commands_tools import load_json_template
 from cba.messages import TelegramMessage, MessageTarget, parse_and_paste_emoji
+from cba.metrics import REGISTRY
 from cba.publishers import BasePublisher
 from cba.helpers import ClientInfo
+from cba.tracing import command_span_id, Trace
 
 from . import arguments
 
 
 logger = logging.getLogger(__name__)
 
+_COMMAND_SECONDS = REGISTRY.histogram(
+    "cba_command_seconds", "Command business logic execution time", ("cmd",)
+)
+_COMMAND_ERRORS = REGISTRY.counter(
+    "cba_command_errors_total", "Commands failed with an exception", ("cmd",)
+)
+
+
+class Priority(IntEnum):
+    """Приоритет выполнения команды, если эвенты ждут в очереди"""
+
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2  # Служебные команды и команды администратора
+    SERVICE = 3  # Интроспекция актуатора ботом
+
 
 class BaseCommand(ABC):
     """
@@ -49,17 +71,29 @@ class BaseCommand(ABC):
     PATH_TO_FILE: str = None  # Путь к файлу с пользовательскими командами
     CMD: str  # Команда в telegram
     HUMAN_CALLABLE: bool  # Могут ли вызывать пользователи?
+    PRIORITY: int = Priority.NORMAL  # Приоритет в очереди эвентов (см. PriorityEventsQueue)
+    EXECUTOR: Optional[str] = None  # Где выполнять команду: "thread", "process" (см. cba.executors)
+    TIMEOUT: Optional[float] = None  # Секунд на выполнение. None - как у диспетчера, 0 - без лимита
+    CACHE_TTL: Optional[float] = None  # Сколько секунд отвечать из кэша (см. cba.caching)
+    INVALIDATES: Tuple[str, ...] = tuple()  # CMD команд, чей кэш сбрасывается после этой
+    # Ждать уже выполняющуюся такую же команду вместо запуска новой. None - как у диспетчера
+    COALESCE: Optional[bool] = None
     hidden = False
     admin_only = False
     behavior__admin: Optional[Type["BaseCommand"]] = None
+    # Увеличивается при любом изменении описания команд (hide, show, admin behavior),
+    # чтобы диспетчеры могли сбрасывать построенные по командам индексы
+    catalog_version = 0
 
     @classmethod
     def hide(cls):
         cls.hidden = True
+        BaseCommand.catalog_version += 1
 
     @classmethod
     def show(cls):
         cls.hidden = False
+        BaseCommand.catalog_version += 1
 
     @classmethod
     def mark_as_admin_only(cls):
@@ -67,6 +101,7 @@ class BaseCommand(ABC):
             raise AttributeError("The command is already has admin behaviour!")
         cls.admin_only = True
         cls.behavior__admin = cls
+        BaseCommand.catalog_version += 1
 
     @classmethod
     def admin_behavior(cls, command: Type["BaseCommand"]):
@@ -75,6 +110,7 @@ class BaseCommand(ABC):
             raise AttributeError("The command is already only for the admin!")
         command.CMD = cls.CMD
         cls.behavior__admin = command
+        BaseCommand.catalog_version += 1
         return command
 
     def __init__(
@@ -85,21 +121,29 @@ class BaseCommand(ABC):
         publishers: List[BasePublisher],
         parent_id: Optional[str] = None,
         command_args: Optional[dict] = None,
+        json_codec: JSONCodec = default_codec,
+        trace: Optional[Trace] = None,
         **kwargs,
     ):
         """
         :param args: используются для передачи аргументов команд.
+        :param json_codec: JSON-кодек актуатора (для шаблонов).
+        :param trace: трасса эвента, вызвавшего команду (cba.tracing)
         :param kwargs: используется для передачи аргументов методов классов команд.
         """
         self.inline_buttons = list()
+        self.json_codec = json_codec
         if self.JSON_TMPL_FILE:
-            self.template: dict = load_json_template(self.JSON_TMPL_FILE, self.PATH_TO_FILE)
+            self.template: dict = load_json_template(
+                self.JSON_TMPL_FILE, self.PATH_TO_FILE, json_codec
+            )
         self.target: MessageTarget = target
         self.client_info = client_info
         self.publishers = publishers
         self.id = self._generate_id()
         self.parent_id = parent_id
         self.command_args = command_args
+        self.trace = trace
         log_marker = f"{'='*20} {client_info.name} {'='*20}"
         logger.info(
             "\n%s\nCreated command-instance [%s]\n"
@@ -141,6 +185,8 @@ class BaseCommand(ABC):
             publishers=publishers,
             command_args=command_args,
             parent_id=self.id,
+            json_codec=self.json_codec,
+            trace=self.trace,
             **kwargs,
         )
 
@@ -153,8 +199,14 @@ class BaseCommand(ABC):
         sender_name = self._check_sender_name()
         message = TelegramMessage(str(self.id), self.CMD, sender_name, target=target, **kwargs)
 
+        if self.trace is None:
+            for publisher in self.publishers:
+                await publisher.publish_message(message)
+            return
+        span_id = command_span_id(self.id)
         for publisher in self.publishers:
-            await publisher.publish_message(message)
+            with self.trace.span("publish", span_id, publisher=type(publisher).__name__):
+                await publisher.publish_message(message)
 
     def _check_sender_name(self):
         if self.client_info.hide_name:
@@ -194,7 +246,25 @@ class BaseCommand(ABC):
         обработку пользовательских исключений.
         Пользовательский исключения должны быть подклассом exceptions.UserException
         """
-        return await self._execute()
+        return await self._measured_execute()
+
+    async def _measured_execute(self):
+        """_execute с замером времени и подсчетом ошибок в метриках"""
+        cmd = getattr(self, "CMD", None) or type(self).__name__
+        started = time.perf_counter()
+        try:
+            if self.trace is None:
+                return await self._execute()
+            parent_id = command_span_id(self.parent_id) if self.parent_id else None
+            with self.trace.span("execute", parent_id, command_span_id(self.id), cmd=cmd):
+                return await self._execute()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _COMMAND_ERRORS.labels(cmd).inc()
+            raise
+        finally:
+            _COMMAND_SECONDS.labels(cmd).observe(time.perf_counter() - started)
 
     @classmethod
     def description(cls, client_name):
@@ -215,6 +285,14 @@ class BaseCommand(ABC):
                 return False
         return True
 
+    def cache_key(self) -> tuple:
+        """
+        Ключ кэша ответов (CACHE_TTL). Класс команды различает CMD и behavior.
+        Если ответ зависит от адресата - переопределите метод.
+        """
+        args = self.command_args or {}
+        return type(self), repr(sorted(args.items()))
+
     @staticmethod
     def from_ts(ts):
         return str(datetime.datetime.fromtimestamp(int(ts)))
@@ -284,17 +362,22 @@ class HumanCallableCommandWithArgs(BaseCommand, ABC):
 
     def __getattr__(self, item):
         """Чтобы PyCharm не ругался на отсутствие атрибутов"""
-        return self.__dict__[item]
+        try:
+            return self.__dict__[item]
+        except KeyError:
+            # AttributeError нужен copy и pickle (команды с EXECUTOR = "process")
+            raise AttributeError(item) from None
 
 
 class ServiceCommand(BaseCommand, ABC):
     """Подкласс для определения служебных команд"""
 
     HUMAN_CALLABLE = False
+    PRIORITY = Priority.HIGH
 
     async def execute(self, *args, **kwargs):
         """Служебной команде не к чему вызывать другие служебные"""
-        return await self._execute()
+        return await self._measured_execute()
 
 
 class WrongArguments(ServiceCommand):
@@ -344,6 +427,49 @@ class WrongCommand(ServiceCommand):
         )
 
 
+class Busy(ServiceCommand):
+    """Вызывается автоматически, когда актуатор перегружен и не принимает новые команды.\n"""
+
+    EMOJI = ">>clock<<"
+    CMD = "Busy"
+
+    async def _execute(self):
+        await self.send_message(
+            subject=f"{self.EMOJI} Too many commands!",
+            text="The actuator is busy, try later.",
+        )
+
+
+class Throttled(ServiceCommand):
+    """Вызывается автоматически, когда адресат превысил лимит частоты команд.\n"""
+
+    EMOJI = ">>clock<<"
+    CMD = "Throttled"
+
+    async def _execute(self):
+        await self.send_message(
+            subject=f"{self.EMOJI} Too many requests!",
+            text="Slow down a little and try again.",
+        )
+
+
+class CommandTimeout(ServiceCommand):
+    """Вызывается автоматически, когда команда не уложилась в отведенное время.\n"""
+
+    EMOJI = ">>clock<<"
+    CMD = "CommandTimeout"
+
+    def __init__(self, timeout: float, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+
+    async def _execute(self):
+        await self.send_message(
+            subject=f"{self.EMOJI} The command took too long!",
+            text=f"It was cancelled after {self.timeout:g} seconds, try later.",
+        )
+
+
 class InternalError(ServiceCommand):
     """Вызывается автоматически при нехватке аргументов.\n"""
 
@@ -1,12 +1,12 @@
 import pathlib
-import json
 
 from cba import exceptions
+from cba.codecs import DecodeError, default_codec, JSONCodec
 
 TEMPLATE_DIR = "feedback_templates"  # Папка с шаблонами в пользовательской программе
 
 
-def load_json_template(file_name: str, path_to_file) -> dict:
+def load_json_template(file_name: str, path_to_file, codec: JSONCodec = default_codec) -> dict:
     """
     Для обращений к API используются готовые JSON-шаблоны.
     Файлы с шаблонами должны лежать в директории рядом
@@ -16,8 +16,7 @@ def load_json_template(file_name: str, path_to_file) -> dict:
     path = path.joinpath(TEMPLATE_DIR)
     path = path.joinpath(file_name)
     try:
-        with open(str(path), "r", encoding="utf-8") as json_:
-            message_template = json.load(json_)
-    except json.decoder.JSONDecodeError:
+        message_template = codec.loads(path.read_bytes())
+    except DecodeError:
         raise exceptions.BadCommandTemplateException(file_name)
     return message_template
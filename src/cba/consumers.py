@@ -1,18 +1,144 @@
+import aioamqp
 import asyncio
 import httpx
-import json
+import importlib.util
 import logging
+import os
+import random
+import time
 
 from asyncio import Queue
+from collections import deque, namedtuple, OrderedDict
+from typing import Callable, List, Optional, Union
 
+from cba.codecs import DecodeError, default_codec, JSONCodec
 from cba.dispatcher import BaseDispatcherEvent
 from cba.messages import MessageTarget
+from cba.metrics import REGISTRY
+from cba.tracing import Trace, Tracer
 
 
-__all__ = ["SSEConsumer", "SSEEventParser"]
+__all__ = [
+    "AMQPConsumer",
+    "ConnectionStats",
+    "ProcessedEvents",
+    "ReconnectBackoff",
+    "SSEConsumer",
+    "SSEConsumerPool",
+    "SSEEventParser",
+    "SSEStreamParser",
+    "ServerSentEvent",
+    "parse_event",
+]
 
 _LOGGER = logging.getLogger("SSE Consumer")
 
+_BOM = b"\xef\xbb\xbf"
+_COLON = ord(":")
+
+_COMMAND_EVENTS = frozenset(("start", "slave"))
+
+_EVENTS = REGISTRY.counter("cba_consumer_events_total", "Received command events", ("source",))
+_RECONNECTS = REGISTRY.counter(
+    "cba_consumer_reconnects_total", "Reconnect attempts to the event stream", ("source",)
+)
+_CONNECTED = REGISTRY.gauge("cba_consumer_connected", "Event stream is connected", ("source",))
+_LAG = REGISTRY.histogram(
+    "cba_consumer_lag_seconds", "Delivery lag from the server to the actuator", ("source",)
+)
+
+ServerSentEvent = namedtuple("ServerSentEvent", "event, data, id, retry")
+ReconnectIncident = namedtuple("ReconnectIncident", "attempts, time_to_reconnect, downtime")
+
+
+class SSEStreamParser:
+    """
+    Инкрементальный разбор SSE-потока (спецификация WHATWG).
+    Принимает куски байт в том виде, в каком они пришли из сокета,
+    и хранит незавершенные строки и эвенты между вызовами feed().
+    Поддерживаются переводы строк LF, CRLF и CR, поля id/retry и комментарии.
+    """
+
+    def __init__(self, last_event_id: str = ""):
+        self.last_event_id = last_event_id
+        self.retry = None  # Рекомендованная сервером задержка переподключения, мс
+        self.comments = 0  # Полученные комментарии (heartbeat)
+        self._pending = []  # Куски незавершенной строки
+        self._bom_checked = False
+        self._skip_lf = False  # Предыдущая строка закончилась на CR
+        self._event = ""
+        self._id = ""
+        self._data = []
+
+    def feed(self, chunk: bytes) -> List[ServerSentEvent]:
+        """Добавляет кусок потока и возвращает все завершенные эвенты"""
+        if self._skip_lf:
+            self._skip_lf = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+
+        if b"\n" not in chunk and b"\r" not in chunk:
+            # Длинная строка (например, картинка в base64) копится без склеиваний
+            if chunk:
+                self._pending.append(chunk)
+            return []
+
+        if self._pending:
+            self._pending.append(chunk)
+            chunk = b"".join(self._pending)
+            self._pending = []
+
+        if not self._bom_checked:
+            self._bom_checked = True
+            if chunk.startswith(_BOM):
+                chunk = chunk[len(_BOM) :]
+
+        lines = chunk.splitlines(True)  # bytes.splitlines делит только по CR, LF и CRLF
+        last_line_end = lines[-1][-1:]
+        if last_line_end == b"\r":
+            # LF может прийти следующим куском - его нужно будет пропустить
+            self._skip_lf = True
+        elif last_line_end != b"\n":
+            self._pending.append(lines.pop())
+
+        events = []
+        for line in lines:
+            event = self._process_line(line.rstrip(b"\r\n"))
+            if event is not None:
+                events.append(event)
+        return events
+
+    def _process_line(self, line: bytes) -> Optional[ServerSentEvent]:
+        if not line:
+            return self._dispatch()
+        if line[0] == _COLON:
+            self.comments += 1  # Комментарий (в т.ч. heartbeat)
+            return None
+
+        field, _, value = line.partition(b":")
+        if value[:1] == b" ":
+            value = value[1:]
+
+        if field == b"data":
+            self._data.append(value)  # Данные остаются в байтах до JSON-декодера
+        elif field == b"event":
+            self._event = value.decode("utf-8", errors="replace")
+        elif field == b"id":
+            if b"\0" not in value:
+                self._id = self.last_event_id = value.decode("utf-8", errors="replace")
+        elif field == b"retry":
+            if value.isdigit():
+                self.retry = int(value)
+        return None
+
+    def _dispatch(self):
+        data, event, event_id = self._data, self._event, self._id
+        self._data, self._event, self._id = [], "", ""
+        if not data:
+            return None
+        # В эвент попадает только его собственный id, без унаследованного от предыдущих
+        return ServerSentEvent(event or "message", b"\n".join(data), event_id, self.retry)
+
 
 class SSEEventParser:
     """
@@ -20,7 +146,10 @@ class SSEEventParser:
     SSE-эвентов к единому виду.
     """
 
+    __slots__ = ("event", "data", "id", "retry")
+
     def __init__(self, raw_text_command: str):
+        self.event = self.data = self.id = self.retry = None
 
         raw_data = raw_text_command.rstrip("\r\n\r\n")
         fields = raw_data.split("\r\n")
@@ -28,34 +157,323 @@ class SSEEventParser:
         for field in fields:
             if not field:  # пустая строка
                 continue
-            field_name, field_data = map(lambda x: x.strip(), field.split(":", maxsplit=1))
+            field_name, _, field_data = field.partition(":")
+            field_name, field_data = field_name.strip(), field_data.strip()
             if field_name == "data":
                 field_data = self._parse_data(field_data)
-            setattr(self, field_name, field_data)
+            if field_name in self.__slots__:
+                setattr(self, field_name, field_data)
+
+    @classmethod
+    def from_sse(cls, sse: ServerSentEvent, codec: JSONCodec = default_codec) -> "SSEEventParser":
+        """Создает парсер из эвента, уже разобранного SSEStreamParser"""
+        parsed = cls.__new__(cls)
+        parsed.event = sse.event
+        parsed.data = cls._parse_data(sse.data, codec)
+        parsed.id = sse.id
+        parsed.retry = sse.retry
+        return parsed
 
     def __call__(self, *args, **kwargs) -> BaseDispatcherEvent:
         if self.data and self.event:
-            command = self.data["command"]
-            target = MessageTarget(**self.data["target"])
-            try:
-                args = self.data["args"]
-            except KeyError:
-                args = {}
-            behavior = self.data.get("behavior")
-            return BaseDispatcherEvent(command, target, args, behavior)
+            return _build_event(self.data, self.id or "")
 
     def __getattr__(self, item):
-        return self.__dict__.get(item)
+        if item in self.__slots__:
+            return object.__getattribute__(self, item)
+        return None
 
     @staticmethod
-    def _parse_data(data: str) -> [dict, str]:
+    def _parse_data(data: Union[bytes, str], codec: JSONCodec = default_codec) -> [dict, str]:
         try:
-            dict_data = json.loads(data)
-        except json.JSONDecodeError:
+            dict_data = codec.loads(data)
+        except DecodeError:
+            if isinstance(data, bytes):
+                return data.decode("utf-8", errors="replace")
             return data
         return dict_data
 
 
+def parse_event(
+    sse: ServerSentEvent, codec: JSONCodec = default_codec
+) -> Optional[BaseDispatcherEvent]:
+    """
+    Прямой путь от SSE-эвента к BaseDispatcherEvent без промежуточного SSEEventParser.
+    Возвращает None для эвентов, не являющихся командами.
+    """
+    if sse.event not in _COMMAND_EVENTS:
+        return None
+    try:
+        data = codec.loads(sse.data)
+    except DecodeError:
+        _LOGGER.warning("Get event with not JSON data: %s", sse.data)
+        return None
+    return _build_event(data, sse.id)
+
+
+def _build_event(data: dict, event_id: str) -> BaseDispatcherEvent:
+    target = data["target"]
+    return BaseDispatcherEvent(
+        data["command"],
+        MessageTarget(target["target_type"], target["target_name"], target.get("message_id")),
+        data.get("args", {}),
+        data.get("behavior"),
+        event_id,
+        data.get("ts"),
+    )
+
+
+def _server_time(server_ts: float) -> float:
+    """Метка времени сервера (unix time в секундах или миллисекундах) в секундах"""
+    if server_ts > 1e11:
+        server_ts /= 1000
+    return server_ts
+
+
+def _server_lag(server_ts: float) -> float:
+    """Задержка доставки по метке времени сервера"""
+    return time.time() - _server_time(server_ts)
+
+
+def _trace_event(trace: Optional[Trace], event: BaseDispatcherEvent, parse_started: float):
+    """Привязывает трассу к разобранному эвенту: этапы доставки и разбора"""
+    if trace is None:
+        return
+    trace.started = parse_started
+    trace.queued_at = time.time()
+    if event.ts:
+        trace.add_span("delivery", _server_time(event.ts), parse_started)
+    trace.add_span("parse", parse_started, trace.queued_at)
+    event.trace = trace
+
+
+class ProcessedEvents:
+    """
+    Ограниченный LRU идентификаторов уже обработанных эвентов.
+    Может сохраняться в файл, чтобы переживать перезапуски актуатора.
+    Внутри event loop id дописываются в файл пачками раз в flush_interval секунд.
+    """
+
+    def __init__(
+        self, limit: int = 1000, file_name: Optional[str] = None, flush_interval: float = 1.0
+    ):
+        """
+        :param flush_interval: как часто дописывать новые id в файл. При падении процесса
+            id за последний интервал теряются, и эти эвенты могут быть выполнены повторно
+        """
+        self.limit = limit
+        self.file_name = file_name
+        self.flush_interval = flush_interval
+        self._ids = OrderedDict()
+        self._file_records = 0
+        self._file = None
+        self._pending: List[str] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        if file_name:
+            self._load()
+
+    def __contains__(self, event_id: str) -> bool:
+        return event_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def last(self) -> str:
+        """Последний обработанный эвент"""
+        return next(reversed(self._ids), "")
+
+    def add(self, event_id: str):
+        self._ids[event_id] = None
+        self._ids.move_to_end(event_id)
+        while len(self._ids) > self.limit:
+            self._ids.popitem(last=False)
+        if self.file_name:
+            self._pending.append(event_id)
+            self._flush_soon()
+
+    def _load(self):
+        if not os.path.exists(self.file_name):
+            return
+        with open(self.file_name, "r", encoding="utf-8") as file:
+            for line in file:
+                event_id = line.rstrip("\n")
+                if event_id:
+                    self._ids[event_id] = None
+                    self._ids.move_to_end(event_id)
+                    self._file_records += 1
+        while len(self._ids) > self.limit:
+            self._ids.popitem(last=False)
+
+    def _flush_soon(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop отложить запись некуда
+            self.flush()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self.flush()
+
+    def flush(self):
+        """Дописывает накопленные id в файл"""
+        if not self._pending:
+            return
+        if self._file_records + len(self._pending) >= 2 * self.limit:
+            # Файл только дописывается - периодически сжимаем его до содержимого LRU
+            self._close_file()
+            with open(self.file_name, "w", encoding="utf-8") as file:
+                file.writelines(f"{id_}\n" for id_ in self._ids)
+            self._file_records = len(self._ids)
+        else:
+            if self._file is None:
+                self._file = open(self.file_name, "a", encoding="utf-8")
+            self._file.write("".join(f"{id_}\n" for id_ in self._pending))
+            self._file.flush()
+            self._file_records += len(self._pending)
+        self._pending = []
+
+    async def close(self):
+        """Записывает оставшиеся id и закрывает файл"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        self.flush()
+        self._close_file()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ReconnectBackoff:
+    """
+    Экспоненциальная задержка переподключения со случайным разбросом.
+    Первая попытка делается почти сразу, чтобы переживать перезапуск бота без простоя,
+    а разброс не дает множеству актуаторов переподключаться одновременно.
+    """
+
+    def __init__(
+        self,
+        first_delay: float = 0.5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        factor: float = 2.0,
+        jitter: float = 0.5,
+    ):
+        """
+        :param first_delay: максимальная задержка первой попытки
+        :param base_delay: задержка второй попытки, дальше растет в factor раз
+        :param max_delay: верхняя граница задержки
+        :param factor: множитель роста задержки
+        :param jitter: доля задержки, на которую она может быть случайно уменьшена
+        """
+        self.first_delay = first_delay
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+
+    def delay(self, attempt: int, base_delay: Optional[float] = None) -> float:
+        """
+        :param attempt: номер попытки переподключения, начиная с 0
+        :param base_delay: переопределяет base_delay (например, полем retry от сервера)
+        """
+        if attempt == 0:
+            return random.uniform(0, self.first_delay)
+        if base_delay is None:
+            base_delay = self.base_delay
+        delay = min(self.max_delay, base_delay * self.factor ** (attempt - 1))
+        return delay * random.uniform(1 - self.jitter, 1)
+
+
+class ConnectionStats:
+    """Счетчики переподключений к потоку событий и задержки доставки эвентов"""
+
+    def __init__(self, history: int = 100, lag_smoothing: float = 0.1, source: str = ""):
+        """
+        :param history: сколько последних инцидентов хранить
+        :param lag_smoothing: вес нового значения в скользящем среднем задержки
+        :param source: метка потока в метриках (адрес или очередь)
+        """
+        self.source = source
+        self.events = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.reconnect_attempts = 0
+        self.stalls = 0  # Переподключения по сторожевому таймеру
+        self.heartbeats = 0
+        self.total_downtime = 0.0
+        self.incidents = deque(maxlen=history)
+        self.last_lag = None  # Задержка сервер -> актуатор, с
+        self.max_lag = 0.0
+        self.avg_lag = None
+        self._lag_smoothing = lag_smoothing
+        self._down_since = None
+        self._first_attempt_at = None
+        self._incident_attempts = 0
+        self._events_metric = _EVENTS.labels(source)
+        self._reconnects_metric = _RECONNECTS.labels(source)
+        self._connected_metric = _CONNECTED.labels(source)
+        self._lag_metric = _LAG.labels(source)
+
+    @property
+    def connected(self) -> bool:
+        return self.connects > 0 and self._down_since is None
+
+    @property
+    def last_incident(self) -> Optional[ReconnectIncident]:
+        return self.incidents[-1] if self.incidents else None
+
+    def on_connected(self):
+        self.connects += 1
+        self._connected_metric.set(1)
+        if self._down_since is None:
+            return
+        now = time.monotonic()
+        incident = ReconnectIncident(
+            attempts=self._incident_attempts,
+            time_to_reconnect=now - (self._first_attempt_at or self._down_since),
+            downtime=now - self._down_since,
+        )
+        self.incidents.append(incident)
+        self.total_downtime += incident.downtime
+        self._down_since = self._first_attempt_at = None
+        self._incident_attempts = 0
+
+    def on_disconnected(self):
+        self._connected_metric.set(0)
+        if self._down_since is None:
+            self.disconnects += 1
+            self._down_since = time.monotonic()
+
+    def on_reconnect_attempt(self):
+        self.reconnect_attempts += 1
+        self._reconnects_metric.inc()
+        self._incident_attempts += 1
+        if self._first_attempt_at is None:
+            self._first_attempt_at = time.monotonic()
+
+    def on_event(self):
+        self.events += 1
+        self._events_metric.inc()
+
+    def on_lag(self, lag: float):
+        self.last_lag = lag
+        self._lag_metric.observe(lag)
+        if lag > self.max_lag:
+            self.max_lag = lag
+        if self.avg_lag is None:
+            self.avg_lag = lag
+        else:
+            self.avg_lag += self._lag_smoothing * (lag - self.avg_lag)
+
+
 class SSEConsumer:
 
     """
@@ -63,40 +481,406 @@ class SSEConsumer:
     Вызывает команды обратной связи.
     """
 
-    def __init__(self, sse_url: str):
+    def __init__(
+        self,
+        sse_url: str,
+        *,
+        processed_events_limit: int = 1000,
+        processed_events_file: Optional[str] = None,
+        client: Optional[httpx.AsyncClient] = None,
+        backoff: Optional[ReconnectBackoff] = None,
+        codec: JSONCodec = default_codec,
+        stall_timeout: float = 35.0,
+        connect_timeout: float = 10.0,
+    ):
+        """
+        :param sse_url: адрес SSE-потока
+        :param processed_events_limit: сколько id обработанных эвентов помнить
+        :param processed_events_file: файл для сохранения id обработанных эвентов
+        :param client: HTTP-клиент. По-умолчанию создается один на все время работы
+        :param backoff: стратегия задержек переподключения
+        :param codec: JSON-кодек для данных эвентов
+        :param stall_timeout: через сколько секунд без данных (включая heartbeat)
+            поток считается зависшим и переоткрывается. Бот шлет heartbeat каждые 30 с
+        :param connect_timeout: таймаут установки соединения
+        """
         self.url = sse_url
+        self.stall_timeout = stall_timeout
+        self.connect_timeout = connect_timeout
+        self.last_byte_at = None  # time.monotonic() последних полученных данных
+        self.last_event_at = None  # time.monotonic() последнего эвента-команды
+        self._idle_since = None  # С какого момента ждем данные из сети
+        self.codec = codec
+        self.backoff = backoff if backoff else ReconnectBackoff()
+        self.stats = ConnectionStats(source=sse_url)
+        self.tracer: Optional[Tracer] = None  # Задается актуатором
+        self._client = client
+        self._own_client = client is None
+        self._server_retry = None  # Задержка переподключения, присланная сервером, мс
+        self._stopping = False
+        self.processed_events = ProcessedEvents(processed_events_limit, processed_events_file)
+        # При переподключении сервер продолжит поток с этого места
+        self.last_event_id = self.processed_events.last
 
-    @staticmethod
-    async def callback(command: str, queue: Queue):
+    async def callback(self, command: ServerSentEvent, queue: Queue):
         """Парсит эвент и кладет в очерель в случае успеха"""
-        raw_event = SSEEventParser(command)
+        event_id = command.id
+        if event_id and event_id in self.processed_events:
+            _LOGGER.info("Skip already processed event: %s", event_id)
+            return
+
+        trace = self.tracer.start_trace() if self.tracer is not None else None
+        parse_started = time.time()
+        event = parse_event(command, self.codec)
+        if event is not None:
+            _trace_event(trace, event, parse_started)
+            _LOGGER.info("Get Event: %s %s", command.event, event)
+            self.last_event_at = time.monotonic()
+            self.stats.on_event()
+            if event.ts:
+                self._measure_lag(event.ts)
+            await queue.put(event)
+
+        if event_id:
+            self.processed_events.add(event_id)
+            self.last_event_id = event_id
+
+    def _measure_lag(self, server_ts: float):
+        self.stats.on_lag(_server_lag(server_ts))
+
+    @property
+    def seconds_since_last_byte(self) -> Optional[float]:
+        if self.last_byte_at is None:
+            return None
+        return time.monotonic() - self.last_byte_at
+
+    @property
+    def seconds_since_last_event(self) -> Optional[float]:
+        if self.last_event_at is None:
+            return None
+        return time.monotonic() - self.last_event_at
+
+    def _request_headers(self) -> dict:
+        if self.last_event_id:
+            return {"Last-Event-ID": self.last_event_id}
+        return {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5)
+            )
+        return self._client
+
+    async def stop(self):
+        """Перестает принимать эвенты. Поток закрывается отменой задачи listen()"""
+        self._stopping = True
 
-        if raw_event.event in ("start", "slave"):
-            _LOGGER.info("Get Event: %s %s", raw_event.event, raw_event.data)
-            await queue.put(raw_event())  # Put BaseDispatcherEvent into queue
+    async def close(self):
+        """Сохраняет обработанные эвенты и закрывает свой HTTP-клиент"""
+        await self.processed_events.close()
+        if self._own_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def listen(self, events_queue: Queue):
 
+        attempt = 0
         while 1:
             try:
-                async with httpx.AsyncClient() as client:
-                    async with client.stream(
-                        method="GET", url=self.url, timeout=35
-                    ) as stream:  # heartbeat every 30s
-                        stream.raise_for_status()
-                        _LOGGER.info("Connected to SSE on %s", self.url)
-
-                        async for message in stream.aiter_text():
-                            _LOGGER.debug("Get data from stream: %s", message)
-                            events = message.split("\r\n\r\n")
-                            for event in events:
-                                if event:
-                                    await self.callback(event, events_queue)
-            except (httpx.RemoteProtocolError, httpx.ConnectError, httpx.ReadError) as err:
+                async with self.client.stream(
+                    method="GET",
+                    url=self.url,
+                    headers=self._request_headers(),
+                    # Зависший поток обнаруживает сторожевой таймер, а не таймаут чтения
+                    timeout=httpx.Timeout(self.connect_timeout, read=None),
+                ) as stream:
+                    stream.raise_for_status()
+                    self.stats.on_connected()
+                    attempt = 0
+                    _LOGGER.info(
+                        "Connected to SSE on %s (Last-Event-ID: %s)",
+                        self.url,
+                        self.last_event_id,
+                    )
+                    await self._read_with_watchdog(stream, events_queue)
+            except httpx.TimeoutException:
+                _LOGGER.warning("SSE connect timeout!")
+            except (httpx.TransportError, httpx.HTTPStatusError) as err:
                 # I can't connect or the bot fell off
                 _LOGGER.error(*err.args)
-                await asyncio.sleep(20)
-            except httpx.TimeoutException:
-                _LOGGER.warning("Heartbeat waiting timeout!")
+
+            self.stats.on_disconnected()
+            if self._stopping:
+                return
+            delay = self.backoff.delay(attempt, self._retry_delay())
+            attempt += 1
+            _LOGGER.info("Reconnecting in %.2f s...", delay)
+            await asyncio.sleep(delay)
+            self.stats.on_reconnect_attempt()
+
+    async def _read_with_watchdog(self, stream: httpx.Response, events_queue: Queue):
+        reader = asyncio.ensure_future(self._read_stream(stream, events_queue))
+        watchdog = asyncio.ensure_future(self._watchdog())
+        try:
+            await asyncio.wait((reader, watchdog), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            reader.cancel()
+            watchdog.cancel()
+        if reader.done() and not reader.cancelled():
+            reader.result()  # Пробрасываем ошибки чтения
+        elif watchdog.done():
+            self.stats.stalls += 1
+            _LOGGER.warning(
+                "No data from SSE on %s for %.1f s, reconnecting", self.url, self.stall_timeout
+            )
+
+    async def _read_stream(self, stream: httpx.Response, events_queue: Queue):
+        parser = SSEStreamParser(self.last_event_id)
+        self._idle_since = time.monotonic()
+        try:
+            async for chunk in stream.aiter_bytes():
+                self.last_byte_at = time.monotonic()
+                _LOGGER.debug("Get data from stream: %s", chunk)
+                self._idle_since = None  # Ожидание места в очереди - не зависание потока
+                comments = parser.comments
+                for event in parser.feed(chunk):
+                    await self.callback(event, events_queue)
+                self.stats.heartbeats += parser.comments - comments
+                self._idle_since = time.monotonic()
+        finally:
+            self._server_retry = parser.retry
+
+    async def _watchdog(self):
+        """Завершается, если поток молчит дольше stall_timeout"""
+        while 1:
+            idle_since = self._idle_since
+            if idle_since is None:
+                timeout = self.stall_timeout
+            else:
+                timeout = idle_since + self.stall_timeout - time.monotonic()
+                if timeout <= 0:
+                    return
+            await asyncio.sleep(timeout)
+
+    def _retry_delay(self) -> Optional[float]:
+        if self._server_retry is None:
+            return None
+        return self._server_retry / 1000
+
+
+class SSEConsumerPool:
+    """
+    Общий пул соединений для потоков событий нескольких актуаторов в одном процессе.
+    Каждый актуатор получает свой SSEConsumer (и свою очередь эвентов для своего диспетчера),
+    но все они работают через один HTTP-клиент. Если установлен h2, используется HTTP/2,
+    и все потоки мультиплексируются в одном TCP-соединении.
+    """
+
+    def __init__(
+        self,
+        url_template: str = "",
+        *,
+        http2: Optional[bool] = None,
+        max_connections: int = 100,
+        client: Optional[httpx.AsyncClient] = None,
+        **consumer_kwargs,
+    ):
+        """
+        :param url_template: шаблон адреса потока, например "http://localhost:8081/sse/{}/events"
+        :param http2: использовать HTTP/2. По-умолчанию - если установлен пакет h2
+        :param max_connections: размер пула. Для HTTP/1.1 каждый поток занимает соединение
+        :param client: готовый HTTP-клиент вместо создаваемого пулом
+        :param consumer_kwargs: параметры для создаваемых SSEConsumer
+        """
+        if http2 is None:
+            http2 = importlib.util.find_spec("h2") is not None
+        self.url_template = url_template
+        self.http2 = http2
+        self.consumers = []
+        self._consumer_kwargs = consumer_kwargs
+        self._own_client = client is None
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=max_connections, max_keepalive_connections=max_connections
+                ),
+            )
+        self.client = client
+
+    def consumer(self, name: str = "", *, sse_url: str = "", **kwargs) -> SSEConsumer:
+        """
+        Создает консьюмер на общем клиенте.
+        :param name: имя актуатора для подстановки в url_template
+        :param sse_url: полный адрес потока (вместо url_template)
+        """
+        if not sse_url:
+            sse_url = self.url_template.format(name)
+        consumer_kwargs = dict(self._consumer_kwargs, **kwargs)
+        consumer = SSEConsumer(sse_url, client=self.client, **consumer_kwargs)
+        self.consumers.append(consumer)
+        return consumer
+
+    async def close(self):
+        if self._own_client:
+            await self.client.aclose()
+
+
+class AMQPConsumer:
+    """
+    Получает команды напрямую из очереди RabbitMQ.
+    Сообщения имеют тот же формат, что и data SSE-эвентов.
+    Сообщение подтверждается (ack) только после выполнения команды диспетчером,
+    поэтому несколько реплик актуатора могут делить одну очередь,
+    а невыполненные из-за падения команды будут доставлены повторно.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: Optional[int] = None,
+        *,
+        login: str = "guest",
+        pwd: str = "guest",
+        queue: str,
+        virtualhost: str = "/",
+        prefetch_count: int = 10,
+        durable: bool = True,
+        backoff: Optional[ReconnectBackoff] = None,
+        codec: JSONCodec = default_codec,
+        connect: Callable = aioamqp.connect,
+    ):
+        """
+        :param queue: очередь с командами
+        :param prefetch_count: сколько неподтвержденных сообщений может быть в работе
+        :param durable: объявлять очередь устойчивой к перезапуску брокера
+        :param connect: функция подключения (aioamqp.connect или тестовая замена)
+        """
+        self.host = host
+        self.port = port
+        self.login = login
+        self.password = pwd
+        self.queue = queue
+        self.virtualhost = virtualhost
+        self.prefetch_count = prefetch_count
+        self.durable = durable
+        self.backoff = backoff if backoff else ReconnectBackoff()
+        self.codec = codec
+        self.stats = ConnectionStats(source=f"amqp://{host}/{queue}")
+        self.tracer: Optional[Tracer] = None  # Задается актуатором
+        self._connect = connect
+        self._protocol = None
+        self._transport = None
+        self._channel = None
+        self._consumer_tag = None
+        self._stopping = False
+
+    async def listen(self, events_queue: Queue):
+
+        attempt = 0
+        while 1:
+            try:
+                await self._consume(events_queue)
+                self.stats.on_connected()
+                attempt = 0
+                _LOGGER.info("Consuming AMQP queue %s", self.queue)
+                await self._protocol.wait_closed()
+                _LOGGER.warning("AMQP connection closed")
+            except (aioamqp.AioamqpException, OSError) as err:
+                _LOGGER.error("AMQP error: %r", err)
             finally:
-                _LOGGER.info("Reconnecting...")
+                # При остановке соединение нужно, чтобы подтвердить выполняющиеся команды
+                if not self._stopping:
+                    await self._close_connection()
+
+            self.stats.on_disconnected()
+            if self._stopping:
+                return
+            delay = self.backoff.delay(attempt)
+            attempt += 1
+            _LOGGER.info("Reconnecting in %.2f s...", delay)
+            await asyncio.sleep(delay)
+            self.stats.on_reconnect_attempt()
+
+    async def stop(self):
+        """Перестает получать сообщения, но оставляет соединение для ack выполняющихся команд"""
+        self._stopping = True
+        if self._channel is not None and self._consumer_tag is not None:
+            try:
+                await self._channel.basic_cancel(self._consumer_tag)
+            except aioamqp.AioamqpException:
+                pass
+
+    async def close(self):
+        await self._close_connection()
+
+    async def _consume(self, events_queue: Queue):
+        self._transport, self._protocol = await self._connect(
+            self.host,
+            self.port,
+            login=self.login,
+            password=self.password,
+            virtualhost=self.virtualhost,
+            login_method="PLAIN",
+        )
+        channel = await self._protocol.channel()
+        await channel.basic_qos(prefetch_count=self.prefetch_count)
+        await channel.queue_declare(self.queue, durable=self.durable)
+
+        async def callback(channel_, body: bytes, envelope, properties):
+            await self.callback(channel_, body, envelope, properties, events_queue)
+
+        consumer = await channel.basic_consume(callback, queue_name=self.queue)
+        self._channel, self._consumer_tag = channel, consumer["consumer_tag"]
+
+    async def callback(self, channel, body: bytes, envelope, properties, queue: Queue):
+        """Парсит сообщение и кладет эвент в очередь, ack - после выполнения команды"""
+        delivery_tag = envelope.delivery_tag
+        trace = self.tracer.start_trace() if self.tracer is not None else None
+        parse_started = time.time()
+        try:
+            data = self.codec.loads(body)
+            event = _build_event(data, getattr(properties, "message_id", None) or "")
+        except (DecodeError, KeyError, TypeError, AssertionError):
+            _LOGGER.warning("Get bad AMQP message, drop it: %s", body)
+            await channel.basic_reject(delivery_tag, requeue=False)
+            return
+
+        _trace_event(trace, event, parse_started)
+        self.stats.on_event()
+        if event.ts:
+            self.stats.on_lag(_server_lag(event.ts))
+
+        async def ack():
+            try:
+                await channel.basic_client_ack(delivery_tag)
+            except aioamqp.AioamqpException:
+                # Соединение уже закрыто - брокер доставит сообщение повторно
+                _LOGGER.warning("Can't ack AMQP message %s", delivery_tag)
+
+        async def nack(requeue: bool):
+            # Повторно доставленное сообщение не возвращается еще раз: оно может
+            # ронять обработчик, и без этого доставлялось бы бесконечно
+            requeue = requeue and not envelope.is_redeliver
+            try:
+                await channel.basic_client_nack(delivery_tag, requeue=requeue)
+            except aioamqp.AioamqpException:
+                _LOGGER.warning("Can't nack AMQP message %s", delivery_tag)
+
+        event.ack = ack
+        event.nack = nack
+        _LOGGER.info("Get AMQP event: %s", event)
+        await queue.put(event)
+
+    async def _close_connection(self):
+        protocol, transport = self._protocol, self._transport
+        self._protocol = self._transport = self._channel = self._consumer_tag = None
+        if protocol is not None:
+            try:
+                await protocol.close()
+            except (aioamqp.AioamqpException, OSError):
+                pass
+        if transport is not None:
+            transport.close()
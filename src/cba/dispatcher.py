@@ -1,20 +1,53 @@
 import asyncio
+import functools
+import hashlib
+import json
 import logging
+import time
+from collections import Counter, deque
 from enum import Enum
-from typing import Iterable, List, Type, Union
+from typing import (
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 
 from cba import commands, exceptions
+from cba.caching import ResultCache, SingleFlight
+from cba.codecs import default_codec
+from cba.executors import CommandExecutors
 from cba.commands import BaseCommand, hide, HumanCallableCommandWithArgs
-from cba.messages import MessageTarget
+from cba.messages import MessageTarget, TelegramMessage
+from cba.metrics import REGISTRY
 from cba.publishers import BasePublisher
 from cba.helpers import ClientInfo
+from cba.throttling import RateLimiter
+from cba.tracing import Trace, Tracer
 
 
-__all__ = ["BaseDispatcherEvent", "CommandsDispatcher"]
+__all__ = ["BaseDispatcherEvent", "CommandsDispatcher", "Handler", "Middleware"]
 
 _INTRO_COMMAND = "getAvailableMethods"
 _LOGGER = logging.getLogger(__name__)
 
+_DISPATCH_SECONDS = REGISTRY.histogram(
+    "cba_dispatch_seconds", "Event dispatch time, including execution", ("cmd", "behavior")
+)
+_DISPATCH_ERRORS = REGISTRY.counter(
+    "cba_dispatch_errors_total", "Events failed with an exception", ("cmd", "behavior")
+)
+_THROTTLED = REGISTRY.counter("cba_throttled_total", "Events rejected by rate limits", ("scope",))
+_TIMEOUTS = REGISTRY.counter(
+    "cba_command_timeouts_total", "Commands cancelled by the deadline", ("cmd",)
+)
+
 
 class Behaviors(Enum):
     USER = "user"
@@ -27,40 +60,152 @@ class BaseDispatcherEvent:
     соответствовать протоколу данного класса
     """
 
-    def __init__(self, command: str, target: MessageTarget, args: dict, behavior: str):
+    __slots__ = ("command", "target", "args", "behavior", "id", "ts", "ack", "nack", "trace")
+
+    def __init__(
+        self,
+        command: str,
+        target: MessageTarget,
+        args: dict,
+        behavior: str,
+        id_: str = "",
+        ts: Optional[float] = None,
+    ):
         assert target.target_type in ("user", "channel", "service")
-        self._command = command
-        self._target = target
-        self._args = args
-        self._behavior = behavior
+        self.command = command
+        self.target = target
+        self.args = args
+        self.behavior = behavior
+        self.id = id_  # id SSE-эвента (если был)
+        self.ts = ts  # Время отправки эвента сервером (unix time), если сервер его передал
+        # Корутина-функция подтверждения обработки (например, ack сообщения AMQP)
+        self.ack: Optional[Callable[[], Awaitable]] = None
+        # Корутина-функция отказа от эвента: nack(requeue) - вернуть источнику для повторной
+        # доставки (requeue=True) или выбросить (например, nack сообщения AMQP)
+        self.nack: Optional[Callable[[bool], Awaitable]] = None
+        self.trace: Optional[Trace] = None  # Трасса эвента, если он трассируется (cba.tracing)
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} {self.command} "
+            f"target={tuple(self.target)} behavior={self.behavior} args={self.args}>"
+        )
 
-    @property
-    def command(self) -> str:
-        return self._command
 
-    @property
-    def target(self) -> MessageTarget:
-        return self._target
+# Обработчик эвента и middleware: async (event, call_next) -> результат.
+# Вместо вызова call_next middleware может вернуть TelegramMessage или служебную команду
+Handler = Callable[[BaseDispatcherEvent], Awaitable]
+Middleware = Callable[[BaseDispatcherEvent, Handler], Awaitable]
 
-    @property
-    def args(self) -> dict:
-        return self._args
 
-    @property
-    def behavior(self) -> str:
-        return self._behavior
+def _is_response(result) -> bool:
+    """Результат middleware - ответ адресату вместо выполнения команды эвента"""
+    if isinstance(result, (TelegramMessage, BaseCommand)):
+        return True
+    return isinstance(result, type) and issubclass(result, BaseCommand)
+
+
+def _record_dispatch(cmd: Optional[BaseCommand], behavior: str, seconds: float, failed: bool):
+    # Метки - только из конечных множеств: CMD зарегистрированных команд и двух поведений
+    labels = (
+        cmd.CMD if cmd is not None else "unknown",
+        Behaviors.ADMIN.value if behavior == Behaviors.ADMIN.value else Behaviors.USER.value,
+    )
+    _DISPATCH_SECONDS.labels(*labels).observe(seconds)
+    if failed:
+        _DISPATCH_ERRORS.labels(*labels).inc()
 
 
 class CommandsDispatcher:
     """После получения команды из telegram возвращает соотвествующий инстанс"""
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        ordered_targets: bool = False,
+        executors: Optional[CommandExecutors] = None,
+        command_timeout: Optional[float] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        result_cache: Optional[ResultCache] = None,
+        coalesce: bool = False,
+        tracer: Optional[Tracer] = None,
+        middlewares: Iterable[Middleware] = (),
+    ):
+        """
+        :param max_concurrency: сколько команд может выполняться одновременно.
+            None - без ограничения, остальные эвенты ждут свободного места в очереди
+        :param ordered_targets: выполнять эвенты одного адресата строго по очереди
+            (разные адресаты по-прежнему выполняются параллельно)
+        :param executors: пулы для команд с EXECUTOR ("thread" или "process")
+        :param command_timeout: сколько секунд дается командам без своего TIMEOUT
+        :param rate_limiter: ограничение частоты команд (проверяется до создания команды)
+        :param result_cache: кэш ответов команд с CACHE_TTL
+        :param coalesce: объединять одинаковые одновременные команды (если в команде нет COALESCE)
+        :param tracer: экспорт трасс эвентов, у которых консьюмер начал трассу (cba.tracing)
+        :param middlewares: middleware вокруг выполнения эвентов, от внешнего к внутреннему
+        """
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be positive")
         self.client_info = None
         self.callable_commands = list()
         self.service_commands = [
             Introduce,
         ]
+        # Индекс CMD -> класс команды и кэш (CMD, behavior) -> класс с учетом behavior__admin
+        self._commands = {Introduce.CMD: Introduce}
+        self._resolved = {}
+        self._resolved_version = BaseCommand.catalog_version
+        # Описание команд для Introduce: (от чего зависит, описание, версия)
+        self._registry_version = 0
+        self._catalog: Optional[Tuple[tuple, dict, str]] = None
         self.publishers = list()
+        self.json_codec = default_codec
+        self.max_concurrency = max_concurrency
+        self.ordered_targets = ordered_targets
+        self.executors = executors if executors is not None else CommandExecutors()
+        self.command_timeout = command_timeout
+        self.timeouts = Counter()  # CMD -> сколько раз команда была прервана по таймауту
+        self.middlewares: List[Middleware] = list(middlewares)
+        # Цепочка middleware собирается при первом эвенте и после изменения состава
+        self._chain: Optional[Handler] = None
+        self._rate_limiter = rate_limiter
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self.coalesce = coalesce
+        self.single_flight = SingleFlight()
+        self.tracer = tracer
+        # Сильные ссылки на задачи диспетчера: loop хранит только слабые
+        self._tasks = set()
+        self._running = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._events_queue: Optional[asyncio.Queue] = None
+        # Очереди эвентов по адресатам. Очередь удаляется, как только опустеет
+        self._lanes: Dict[Tuple[str, str], Deque[BaseDispatcherEvent]] = {}
+        self._lanes_backlog = 0
+
+    @property
+    def rate_limiter(self) -> Optional[RateLimiter]:
+        return self._rate_limiter
+
+    @rate_limiter.setter
+    def rate_limiter(self, rate_limiter: Optional[RateLimiter]):
+        self._rate_limiter = rate_limiter
+        self._chain = None  # Лимиты - слой цепочки, он есть только при rate_limiter
+
+    @property
+    def in_flight(self) -> int:
+        """Сколько команд выполняется прямо сейчас"""
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        """Сколько эвентов ждут запуска (в очереди актуатора и в очередях адресатов)"""
+        queued = self._events_queue.qsize() if self._events_queue is not None else 0
+        return queued + self._lanes_backlog
+
+    @property
+    def lanes(self) -> int:
+        """Сколько адресатов сейчас имеют невыполненные эвенты"""
+        return len(self._lanes)
 
     def set_publishers(self, publishers: Union[BasePublisher, List[BasePublisher]]):
         if isinstance(publishers, Iterable):
@@ -72,17 +217,143 @@ class CommandsDispatcher:
         self.client_info = client_info
 
     async def events_reader(self, events_queue: asyncio.Queue):
+        self._events_queue = events_queue
+        if self.max_concurrency is not None and self._slots is None:
+            # Семафор создается внутри loop: в python < 3.10 он привязывается к текущему loop
+            self._slots = asyncio.Semaphore(self.max_concurrency)
         while 1:
-            event = await events_queue.get()
-            asyncio.ensure_future(self.dispatch(event))
+            if self.ordered_targets:
+                # Место под выполнение занимает очередь адресата
+                self._to_lane(await events_queue.get(), events_queue)
+                continue
+
+            if self._slots is not None:
+                # Пока все места заняты, эвенты остаются в очереди и к ним
+                # применяется политика переполнения EventsQueue
+                await self._slots.acquire()
+            try:
+                event = await events_queue.get()
+            except BaseException:
+                if self._slots is not None:
+                    self._slots.release()
+                raise
+            task = self._spawn(self._run_event(event, events_queue))
+            if self._slots is not None:
+                task.add_done_callback(lambda _: self._slots.release())
+
+    async def cancel_pending(self):
+        """Отменяет выполняющиеся команды и ждет завершения отмены"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, coro: Awaitable) -> asyncio.Future:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run_event(self, event: BaseDispatcherEvent, events_queue: asyncio.Queue):
+        self._running += 1
+        try:
+            return await self.process_event(event)
+        finally:
+            self._running -= 1
+            # Эвент считается обработанным только после выполнения команды:
+            # так EventsQueue ограничивает и ожидающие, и выполняющиеся команды
             events_queue.task_done()
 
+    def _to_lane(self, event: BaseDispatcherEvent, events_queue: asyncio.Queue):
+        key = (event.target.target_type, event.target.target_name)
+        self._lanes_backlog += 1
+        lane = self._lanes.get(key)
+        if lane is not None:
+            lane.append(event)
+            return
+        lane = self._lanes[key] = deque((event,))
+        self._spawn(self._run_lane(key, lane, events_queue))
+
+    async def _run_lane(
+        self, key: Tuple[str, str], lane: Deque[BaseDispatcherEvent], events_queue: asyncio.Queue
+    ):
+        """Выполняет эвенты одного адресата по порядку, пока они не закончатся"""
+        try:
+            while lane:
+                if self._slots is not None:
+                    await self._slots.acquire()
+                event = lane.popleft()
+                self._lanes_backlog -= 1
+                try:
+                    await self._run_event(event, events_queue)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    # Ошибка одной команды не должна терять остальные эвенты адресата,
+                    # поэтому сообщаем о ней так же, как о необработанной ошибке задачи
+                    asyncio.get_event_loop().call_exception_handler(
+                        {"message": f"Command failed for {key}", "exception": exc}
+                    )
+                finally:
+                    if self._slots is not None:
+                        self._slots.release()
+        finally:
+            del self._lanes[key]
+            for _ in range(len(lane)):
+                self._lanes_backlog -= 1
+                events_queue.task_done()
+
+    async def process_event(self, event: BaseDispatcherEvent):
+        """Выполняет эвент и подтверждает его обработку источнику"""
+        trace = event.trace
+        if trace is not None:
+            trace.add_span("queue", trace.queued_at, time.time())
+        try:
+            return await self.dispatch(event)
+        except asyncio.CancelledError:
+            # Команда не выполнена - источник должен доставить эвент повторно
+            event.ack = None
+            raise
+        finally:
+            if event.ack is not None:
+                await event.ack()
+            if trace is not None and self.tracer is not None:
+                target = f"{event.target.target_type}/{event.target.target_name}"
+                self.tracer.finish(trace, command=event.command, target=target, event_id=event.id)
+
+    async def reject(self, event: BaseDispatcherEvent):
+        """Сообщить адресату эвента, что актуатор перегружен"""
+        try:
+            await commands.Busy(**self._get_cmd_kwargs(event)).execute()
+        finally:
+            if event.ack is not None:
+                await event.ack()
+
+    async def drop(self, event: BaseDispatcherEvent):
+        """Эвент выброшен из переполненной очереди: источник не должен ждать его выполнения"""
+        try:
+            if event.nack is not None:
+                await event.nack(False)
+            elif event.ack is not None:
+                await event.ack()
+        except Exception:
+            _LOGGER.warning("Can't settle dropped %r", event, exc_info=True)
+
+    def event_priority(self, event: BaseDispatcherEvent) -> int:
+        """Приоритет эвента в очереди: PRIORITY команды, для администратора - не ниже HIGH"""
+        cmd_type = self._find_command(event.command, event.behavior)
+        priority = cmd_type.PRIORITY if cmd_type is not None else commands.Priority.NORMAL
+        if event.behavior == Behaviors.ADMIN.value:
+            priority = max(priority, commands.Priority.HIGH)
+        return priority
+
     def register_callable_command(self, cmd: Type[commands.BaseCommand]):
         """
         Зарегистрировать команду, которую можно будет вызывать через диспетчер из телеграм
         (она попадет в Introduce)
         """
-        self.callable_commands.append(cmd)
+        if self._index_command(cmd):
+            self.callable_commands.append(cmd)
         return cmd
 
     def register_service_command(self, cmd: Type[commands.BaseCommand]):
@@ -91,43 +362,181 @@ class CommandsDispatcher:
         но чат-бот не будет о ней знать
         (она НЕ попадет в Introduce)
         """
-        self.service_commands.append(cmd)
+        if self._index_command(cmd):
+            self.service_commands.append(cmd)
         return cmd
 
-    async def dispatch(self, event: BaseDispatcherEvent):
-        command = event.command
-        cmd_kwargs = {
+    def _index_command(self, cmd: Type[commands.BaseCommand]) -> bool:
+        """Добавляет команду в индекс. False - если эта команда уже зарегистрирована"""
+        cmd_name = getattr(cmd, "CMD", None)
+        if cmd_name is None:
+            # Без CMD команду нельзя вызвать, но регистрацию не запрещаем
+            return cmd not in self.callable_commands and cmd not in self.service_commands
+        registered = self._commands.get(cmd_name)
+        if registered is cmd:
+            return False
+        if registered is not None:
+            raise exceptions.DuplicateCommandError(cmd_name)
+        self._commands[cmd_name] = cmd
+        self._resolved.clear()
+        self._registry_version += 1
+        return True
+
+    def commands_catalog(self) -> Tuple[dict, str]:
+        """
+        Описание команд для Introduce и его версия (хэш содержимого).
+        Пересчитывается только после регистрации команд или изменения их описания.
+        """
+        key = (BaseCommand.catalog_version, self._registry_version, self.client_info)
+        if self._catalog is None or self._catalog[0] != key:
+            catalog = Introduce.describe_commands(self.callable_commands, self.client_info.name)
+            content = json.dumps(catalog, sort_keys=True, ensure_ascii=False).encode("utf-8")
+            self._catalog = (key, catalog, hashlib.sha1(content).hexdigest()[:16])
+        return self._catalog[1], self._catalog[2]
+
+    def _get_cmd_kwargs(self, event: BaseDispatcherEvent) -> dict:
+        return {
             "command_args": event.args,
             "target": event.target,
             "client_info": self.client_info,
             "publishers": self.publishers,
+            "json_codec": self.json_codec,
+            "trace": event.trace,
         }
 
-        if command == _INTRO_COMMAND:
-            cmd_kwargs["commands_"] = self.callable_commands
+    def add_middleware(self, middleware: Middleware) -> Middleware:
+        """
+        Добавляет middleware внутрь уже добавленных. Можно использовать как декоратор.
+        middleware(event, call_next) вызывает call_next(event), чтобы эвент выполнился дальше,
+        или возвращает TelegramMessage или служебную команду (класс или экземпляр) вместо него.
+        """
+        self.middlewares.append(middleware)
+        self._chain = None
+        return middleware
 
+    async def dispatch(self, event: BaseDispatcherEvent):
+        chain = self._chain
+        if chain is None:
+            chain = self._chain = self._compose()
+        return await chain(event)
+
+    def _compose(self) -> Handler:
+        """
+        Собирает цепочку: ошибки -> пользовательские middleware -> лимиты -> выполнение.
+        На каждый эвент - только вызовы слоев, без построения списков
+        """
+        layers = [self._map_errors, *self.middlewares]
+        if self._rate_limiter is not None:
+            layers.append(self._throttle)
+        handler = self._handle
+        for middleware in reversed(layers):
+            handler = self._bind(middleware, handler)
+        return handler
+
+    def _bind(self, middleware: Middleware, call_next: Handler) -> Handler:
+        respond = self._respond
+
+        async def layer(event: BaseDispatcherEvent):
+            result = await middleware(event, call_next)
+            if _is_response(result):
+                return await respond(event, result)
+            return result
+
+        return layer
+
+    async def _respond(self, event: BaseDispatcherEvent, response):
+        """Отправляет ответ middleware адресату эвента. Команда эвента не выполнялась - None"""
+        if isinstance(response, TelegramMessage):
+            for publisher in self.publishers:
+                await publisher.publish_message(response)
+            return None
+        if isinstance(response, type):
+            response = response(**self._get_cmd_kwargs(event))
+        await response.execute()
+        return None
+
+    async def _map_errors(self, event: BaseDispatcherEvent, call_next: Handler):
+        """Middleware: об ошибке выполнения сообщается адресату, после чего она пробрасывается"""
         try:
-            cmd = self._get_command(command, event.behavior, **cmd_kwargs)
-            return await cmd.execute()
+            return await call_next(event)
         # Что ниже - убивает приложение
         except exceptions.BadCommandTemplateException as err:
             # Загрузка шаблонов происходит и до вызова метода execute() у команд
+            cmd_kwargs = self._get_cmd_kwargs(event)
             await commands.BadJSONTemplateCommand(template=err.file_name, **cmd_kwargs).execute()
             raise
         except BaseException as err:
-            await commands.InternalError(err, **cmd_kwargs).execute()
+            await commands.InternalError(err, **self._get_cmd_kwargs(event)).execute()
             raise
 
-    def _get_command(self, command: str, behavior: str, **kwargs) -> BaseCommand:
-        all_commands = self.callable_commands + self.service_commands
+    async def _throttle(self, event: BaseDispatcherEvent, call_next: Handler):
+        """Middleware лимитов частоты. Интроспекция ботом не ограничивается"""
+        if event.command == _INTRO_COMMAND:
+            return await call_next(event)
+        target = (event.target.target_type, event.target.target_name)
+        scope = self._rate_limiter.check(event.command, target)
+        if scope is None:
+            return await call_next(event)
+        _LOGGER.warning("Command %s for %s throttled by %s limit", event.command, target, scope)
+        _THROTTLED.labels(scope).inc()
+        if self._rate_limiter.should_notify(target):
+            return commands.Throttled
+        return None
+
+    async def _handle(self, event: BaseDispatcherEvent):
+        """Последнее звено цепочки: поиск и выполнение команды эвента"""
+        command = event.command
+        cmd_kwargs = self._get_cmd_kwargs(event)
+        if command == _INTRO_COMMAND:
+            cmd_kwargs["commands_"] = self.callable_commands
+            cmd_kwargs["catalog"], cmd_kwargs["commands_version"] = self.commands_catalog()
+
+        cmd = None
+        failed = True
+        started = time.perf_counter()
         try:
-            cmd_type = list(filter(lambda x: x.CMD == command, all_commands))[0]
-        except IndexError:
-            _LOGGER.warning("Get wrong command!", exc_info=True)
-            return commands.WrongCommand(**kwargs)
+            if event.trace is None:
+                cmd = self._get_command(command, event.behavior, **cmd_kwargs)
+            else:
+                with event.trace.span("resolve", command=command):
+                    cmd = self._get_command(command, event.behavior, **cmd_kwargs)
+            result = await self._execute(cmd, cmd_kwargs)
+            failed = False
+            return result
+        finally:
+            _record_dispatch(cmd, event.behavior, time.perf_counter() - started, failed)
+
+    async def _execute(self, cmd: BaseCommand, cmd_kwargs: dict):
+        timeout = cmd.TIMEOUT if cmd.TIMEOUT is not None else self.command_timeout
+        if not timeout:
+            return await self._run(cmd)
+        try:
+            # wait_for отменяет зависшую команду, чтобы ее корутина не висела в памяти
+            return await asyncio.wait_for(self._run(cmd), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts[cmd.CMD] += 1
+            _TIMEOUTS.labels(cmd.CMD).inc()
+            _LOGGER.warning("Command %s timed out after %s seconds", cmd.CMD, timeout)
+            await commands.CommandTimeout(timeout, **cmd_kwargs).execute()
+
+    async def _run(self, cmd: BaseCommand):
+        execute = self.executors.execute
+        if cmd.CACHE_TTL:
+            execute = functools.partial(self.result_cache.run, execute=execute)
+        coalesce = cmd.COALESCE if cmd.COALESCE is not None else self.coalesce
+        if coalesce:
+            result = await self.single_flight.run(cmd, execute)
+        else:
+            result = await execute(cmd)
+        if cmd.INVALIDATES:
+            self.result_cache.invalidate(*cmd.INVALIDATES)
+        return result
 
-        if behavior == Behaviors.ADMIN.value:
-            cmd_type = cmd_type.behavior__admin
+    def _get_command(self, command: str, behavior: str, **kwargs) -> BaseCommand:
+        cmd_type = self._find_command(command, behavior)
+        if cmd_type is None:
+            _LOGGER.warning("Get wrong command: %s", command)
+            return commands.WrongCommand(**kwargs)
 
         try:
             cmd = cmd_type(**kwargs)
@@ -141,6 +550,25 @@ class CommandsDispatcher:
 
         return cmd
 
+    def _find_command(self, command: str, behavior: str) -> Optional[Type[BaseCommand]]:
+        """Класс команды за O(1). Поведение для админа вычисляется один раз на пару"""
+        if self._resolved_version != BaseCommand.catalog_version:
+            self._resolved.clear()
+            self._resolved_version = BaseCommand.catalog_version
+        key = (command, behavior)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+
+        cmd_type = self._commands.get(command)
+        if cmd_type is None:
+            return None  # Неизвестные команды не кэшируем, чтобы кэш не рос
+        if behavior == Behaviors.ADMIN.value and cmd_type.behavior__admin is not None:
+            cmd_type = cmd_type.behavior__admin
+        self._resolved[key] = cmd_type
+        return cmd_type
+
 
 @hide
 class Introduce(commands.BaseCommand):
@@ -148,35 +576,54 @@ class Introduce(commands.BaseCommand):
 
     EMOJI = ">>WARNING<<"
     CMD = _INTRO_COMMAND
+    PRIORITY = commands.Priority.SERVICE
     # TODO: send service description
-    def __init__(self, *args, commands_: list, **kwargs):
+    def __init__(
+        self,
+        *args,
+        commands_: list,
+        catalog: Optional[dict] = None,
+        commands_version: str = "",
+        **kwargs,
+    ):
+        """
+        :param catalog: готовое описание команд (см. CommandsDispatcher.commands_catalog)
+        :param commands_version: хэш описания команд
+        """
         super().__init__(*args, **kwargs)
         self.commands = commands_
+        self.catalog = catalog
+        self.commands_version = commands_version
 
     def collect_commands_to_json(self) -> dict:
+        if self.catalog is not None:
+            return self.catalog
+        return self.describe_commands(self.commands, self.client_info.name)
 
-        commands_dict = {cmd.CMD: self._get_cmd_full_description(cmd) for cmd in self.commands}
-
-        return commands_dict
+    @classmethod
+    def describe_commands(cls, commands_: list, client_name: str) -> dict:
+        return {cmd.CMD: cls._get_cmd_full_description(cmd, client_name) for cmd in commands_}
 
-    def _get_cmd_full_description(self, cmd: Type["BaseCommand"]) -> dict:
+    @classmethod
+    def _get_cmd_full_description(cls, cmd: Type["BaseCommand"], client_name: str) -> dict:
         description = {"hidden": cmd.hidden}
 
         if cmd.admin_only:
-            description["behavior__admin"] = self._get_cmd_behavior(cmd)
+            description["behavior__admin"] = cls._get_cmd_behavior(cmd, client_name)
         elif cmd.behavior__admin:
-            description["behavior__admin"] = self._get_cmd_behavior(cmd.behavior__admin)
-            description["behavior__user"] = self._get_cmd_behavior(cmd)
+            description["behavior__admin"] = cls._get_cmd_behavior(cmd.behavior__admin, client_name)
+            description["behavior__user"] = cls._get_cmd_behavior(cmd, client_name)
         else:
-            description["behavior__user"] = self._get_cmd_behavior(cmd)
+            description["behavior__user"] = cls._get_cmd_behavior(cmd, client_name)
         return description
 
+    @staticmethod
     def _get_cmd_behavior(
-        self, cmd: Type[Union["BaseCommand", "HumanCallableCommandWithArgs"]]
+        cmd: Type[Union["BaseCommand", "HumanCallableCommandWithArgs"]], client_name: str
     ) -> dict:
         return {
             "args": cmd.args_description() if issubclass(cmd, HumanCallableCommandWithArgs) else {},
-            "description": commands.parse_and_paste_emoji(cmd.description(self.client_info.name)),
+            "description": commands.parse_and_paste_emoji(cmd.description(client_name)),
         }
 
     async def _execute(self):
@@ -184,4 +631,5 @@ class Introduce(commands.BaseCommand):
         await self.send_message(
             subject="Introducing commands",
             commands=client_commands,
+            commands_version=self.commands_version or None,
         )
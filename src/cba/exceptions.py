@@ -7,6 +7,12 @@ class BadCommandTemplateException(Exception):
         self.file_name = file_name
 
 
+class DuplicateCommandError(Exception):
+    def __init__(self, cmd: str):
+        super().__init__(f"Command {cmd} is already registered")
+        self.cmd = cmd
+
+
 class NotEnoughArgumentsError(Exception):
     def __init__(self, missing_args: list):
         self.missing_args = missing_args
@@ -0,0 +1,211 @@
+"""
+Выполнение блокирующих и тяжелых команд вне event loop.
+
+Команда выбирает режим атрибутом класса EXECUTOR:
+    None - в event loop актуатора (по-умолчанию);
+    "thread" - в пуле потоков, у каждого потока свой event loop;
+    "process" - в пуле процессов.
+
+В режиме "thread" сообщения команды публикуются из event loop актуатора сразу.
+В режиме "process" команда передается в дочерний процесс без паблишеров,
+а ее сообщения публикуются в актуаторе после завершения команды.
+
+Поток и процесс пула прервать нельзя. Если ожидание команды отменено (например, по TIMEOUT),
+она выполняется до конца, но ее сообщения и результат выбрасываются.
+"""
+
+import asyncio
+import copy
+import logging
+import threading
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict
+
+from cba.messages import TelegramMessage
+from cba.publishers import BasePublisher
+
+
+__all__ = ["CommandExecutors", "ExecutorStats"]
+
+_LOGGER = logging.getLogger(__name__)
+
+THREAD = "thread"
+PROCESS = "process"
+
+_thread_state = threading.local()
+
+
+class ExecutorStats:
+    """Загрузка пула: сколько команд выполняется и сколько ждут свободного воркера"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def busy(self) -> int:
+        return min(self.in_flight, self.workers)
+
+    @property
+    def waiting(self) -> int:
+        return max(0, self.in_flight - self.workers)
+
+    @property
+    def saturation(self) -> float:
+        """Больше 1 - команды стоят в очереди пула"""
+        return self.in_flight / self.workers
+
+    def as_dict(self) -> dict:
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "waiting": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.as_dict()}>"
+
+
+class _LoopPublisher(BasePublisher):
+    """Публикует сообщения команды из потока пула через event loop актуатора"""
+
+    METRICS = False
+
+    def __init__(self, publisher: BasePublisher, loop: asyncio.AbstractEventLoop):
+        self.publisher = publisher
+        self.loop = loop
+        self.cancelled = False  # Команду перестали ждать - ее сообщения больше не нужны
+
+    async def publish_message(self, message: TelegramMessage):
+        future = asyncio.run_coroutine_threadsafe(self._publish(message), self.loop)
+        return await asyncio.wrap_future(future)
+
+    async def _publish(self, message: TelegramMessage):
+        # Проверка в loop актуатора: флаг меняется там же
+        if self.cancelled:
+            _LOGGER.warning("Message of a cancelled thread command is dropped")
+            return None
+        return await self.publisher.publish_message(message)
+
+
+class _OutboxPublisher(BasePublisher):
+    """Копит сообщения команды в дочернем процессе"""
+
+    METRICS = False
+
+    def __init__(self):
+        self.messages = []
+
+    async def publish_message(self, message: TelegramMessage):
+        self.messages.append(message)
+
+
+def _run_in_thread(command):
+    loop = getattr(_thread_state, "loop", None)
+    if loop is None:
+        loop = _thread_state.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop.run_until_complete(command.execute())
+
+
+def _run_in_process(command):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        result = loop.run_until_complete(command.execute())
+    finally:
+        loop.close()
+    spans = command.trace.spans if command.trace is not None else []
+    return result, command.publishers[0].messages, spans
+
+
+class CommandExecutors:
+    """Пулы для команд с EXECUTOR. Пулы создаются при первой такой команде"""
+
+    def __init__(self, thread_workers: int = 4, process_workers: int = 2):
+        """
+        :param thread_workers: размер пула потоков
+        :param process_workers: размер пула процессов
+        """
+        if thread_workers < 1 or process_workers < 1:
+            raise ValueError("Pool size must be positive")
+        self._workers = {THREAD: thread_workers, PROCESS: process_workers}
+        self._pools: Dict[str, Executor] = {}
+        self.stats = {kind: ExecutorStats(workers) for kind, workers in self._workers.items()}
+
+    async def execute(self, command):
+        """Выполняет command.execute() в режиме, заданном EXECUTOR команды"""
+        kind = getattr(command, "EXECUTOR", None)
+        if kind is None:
+            return await command.execute()
+        if kind == THREAD:
+            return await self._execute_in_thread(command)
+        if kind == PROCESS:
+            return await self._execute_in_process(command)
+        raise ValueError(f"Unknown executor {kind!r} of command {command.CMD}")
+
+    async def _execute_in_thread(self, command):
+        loop = asyncio.get_event_loop()
+        # Своя копия команды: после отмены поток продолжает работать с ней,
+        # а настоящие паблишеры команды ему недоступны
+        detached = copy.copy(command)
+        publishers = [_LoopPublisher(publisher, loop) for publisher in command.publishers]
+        detached.publishers = publishers
+        try:
+            return await self._submit(THREAD, _run_in_thread, detached)
+        except asyncio.CancelledError:
+            for publisher in publishers:
+                publisher.cancelled = True
+            raise
+
+    async def _execute_in_process(self, command):
+        # Паблишеры держат соединения и не передаются в другой процесс
+        detached = copy.copy(command)
+        detached.publishers = [_OutboxPublisher()]
+        if command.trace is not None:
+            # Этапы выполнения в дочернем процессе возвращаются вместе с результатом
+            detached.trace = command.trace.detached()
+        result, messages, spans = await self._submit(PROCESS, _run_in_process, detached)
+        if spans:
+            command.trace.spans.extend(spans)
+        for message in messages:
+            for publisher in command.publishers:
+                await publisher.publish_message(message)
+        return result
+
+    async def _submit(self, kind: str, func, command):
+        stats = self.stats[kind]
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            result = await asyncio.get_event_loop().run_in_executor(self._pool(kind), func, command)
+        except BaseException:
+            stats.failed += 1
+            raise
+        finally:
+            stats.in_flight -= 1
+        stats.completed += 1
+        return result
+
+    def _pool(self, kind: str) -> Executor:
+        pool = self._pools.get(kind)
+        if pool is None:
+            workers = self._workers[kind]
+            if kind == THREAD:
+                pool = ThreadPoolExecutor(workers, thread_name_prefix="cba-command")
+            else:
+                pool = ProcessPoolExecutor(workers)
+            self._pools[kind] = pool
+        return pool
+
+    def shutdown(self, wait: bool = True):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait)
+        self._pools.clear()
@@ -1,3 +1,4 @@
+import copy
 import logging
 
 from collections import namedtuple
@@ -45,6 +46,7 @@ class TelegramMessage:
         replies: Optional[Iterable] = None,
         reply_markup: Optional[List[dict]] = None,
         inline_edit_button: bool = False,
+        commands_version: Optional[str] = None,
     ):
         """
         :param _id:                 id команды, инициирующей отправку сообщения
@@ -84,6 +86,7 @@ class TelegramMessage:
                             },
                             "cmd2": ...
                         }
+        :param commands_version:    Версия (хэш) описания команд в commands
         :param replies:             Сообщения, которые выведутся в телеграме как ответы на основное
         :param reply_markup:        Описание inline-buttons под сообщением
         """
@@ -95,6 +98,7 @@ class TelegramMessage:
         self._document = document
         self._issue = issue
         self._commands = commands
+        self._commands_version = commands_version
         self._replies = replies
         self._reply_markup = reply_markup
         self._target = target
@@ -119,6 +123,8 @@ class TelegramMessage:
         if self._commands:
             # Introduce
             payload["commands"] = self._commands
+            if self._commands_version:
+                payload["commands_version"] = self._commands_version
 
         if self._images:
             if len(self._images) == 1:
@@ -151,5 +157,17 @@ class TelegramMessage:
 
         return payload
 
+    @property
+    def target(self) -> MessageTarget:
+        return self._target
+
+    def retarget(self, target: MessageTarget, _id: Optional[str] = None) -> "TelegramMessage":
+        """Копия сообщения для другого адресата (например, ответ из кэша команд)"""
+        message = copy.copy(self)
+        message._target = target
+        if _id is not None:
+            message._id = _id
+        return message
+
     def _build_message(self, subject: str, text: str):
         return build_message(subject, text, self.sender_name)
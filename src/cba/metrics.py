@@ -0,0 +1,403 @@
+"""
+Метрики актуатора в формате Prometheus.
+
+Метрики регистрируются один раз при импорте модулей в общем реестре REGISTRY.
+На горячем пути запись - это поиск дочерней метрики по кортежу меток
+и изменение чисел в заранее выделенных списках, без создания словарей.
+
+Экспорт: REGISTRY.render() или HTTP-сервер MetricsServer (GET /metrics).
+"""
+
+import asyncio
+import logging
+import math
+import time
+
+from bisect import bisect_left
+from collections import namedtuple
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsRegistry",
+    "MetricsServer",
+    "REGISTRY",
+    "DEFAULT_BUCKETS",
+]
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+# Значения метрики для экспорта и передачи между процессами (см. MetricsRegistry.set_remote)
+_Snapshot = namedtuple("_Snapshot", "type, documentation, label_names, upper_bounds, values")
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.upper_bounds: Tuple[float, ...] = ()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.label_names:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values: str):
+        """Дочерняя метрика с этими значениями меток. Ее можно сохранить и переиспользовать"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _value(self, child):
+        raise NotImplementedError
+
+    def reset(self):
+        """Обнуляет значения, сохраняя дочерние метрики (на них есть ссылки)"""
+        for child in list(self._children.values()):
+            child.reset()
+
+    def snapshot(self) -> _Snapshot:
+        values = {labels: self._value(child) for labels, child in list(self._children.items())}
+        return _Snapshot(self.TYPE, self.documentation, self.label_names, self.upper_bounds, values)
+
+
+class _CounterChild:
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def reset(self):
+        self.value = 0
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def _value(self, child):
+        return child.value
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+
+class _GaugeChild:
+
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Значение читается при экспорте - на горячем пути ничего не записывается"""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+    def reset(self):
+        self.value = 0
+
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _value(self, child):
+        return child.get()
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def remove(self, *values: str):
+        self._children.pop(values, None)
+
+
+class _HistogramChild:
+
+    __slots__ = ("upper_bounds", "counts", "sum", "count")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)  # Последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> "_Timer":
+        """async with / with histogram.time(): ..."""
+        return _Timer(self)
+
+    def reset(self):
+        self.counts = [0] * (len(self.upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Timer:
+
+    __slots__ = ("child", "started")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        upper_bounds = tuple(sorted(bucket for bucket in buckets if bucket != math.inf))
+        super().__init__(name, documentation, labels)
+        self.upper_bounds = upper_bounds
+        for child in self._children.values():
+            child.upper_bounds = upper_bounds
+            child.counts = [0] * (len(upper_bounds) + 1)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def _value(self, child):
+        return list(child.counts), child.sum, child.count
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+
+def _render(name: str, snapshot: _Snapshot) -> List[str]:
+    lines = [f"# HELP {name} {snapshot.documentation}", f"# TYPE {name} {snapshot.type}"]
+    for values, value in snapshot.values.items():
+        labels = _format_labels(snapshot.label_names, values)
+        if snapshot.type != Histogram.TYPE:
+            lines.append(f"{name}{labels} {_format_value(value)}")
+            continue
+        counts, total, count = value
+        cumulative = 0
+        for upper_bound, bucket_count in zip(snapshot.upper_bounds + (math.inf,), counts):
+            cumulative += bucket_count
+            le = f'le="{_format_value(float(upper_bound))}"'
+            lines.append(
+                f"{name}_bucket{_format_labels(snapshot.label_names, values, le)} {cumulative}"
+            )
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {count}")
+    return lines
+
+
+def _merge(target: Dict[str, _Snapshot], source: Dict[str, _Snapshot], gauges: bool = True):
+    """Складывает значения метрик source в target (target изменяется)"""
+    for name, snapshot in source.items():
+        if not gauges and snapshot.type == Gauge.TYPE:
+            continue
+        mine = target.get(name)
+        if mine is None:
+            target[name] = snapshot._replace(values={})
+            mine = target[name]
+        elif mine.type != snapshot.type or mine.upper_bounds != snapshot.upper_bounds:
+            _LOGGER.warning("Can't merge metric %s of different type or buckets", name)
+            continue
+        for labels, value in snapshot.values.items():
+            current = mine.values.get(labels)
+            if current is None:
+                mine.values[labels] = (
+                    (list(value[0]), *value[1:]) if isinstance(value, tuple) else value
+                )
+            elif mine.type == Histogram.TYPE:
+                counts, total, count = current
+                mine.values[labels] = (
+                    [a + b for a, b in zip(counts, value[0])],
+                    total + value[1],
+                    count + value[2],
+                )
+            else:
+                mine.values[labels] = current + value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        # Метрики других процессов (воркеров): ключ -> последний снимок
+        self._remotes: Dict[Hashable, Dict[str, _Snapshot]] = {}
+        # Счетчики завершившихся процессов, чтобы суммы не уменьшались при перезапуске
+        self._retired: Dict[str, _Snapshot] = {}
+
+    def _get_or_create(self, cls, name: str, documentation: str, labels: Sequence[str], **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, documentation, labels, **kwargs)
+        elif not isinstance(metric, cls) or metric.label_names != tuple(labels):
+            raise ValueError(f"Metric {name} is already registered with another type or labels")
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labels)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labels, buckets=buckets)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def snapshot(self) -> Dict[str, _Snapshot]:
+        """Значения метрик этого процесса. Снимок можно передать в другой процесс (pickle)"""
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())}
+
+    def reset(self):
+        """Обнуляет все метрики (например, в дочернем процессе после fork)"""
+        for metric in list(self._metrics.values()):
+            metric.reset()
+        self._remotes.clear()
+        self._retired.clear()
+
+    def set_remote(self, key: Hashable, snapshot: Dict[str, _Snapshot]):
+        """Запоминает последний снимок метрик другого процесса: они суммируются с местными"""
+        self._remotes[key] = snapshot
+
+    def retire_remote(self, key: Hashable):
+        """Процесс завершился: его счетчики и гистограммы остаются в суммах, измерители - нет"""
+        snapshot = self._remotes.pop(key, None)
+        if snapshot is not None:
+            _merge(self._retired, snapshot, gauges=False)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus (version 0.0.4)"""
+        snapshot = self.snapshot()
+        for remote in (self._retired, *list(self._remotes.values())):
+            _merge(snapshot, remote)
+        lines = []
+        for name, metric_snapshot in snapshot.items():
+            lines.extend(_render(name, metric_snapshot))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsServer:
+    """Минимальный HTTP-сервер на asyncio, отдающий метрики по GET /metrics"""
+
+    def __init__(
+        self, port: int = 9100, host: str = "0.0.0.0", registry: MetricsRegistry = REGISTRY
+    ):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+        _LOGGER.info("Metrics are available on http://%s:%s/metrics", self.host, self.port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # Заголовки запроса не нужны
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status = "200 OK"
+                body = self.registry.render().encode("utf-8")
+            else:
+                status = "404 Not Found"
+                body = b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("ascii") + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -1,20 +1,82 @@
 import aioamqp
+import asyncio
+import contextvars
+import functools
 import logging
 import httpx
 import json
+import time
 
 from abc import ABC, abstractmethod
+from typing import Optional
 
 from cba import exceptions
+from cba.codecs import default_codec, JSONCodec
 from cba.messages import TelegramMessage
+from cba.metrics import REGISTRY
 
 
 __all__ = ["BasePublisher", "HTTPPublisher", "RabbitPublisher"]
 
 _LOGGER = logging.getLogger(__name__)
 
+_PUBLISH_SECONDS = REGISTRY.histogram(
+    "cba_publish_seconds", "Message publishing latency", ("publisher",)
+)
+_PUBLISH_ERRORS = REGISTRY.counter(
+    "cba_publish_errors_total", "Messages failed to publish", ("publisher",)
+)
+_PUBLISH_BYTES = REGISTRY.counter(
+    "cba_publish_bytes_total", "Bytes of published messages", ("publisher",)
+)
+
+# Уже внутри измеряемой публикации (например, при вызове super().publish_message)
+_measuring = contextvars.ContextVar("cba_publish_measuring", default=False)
+
+
+def _measured(publish_message):
+    """Добавляет к publish_message паблишера замер времени и подсчет ошибок"""
+
+    @functools.wraps(publish_message)
+    async def wrapper(self, message: TelegramMessage, *args, **kwargs):
+        if _measuring.get():
+            return await publish_message(self, message, *args, **kwargs)
+        seconds, errors, _ = self._publish_metrics
+        token = _measuring.set(True)
+        started = time.perf_counter()
+        try:
+            return await publish_message(self, message, *args, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            _measuring.reset(token)
+            seconds.observe(time.perf_counter() - started)
+
+    return wrapper
+
 
 class BasePublisher(ABC):
+
+    codec: JSONCodec = default_codec  # Кодек для сериализации сообщений
+    # Измерять ли публикацию. Отключается у паблишеров-посредников
+    METRICS = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.METRICS:
+            return
+        name = cls.__name__
+        cls._publish_metrics = (
+            _PUBLISH_SECONDS.labels(name),
+            _PUBLISH_ERRORS.labels(name),
+            _PUBLISH_BYTES.labels(name),
+        )
+        if "publish_message" in cls.__dict__:
+            cls.publish_message = _measured(cls.__dict__["publish_message"])
+
     @abstractmethod
     async def publish_message(self, message: TelegramMessage):
         """
@@ -23,6 +85,22 @@ class BasePublisher(ABC):
         """
         ...
 
+    async def close(self):
+        """Закрывает соединения паблишера при остановке актуатора"""
+        ...
+
+    def after_fork(self):
+        """
+        Вызывается в дочернем процессе (cba.workers): соединения родителя
+        нельзя ни использовать, ни закрывать - их нужно просто забыть
+        """
+        ...
+
+    def _count_bytes(self, size: int):
+        """Учитывает размер отправленного сообщения в метриках"""
+        if self.METRICS:
+            self._publish_metrics[2].inc(size)
+
 
 class HTTPPublisher(BasePublisher):
     """HTTP-клиент"""
@@ -35,6 +113,26 @@ class HTTPPublisher(BasePublisher):
         super().__init__(*args, **kwargs)
         self.url = url
         self.headers = headers if headers else {}
+        self._json_headers = {"Content-Type": "application/json", **self.headers}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Клиент создается один раз: соединения с ботом переиспользуются,
+        а SSL-контекст не загружается заново на каждое сообщение
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient()
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def after_fork(self):
+        self._client = None
 
     async def publish_message(self, message: TelegramMessage, queue: str = "telegram"):
         json_message = {
@@ -42,18 +140,19 @@ class HTTPPublisher(BasePublisher):
             "payload": message.payload,
         }
         _LOGGER.debug("TO Telegram via HTTP-client: %s", json_message)
-        await self._post_http(self.url, json_=json_message, headers=self.headers)
+        body = self.codec.dumps(json_message)
+        await self._post_http(self.url, data=body, headers=self._json_headers)
+        self._count_bytes(len(body))
 
-    @staticmethod
     async def _post_http(
+        self,
         url: str,
-        data: str = None,
+        data: [str, bytes] = None,
         json_: dict = None,
         headers: dict = None,
     ):
         try:
-            async with httpx.AsyncClient() as client:
-                request = await client.post(url, data=data, json=json_, headers=headers)
+            request = await self.client.post(url, data=data, json=json_, headers=headers)
             return request.status_code, request.text
         except (httpx.ConnectTimeout, httpx.ConnectError):
             raise exceptions.HTTPClientConnectException
@@ -91,8 +190,9 @@ class RabbitPublisher(BasePublisher):
                 "Send message to RabbitMQ:\n%s",
                 "\n".join(f"{key}: {value}" for key, value in payload.items()),
             )
-            payload = json.dumps(payload)
-            await channel.publish(payload, "", queue)
+            body = self.codec.dumps(payload)
+            await channel.publish(body, "", queue)
+            self._count_bytes(len(body))
             _LOGGER.debug("Send message - OK")
         finally:
             await protocol.close()
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+
+from collections import deque
+from enum import Enum
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+
+__all__ = ["EventsQueue", "OverloadPolicy", "PriorityEventsQueue"]
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class OverloadPolicy(Enum):
+    BLOCK = "block"  # Консьюмер ждет, пока освободится место
+    DROP_OLDEST = "drop_oldest"  # Самый старый еще не начатый эвент выбрасывается
+    REJECT = "reject"  # Новый эвент отклоняется, адресату уходит служебное сообщение
+
+
+class EventsQueue(asyncio.Queue):
+    """
+    Очередь эвентов между консьюмером и диспетчером.
+    maxsize ограничивает число принятых, но еще не обработанных эвентов:
+    и ожидающих в очереди, и уже выполняющихся (до вызова task_done()).
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        *,
+        overload_policy: OverloadPolicy = OverloadPolicy.BLOCK,
+        on_reject: Optional[Callable[[object], Awaitable]] = None,
+        on_drop: Optional[Callable[[object], Awaitable]] = None,
+    ):
+        """
+        :param maxsize: сколько эвентов может быть в работе одновременно (0 - без ограничений)
+        :param overload_policy: что делать с новым эвентом, когда очередь заполнена
+        :param on_reject: корутина, вызываемая с отклоненным эвентом
+        :param on_drop: корутина, вызываемая с выброшенным эвентом (например, чтобы
+            сообщить источнику, что эвент не будет выполнен)
+        """
+        super().__init__(maxsize)
+        self.overload_policy = OverloadPolicy(overload_policy)
+        self.on_reject = on_reject
+        self.on_drop = on_drop
+        self.high_water_mark = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    @property
+    def unfinished(self) -> int:
+        """Эвенты в очереди и в работе"""
+        return self._unfinished_tasks
+
+    def full(self) -> bool:
+        if self.maxsize <= 0:
+            return False
+        return self._unfinished_tasks >= self.maxsize
+
+    async def put(self, item):
+        if self.full():
+            if self.overload_policy is OverloadPolicy.REJECT:
+                self.rejected += 1
+                _LOGGER.warning("Events queue is full, event rejected")
+                if self.on_reject:
+                    await self.on_reject(item)
+                return
+            if self.overload_policy is OverloadPolicy.DROP_OLDEST and not self.empty():
+                dropped = self._drop()
+                self.dropped += 1
+                _LOGGER.warning("Events queue is full, the oldest event dropped")
+                if self.on_drop:
+                    await self.on_drop(dropped)
+        await super().put(item)
+
+    def put_nowait(self, item):
+        super().put_nowait(item)
+        if self._unfinished_tasks > self.high_water_mark:
+            self.high_water_mark = self._unfinished_tasks
+
+    def task_done(self):
+        super().task_done()
+        # Место освобождается при завершении обработки, а не при извлечении
+        self._wakeup_next(self._putters)
+
+    def _drop(self):
+        """Выбрасывает эвент, которым проще всего пожертвовать, и возвращает его"""
+        item = self.get_nowait()
+        self.task_done()
+        return item
+
+    def reset_high_water_mark(self) -> int:
+        """Возвращает максимум с прошлого сброса и начинает отсчет заново"""
+        high_water_mark, self.high_water_mark = self.high_water_mark, self._unfinished_tasks
+        return high_water_mark
+
+
+class _PriorityLevels:
+    """
+    Хранилище PriorityEventsQueue вместо deque в asyncio.Queue:
+    по FIFO-очереди на каждый уровень приоритета
+    """
+
+    def __init__(self, priority: Callable[[object], int], aging: float):
+        self.priority = priority
+        self.aging = aging
+        self.levels: Dict[int, Deque[Tuple[float, object]]] = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for level in self.levels.values():
+            for _, item in level:
+                yield item
+
+    def append(self, item):
+        priority = self.priority(item)
+        level = self.levels.get(priority)
+        if level is None:
+            level = self.levels[priority] = deque()
+        level.append((time.monotonic(), item))
+        self.size += 1
+
+    def popleft(self):
+        """Самый старый эвент уровня с наибольшим приоритетом с учетом времени ожидания"""
+        now = time.monotonic()
+        best_priority, best_level = None, None
+        for priority, level in self.levels.items():
+            if not level:
+                continue
+            effective = priority + (now - level[0][0]) / self.aging
+            if best_level is None or effective > best_priority:
+                best_priority, best_level = effective, level
+        self.size -= 1
+        return best_level.popleft()[1]
+
+    def pop_lowest(self):
+        """Самый старый эвент уровня с наименьшим приоритетом"""
+        priority = min(priority for priority, level in self.levels.items() if level)
+        self.size -= 1
+        return self.levels[priority].popleft()[1]
+
+
+class PriorityEventsQueue(EventsQueue):
+    """
+    EventsQueue, отдающая первыми эвенты с большим приоритетом.
+    Чтобы эвенты с низким приоритетом не ждали вечно, их приоритет растет
+    на единицу за каждые aging секунд ожидания.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        *,
+        priority: Callable[[object], int],
+        aging: float = 5.0,
+        **kwargs,
+    ):
+        """
+        :param priority: функция, возвращающая приоритет эвента (больше - важнее)
+        :param aging: за сколько секунд ожидания приоритет эвента растет на единицу
+        """
+        if aging <= 0:
+            raise ValueError("aging must be positive")
+        self._priority = priority
+        self._aging = aging
+        super().__init__(maxsize, **kwargs)
+
+    def _init(self, maxsize):
+        self._queue = _PriorityLevels(self._priority, self._aging)
+
+    def _drop(self):
+        # При переполнении жертвуем самым старым эвентом с наименьшим приоритетом
+        item = self._queue.pop_lowest()
+        self._wakeup_next(self._putters)
+        self.task_done()
+        return item
@@ -0,0 +1,7 @@
+from .fake_amqp import FakeAMQPBroker
+from .fake_bot import FakeControlBot
+
+__all__ = [
+    "FakeAMQPBroker",
+    "FakeControlBot",
+]
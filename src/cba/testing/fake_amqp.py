@@ -0,0 +1,170 @@
+"""
+In-process замена RabbitMQ для тестов AMQPConsumer и RabbitPublisher.
+FakeAMQPBroker.connect повторяет сигнатуру aioamqp.connect, а каналы поддерживают
+подмножество API aioamqp: qos (prefetch_count), объявление очередей, публикацию,
+потребление, ack/nack/reject и повторную доставку неподтвержденных сообщений
+при закрытии соединения.
+"""
+
+import asyncio
+import itertools
+
+from collections import defaultdict, deque
+from typing import Optional
+
+from aioamqp.envelope import Envelope
+from aioamqp.exceptions import AmqpClosedConnection
+from aioamqp.properties import Properties
+
+
+__all__ = ["FakeAMQPBroker"]
+
+
+class FakeAMQPBroker:
+    def __init__(self):
+        self.queues = defaultdict(deque)  # queue -> deque[(body, properties, redelivered)]
+        self.acked = []  # Тела подтвержденных сообщений
+        self.rejected = []
+        self.max_unacked = 0  # Максимум одновременно неподтвержденных сообщений
+        self.connections = []
+        self._delivery_tags = itertools.count(1)
+
+    async def connect(self, host="localhost", port=None, **kwargs):
+        """Замена aioamqp.connect"""
+        protocol = _FakeProtocol(self)
+        self.connections.append(protocol)
+        return _FakeTransport(protocol), protocol
+
+    def publish(self, queue: str, body: bytes, message_id: Optional[str] = None):
+        properties = Properties(message_id=message_id)
+        self.queues[queue].append((body, properties, False))
+        self._deliver(queue)
+
+    def _deliver(self, queue: str):
+        for protocol in self.connections:
+            for channel in protocol.channels:
+                channel._deliver(queue)
+
+    def _next_tag(self) -> int:
+        return next(self._delivery_tags)
+
+
+class _FakeTransport:
+    def __init__(self, protocol: "_FakeProtocol"):
+        self._protocol = protocol
+
+    def close(self):
+        self._protocol._lost()
+
+
+class _FakeProtocol:
+    def __init__(self, broker: FakeAMQPBroker):
+        self.broker = broker
+        self.channels = []
+        self.connection_closed = asyncio.Event()
+
+    async def channel(self) -> "_FakeChannel":
+        self._check_open()
+        channel = _FakeChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    async def close(self, no_wait=False, timeout=None):
+        self._check_open()
+        self._lost()
+
+    async def wait_closed(self, timeout=None):
+        await asyncio.wait_for(self.connection_closed.wait(), timeout)
+
+    def _check_open(self):
+        if self.connection_closed.is_set():
+            raise AmqpClosedConnection()
+
+    def _lost(self):
+        """Неподтвержденные сообщения возвращаются в очереди для повторной доставки"""
+        if self.connection_closed.is_set():
+            return
+        self.connection_closed.set()
+        self.broker.connections.remove(self)
+        for channel in self.channels:
+            channel._requeue_unacked()
+        for channel in self.channels:
+            self.broker._deliver(channel.queue_name)
+
+
+class _FakeChannel:
+    def __init__(self, protocol: _FakeProtocol):
+        self.protocol = protocol
+        self.broker = protocol.broker
+        self.prefetch_count = 0
+        self.queue_name = None
+        self.unacked = {}  # delivery_tag -> (body, properties)
+        self._callback = None
+        self._consumer_tag = ""
+
+    async def basic_qos(self, prefetch_size=0, prefetch_count=0, connection_global=False):
+        self.prefetch_count = prefetch_count
+
+    async def queue_declare(self, queue_name=None, durable=False, **kwargs):
+        queue = self.broker.queues[queue_name]
+        return {"queue": queue_name, "message_count": len(queue), "consumer_count": 0}
+
+    async def basic_consume(self, callback, queue_name="", consumer_tag="", no_ack=False, **kwargs):
+        self.protocol._check_open()
+        self._callback = callback
+        self.queue_name = queue_name
+        self._consumer_tag = consumer_tag or f"ctag{id(self)}"
+        self._deliver(queue_name)
+        return {"consumer_tag": self._consumer_tag}
+
+    async def basic_cancel(self, consumer_tag, no_wait=False):
+        self.protocol._check_open()
+        self._callback = None
+        return {"consumer_tag": consumer_tag}
+
+    async def publish(self, payload, exchange_name, routing_key, properties=None, **kwargs):
+        self.protocol._check_open()
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.broker.publish(routing_key, payload, (properties or {}).get("message_id"))
+
+    async def basic_client_ack(self, delivery_tag, multiple=False):
+        self.protocol._check_open()
+        body, _ = self.unacked.pop(delivery_tag)
+        self.broker.acked.append(body)
+        self._deliver(self.queue_name)
+
+    async def basic_client_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.protocol._check_open()
+        body, properties = self.unacked.pop(delivery_tag)
+        if requeue:
+            self.broker.queues[self.queue_name].appendleft((body, properties, True))
+        else:
+            self.broker.rejected.append(body)
+        self.broker._deliver(self.queue_name)
+
+    async def basic_reject(self, delivery_tag, requeue=False):
+        await self.basic_client_nack(delivery_tag, requeue=requeue)
+
+    async def close(self, reply_code=0, reply_text="Normal Shutdown"):
+        self._requeue_unacked()
+
+    def _deliver(self, queue_name: str):
+        if self._callback is None or queue_name != self.queue_name:
+            return
+        if self.protocol.connection_closed.is_set():
+            return
+        queue = self.broker.queues[queue_name]
+        while queue and (not self.prefetch_count or len(self.unacked) < self.prefetch_count):
+            body, properties, redelivered = queue.popleft()
+            delivery_tag = self.broker._next_tag()
+            self.unacked[delivery_tag] = (body, properties)
+            self.broker.max_unacked = max(self.broker.max_unacked, len(self.unacked))
+            envelope = Envelope(self._consumer_tag, delivery_tag, "", queue_name, redelivered)
+            asyncio.ensure_future(self._callback(self, body, envelope, properties))
+
+    def _requeue_unacked(self):
+        queue = self.broker.queues[self.queue_name]
+        for body, properties in reversed(list(self.unacked.values())):
+            queue.appendleft((body, properties, True))
+        self.unacked.clear()
@@ -0,0 +1,216 @@
+"""
+Локальная замена control bot для нагрузочного тестирования.
+Отдает поток команд /sse/{name}/events с заданной частотой и размером аргументов
+и принимает сообщения актуатора на /inbox (контракт HTTPPublisher).
+Работает на чистом asyncio, без внешних зависимостей.
+"""
+
+import asyncio
+import logging
+import time
+
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from cba.codecs import default_codec, JSONCodec
+
+
+__all__ = ["FakeControlBot"]
+
+_LOGGER = logging.getLogger(__name__)
+
+_SSE_HEADERS = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Transfer-Encoding: chunked\r\n"
+    b"\r\n"
+)
+_INBOX_RESPONSE = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 2\r\n"
+    b"\r\n"
+    b"{}"
+)
+_NOT_FOUND_RESPONSE = b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n"
+_TICK = 0.01  # Эвенты отправляются пачками раз в _TICK секунд
+
+
+class FakeControlBot:
+    """
+    Каждый эвент адресован пользователю с target_name, равным номеру эвента.
+    Бот отвечает на него сообщением с тем же target, поэтому по /inbox
+    можно посчитать задержку от отправки эвента до получения ответа.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        *,
+        rate: float = 100.0,
+        payload_size: int = 16,
+        events_total: Optional[int] = None,
+        command: str = "loadEcho",
+        heartbeat: float = 15.0,
+        codec: JSONCodec = default_codec,
+    ):
+        """
+        :param port: 0 - выбрать свободный порт
+        :param rate: эвентов в секунду на каждый поток
+        :param payload_size: длина текстового аргумента команды
+        :param events_total: после скольких эвентов остановиться (на поток)
+        :param command: CMD команды в эвентах
+        :param heartbeat: период комментариев-heartbeat в потоке, с
+        """
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.payload_size = payload_size
+        self.events_total = events_total
+        self.command = command
+        self.heartbeat = heartbeat
+        self.codec = codec
+
+        self.events_sent = 0
+        self.messages: List[dict] = []  # Все полученные на /inbox сообщения
+        self.latencies: List[float] = []  # Задержка эвент -> ответ, с
+        self._sent_at: Dict[str, float] = {}
+        self._seq = 0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def inbox_url(self) -> str:
+        return f"{self.url}/inbox"
+
+    def sse_url(self, name: str) -> str:
+        return f"{self.url}/sse/{name}/events"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        _LOGGER.info("Fake control bot started on %s", self.url)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def reset_stats(self):
+        self.events_sent = 0
+        self.messages.clear()
+        self.latencies.clear()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while 1:  # keep-alive
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                parts = path.split("/")
+                if method == "GET" and len(parts) == 4 and parts[1] == "sse":
+                    await self._stream_events(writer, parts[2])
+                    break
+                if method == "POST" and path == "/inbox":
+                    self._receive_message(body)
+                    writer.write(_INBOX_RESPONSE)
+                else:
+                    writer.write(_NOT_FOUND_RESPONSE)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(
+        reader: asyncio.StreamReader,
+    ) -> Optional[Tuple[str, str, dict, bytes]]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = request_line.split(" ", 2)
+        headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        body = b""
+        if "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        return method, urlsplit(target).path, headers, body
+
+    async def _stream_events(self, writer: asyncio.StreamWriter, name: str):
+        _LOGGER.info("Actuator %s connected", name)
+        writer.write(_SSE_HEADERS)
+        payload = "x" * self.payload_size
+        started = last_heartbeat = time.monotonic()
+        sent = 0
+        while self.events_total is None or sent < self.events_total:
+            now = time.monotonic()
+            due = int((now - started) * self.rate) - sent
+            if self.events_total is not None:
+                due = min(due, self.events_total - sent)
+            frames = []
+            for _ in range(due):
+                frames.append(self._build_event(payload))
+            if now - last_heartbeat >= self.heartbeat:
+                frames.append(b": heartbeat\r\n\r\n")
+                last_heartbeat = now
+            if frames:
+                writer.write(_chunk(b"".join(frames)))
+                await writer.drain()
+                sent += due
+                self.events_sent += due
+            await asyncio.sleep(_TICK)
+        # Поток не закрываем: актуатор должен дослать ответы, а не переподключаться
+        while 1:
+            await asyncio.sleep(self.heartbeat)
+            writer.write(_chunk(b": heartbeat\r\n\r\n"))
+            await writer.drain()
+
+    def _build_event(self, payload: str) -> bytes:
+        self._seq += 1
+        seq = str(self._seq)
+        now = time.time()
+        self._sent_at[seq] = time.perf_counter()
+        data = self.codec.dumps(
+            {
+                "command": self.command,
+                "target": {"target_type": "user", "target_name": seq},
+                "behavior": "user",
+                "args": {"text": payload},
+                "ts": now,
+            }
+        )
+        return b"id: %s\r\nevent: slave\r\ndata: %s\r\n\r\n" % (seq.encode(), data)
+
+    def _receive_message(self, body: bytes):
+        received_at = time.perf_counter()
+        message = self.codec.loads(body)
+        self.messages.append(message)
+        target_name = message.get("payload", {}).get("target", {}).get("target_name")
+        sent_at = self._sent_at.pop(str(target_name), None)
+        if sent_at is not None:
+            self.latencies.append(received_at - sent_at)
+
+
+def _chunk(data: bytes) -> bytes:
+    """Кусок тела в Transfer-Encoding: chunked"""
+    return b"%x\r\n%s\r\n" % (len(data), data)
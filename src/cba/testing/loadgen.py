@@ -0,0 +1,155 @@
+"""
+Нагрузочный тест актуатора без внешних сервисов:
+
+    python -m cba.testing.loadgen --rate 500 --duration 10 --payload-size 200
+
+Поднимает FakeControlBot и актуатор(ы) с цепочкой
+SSEConsumer -> CommandsDispatcher -> HTTPPublisher,
+после чего печатает пропускную способность и перцентили задержки "эвент -> ответ".
+С --min-rate и --max-p99 завершается с кодом 1 при деградации (для CI).
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+
+from typing import List, Optional
+
+from cba.actuator import Actuator
+from cba.commands import BaseCommand
+from cba.consumers import SSEConsumer
+from cba.dispatcher import CommandsDispatcher
+from cba.publishers import HTTPPublisher
+from cba.testing.fake_bot import FakeControlBot
+
+
+__all__ = ["LoadReport", "build_dispatcher", "percentile", "run_load"]
+
+
+class LoadEcho(BaseCommand):
+    """Отвечает текстом из аргументов. Используется для нагрузочного теста"""
+
+    CMD = "loadEcho"
+
+    async def _execute(self):
+        await self.send_message(text=self.command_args.get("text", ""))
+
+
+class LoadReport:
+    def __init__(self, duration: float, events_sent: int, latencies: List[float]):
+        self.duration = duration
+        self.events_sent = events_sent
+        self.messages_received = len(latencies)
+        self.rate = self.messages_received / duration if duration else 0.0
+        latencies = sorted(latencies)
+        self.p50 = percentile(latencies, 50)
+        self.p95 = percentile(latencies, 95)
+        self.p99 = percentile(latencies, 99)
+
+    def __str__(self):
+        return (
+            f"events sent:       {self.events_sent}\n"
+            f"replies received:  {self.messages_received}\n"
+            f"throughput:        {self.rate:.1f} events/s\n"
+            f"latency p50:       {self.p50 * 1000:.1f} ms\n"
+            f"latency p95:       {self.p95 * 1000:.1f} ms\n"
+            f"latency p99:       {self.p99 * 1000:.1f} ms"
+        )
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """Перцентиль методом ближайшего ранга по отсортированному списку"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def build_dispatcher() -> CommandsDispatcher:
+    dispatcher = CommandsDispatcher()
+    dispatcher.register_callable_command(LoadEcho)
+    return dispatcher
+
+
+async def run_load(
+    *,
+    rate: float = 100.0,
+    duration: float = 5.0,
+    payload_size: int = 16,
+    actuators: int = 1,
+    drain_timeout: float = 5.0,
+    dispatcher: Optional[CommandsDispatcher] = None,
+) -> LoadReport:
+    """
+    :param rate: эвентов в секунду на каждый актуатор
+    :param duration: сколько секунд генерировать эвенты
+    :param actuators: сколько актуаторов запустить в одном процессе
+    :param drain_timeout: сколько ждать ответы на уже отправленные эвенты
+    :param dispatcher: свой диспетчер с командой LoadEcho (по-умолчанию создается новый)
+    """
+    loop = asyncio.get_event_loop()
+    events_total = int(rate * duration)
+    async with FakeControlBot(
+        rate=rate, payload_size=payload_size, events_total=events_total
+    ) as bot:
+        running = []
+        for number in range(actuators):
+            name = f"load{number}"
+            actuator = Actuator(
+                name,
+                consumer=SSEConsumer(bot.sse_url(name)),
+                dispatcher=dispatcher if dispatcher else build_dispatcher(),
+                publishers=HTTPPublisher(url=bot.inbox_url),
+                hide_name=True,
+            )
+            actuator.start(loop)
+            running.append(actuator)
+
+        started = loop.time()
+        expected = events_total * actuators
+        deadline = started + duration + drain_timeout
+        while len(bot.latencies) < expected and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = loop.time() - started
+
+        await asyncio.gather(*(actuator.shutdown(timeout=0) for actuator in running))
+        return LoadReport(elapsed, bot.events_sent, list(bot.latencies))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m cba.testing.loadgen", description="Actuator load generator"
+    )
+    arg_parser.add_argument("--rate", type=float, default=100.0, help="events/s per actuator")
+    arg_parser.add_argument("--duration", type=float, default=5.0, help="seconds")
+    arg_parser.add_argument("--payload-size", type=int, default=16, help="bytes of command args")
+    arg_parser.add_argument("--actuators", type=int, default=1)
+    arg_parser.add_argument("--min-rate", type=float, help="fail if throughput is lower")
+    arg_parser.add_argument("--max-p99", type=float, help="fail if p99 latency is higher, ms")
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    report = asyncio.get_event_loop().run_until_complete(
+        run_load(
+            rate=args.rate,
+            duration=args.duration,
+            payload_size=args.payload_size,
+            actuators=args.actuators,
+        )
+    )
+    print(report)
+
+    failed = False
+    if args.min_rate is not None and report.rate < args.min_rate:
+        print(f"FAIL: throughput {report.rate:.1f} < {args.min_rate} events/s")
+        failed = True
+    if args.max_p99 is not None and report.p99 * 1000 > args.max_p99:
+        print(f"FAIL: p99 latency {report.p99 * 1000:.1f} > {args.max_p99} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
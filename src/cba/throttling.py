@@ -0,0 +1,135 @@
+"""
+Ограничение частоты команд алгоритмом token bucket:
+для каждого адресата, для каждой команды и для актуатора в целом.
+"""
+
+import time
+
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Union
+
+
+__all__ = ["RateLimit", "RateLimiter", "TokenBuckets"]
+
+
+class RateLimit:
+    """rate команд в секунду в среднем, но не больше burst подряд"""
+
+    __slots__ = ("rate", "burst")
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate))
+        if self.burst < 1:
+            raise ValueError("burst must be positive")
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} rate={self.rate} burst={self.burst}>"
+
+
+class TokenBuckets:
+    """
+    Набор ведер с одинаковым лимитом, по ведру на ключ.
+    Ведер не больше max_buckets: дольше всех не использовавшиеся выбрасываются.
+    Ведро, простоявшее burst / rate секунд, полное, так что его потеря ничего не меняет.
+    """
+
+    def __init__(self, limit: RateLimit, max_buckets: int = 10000):
+        self.limit = limit
+        self.max_buckets = max_buckets
+        # Ключ -> [токены, время последнего пополнения]
+        self._buckets: Dict[Hashable, list] = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def tokens(self, key: Hashable, now: float) -> float:
+        """Сколько токенов в ведре сейчас (ведро пополняется, но токены не тратятся)"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.limit.burst), now]
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            tokens, updated = bucket
+            bucket[0] = min(self.limit.burst, tokens + (now - updated) * self.limit.rate)
+            bucket[1] = now
+        return bucket[0]
+
+    def take(self, key: Hashable):
+        """Тратит токен. Вызывается после tokens() для того же ключа"""
+        self._buckets[key][0] -= 1
+
+    def acquire(self, key: Hashable, now: float) -> bool:
+        if self.tokens(key, now) < 1:
+            return False
+        self.take(key)
+        return True
+
+
+class RateLimiter:
+    """
+    Решает, можно ли выполнить эвент. Эвент проходит,
+    только если токен есть во всех ведрах, которые к нему относятся.
+    """
+
+    TARGET = "target"
+    COMMAND = "command"
+    GLOBAL = "global"
+
+    def __init__(
+        self,
+        *,
+        per_target: Optional[RateLimit] = None,
+        per_command: Union[RateLimit, Dict[str, RateLimit], None] = None,
+        global_limit: Optional[RateLimit] = None,
+        notice_interval: float = 10.0,
+        max_buckets: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param per_target: лимит для каждого адресата (target_type + target_name)
+        :param per_command: лимит для каждой команды или словарь CMD -> лимит
+        :param global_limit: лимит на все эвенты актуатора
+        :param notice_interval: не чаще одного уведомления об ограничении адресату за столько секунд
+        :param max_buckets: сколько ведер хранить для каждого вида лимита
+        """
+        self.clock = clock
+        self._target = TokenBuckets(per_target, max_buckets) if per_target else None
+        if isinstance(per_command, RateLimit):
+            self._commands = {None: TokenBuckets(per_command, max_buckets)}
+        else:
+            self._commands = {
+                cmd: TokenBuckets(limit, 1) for cmd, limit in (per_command or {}).items()
+            }
+        self._global = TokenBuckets(global_limit, 1) if global_limit else None
+        self._notices = TokenBuckets(RateLimit(1 / notice_interval, 1), max_buckets)
+        self.rejected = Counter()  # Вид лимита -> сколько эвентов отклонено
+
+    def check(self, command: str, target: tuple) -> Optional[str]:
+        """Тратит токены эвента. Возвращает вид исчерпанного лимита или None"""
+        now = self.clock()
+        buckets = []
+        if self._target is not None:
+            buckets.append((self.TARGET, self._target, target))
+        command_buckets = self._commands.get(command, self._commands.get(None))
+        if command_buckets is not None:
+            buckets.append((self.COMMAND, command_buckets, command))
+        if self._global is not None:
+            buckets.append((self.GLOBAL, self._global, None))
+
+        for scope, bucket, key in buckets:
+            if bucket.tokens(key, now) < 1:
+                self.rejected[scope] += 1
+                return scope
+        # Токены тратятся только если эвент проходит по всем лимитам
+        for _, bucket, key in buckets:
+            bucket.take(key)
+        return None
+
+    def should_notify(self, target: tuple) -> bool:
+        """Нужно ли сообщить адресату об ограничении (или он уже знает)"""
+        return self._notices.acquire(target, self.clock())
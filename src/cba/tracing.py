@@ -0,0 +1,441 @@
+"""
+Трассировка эвентов: куда ушло время от SSE-эвента до отправленного сообщения.
+
+Trace создается консьюмером при разборе эвента и передается дальше в эвенте
+(BaseDispatcherEvent.trace) и в командах (BaseCommand.trace).
+Каждый этап добавляет в него Span:
+    delivery - от отправки эвента сервером до получения (если сервер передал ts);
+    parse - разбор эвента;
+    queue - ожидание в очереди актуатора;
+    resolve - поиск команды и проверка аргументов;
+    execute - выполнение команды (span_id - id команды, у подкоманд parent - id родителя);
+    publish - отправка сообщения паблишером.
+После выполнения эвента Tracer передает трассу экспортеру.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional
+
+import httpx
+
+from cba.codecs import default_codec, JSONCodec
+
+
+__all__ = [
+    "BaseExporter",
+    "JSONLExporter",
+    "LogExporter",
+    "OTLPExporter",
+    "Span",
+    "Trace",
+    "Tracer",
+]
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def command_span_id(command_id) -> str:
+    """Span id выполнения команды из ее id (uuid)"""
+    return command_id.hex[:16] if isinstance(command_id, uuid.UUID) else str(command_id)
+
+
+class Span:
+
+    __slots__ = ("span_id", "parent_id", "name", "start", "end", "attributes", "error")
+
+    def __init__(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        parent_id: str,
+        span_id: Optional[str] = None,
+        attributes: Optional[dict] = None,
+        error: Optional[str] = None,
+    ):
+        self.name = name
+        self.start = start  # unix time, с
+        self.end = end
+        self.parent_id = parent_id
+        self.span_id = span_id or new_span_id()
+        self.attributes = attributes or {}
+        self.error = error
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def as_dict(self) -> dict:
+        span = {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+        if self.attributes:
+            span["attributes"] = self.attributes
+        if self.error:
+            span["error"] = self.error
+        return span
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.name} {self.duration * 1000:.1f} ms>"
+
+
+class _SpanContext:
+    """with / async with trace.span(...): этап записывается при выходе"""
+
+    __slots__ = ("trace", "name", "parent_id", "span_id", "attributes", "start")
+
+    def __init__(self, trace: "Trace", name, parent_id, span_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.parent_id = parent_id
+        self.span_id = span_id
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        error = None
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            error = repr(exc)
+        self.trace.spans.append(
+            Span(
+                self.name,
+                self.start,
+                time.time(),
+                self.parent_id or self.trace.root_id,
+                self.span_id,
+                self.attributes,
+                error,
+            )
+        )
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+class Trace:
+    """Этапы обработки одного эвента"""
+
+    __slots__ = ("trace_id", "root_id", "sampled", "started", "queued_at", "spans")
+
+    def __init__(self, sampled: bool = True, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.root_id = new_span_id()  # Корневой span - весь эвент
+        self.sampled = sampled  # False - трасса экспортируется, только если эвент медленный
+        self.started = time.time()
+        self.queued_at = self.started  # Когда эвент попал в очередь актуатора
+        self.spans: List[Span] = []
+
+    def span(
+        self,
+        name: str,
+        parent_id: Optional[str] = None,
+        span_id: Optional[str] = None,
+        **attributes,
+    ) -> _SpanContext:
+        """Контекстный менеджер этапа. По-умолчанию этап - потомок корневого span"""
+        return _SpanContext(self, name, parent_id, span_id, attributes)
+
+    def add_span(
+        self, name: str, start: float, end: float, parent_id: Optional[str] = None, **attributes
+    ) -> Span:
+        """Добавляет уже завершенный этап"""
+        span = Span(name, start, end, parent_id or self.root_id, attributes=attributes)
+        self.spans.append(span)
+        return span
+
+    def detached(self) -> "Trace":
+        """Трасса с теми же id, но без этапов - для передачи в другой процесс"""
+        trace = Trace(self.sampled, self.trace_id)
+        trace.root_id = self.root_id
+        trace.started = trace.queued_at = self.started
+        return trace
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.trace_id} spans={len(self.spans)}>"
+
+
+class BaseExporter(ABC):
+    @abstractmethod
+    def export(self, trace: Trace, root: Span):
+        """Принимает завершенную трассу. Не должен блокировать event loop"""
+        ...
+
+    async def close(self):
+        """Отправляет накопленное и закрывает соединения при остановке актуатора"""
+        ...
+
+
+class LogExporter(BaseExporter):
+    """Пишет трассу в лог одной строкой: длительность каждого этапа"""
+
+    def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.INFO):
+        self.logger = logger or _LOGGER
+        self.level = level
+
+    def export(self, trace: Trace, root: Span):
+        stages = ", ".join(
+            f"{span.name}{_stage_label(span)} {span.duration * 1000:.1f} ms"
+            for span in sorted(trace.spans, key=lambda span: span.start)
+        )
+        self.logger.log(
+            self.level,
+            "Trace %s %s: %.1f ms (%s)",
+            trace.trace_id,
+            root.attributes.get("command", ""),
+            root.duration * 1000,
+            stages,
+        )
+
+
+def _stage_label(span: Span) -> str:
+    label = span.attributes.get("cmd") or span.attributes.get("publisher")
+    return f"[{label}]" if label else ""
+
+
+class JSONLExporter(BaseExporter):
+    """
+    Дописывает трассы в файл, по JSON-объекту на строку.
+    Записи копятся и пишутся пачкой через flush_interval секунд после первой трассы
+    или сразу, как только их набралось batch_size.
+    """
+
+    def __init__(
+        self,
+        file_name: str,
+        codec: JSONCodec = default_codec,
+        *,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+    ):
+        self.file_name = file_name
+        self.codec = codec
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._file = open(file_name, "ab")
+        self._pending: List[bytes] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def export(self, trace: Trace, root: Span):
+        record = {
+            "trace_id": trace.trace_id,
+            "sampled": trace.sampled,
+            **root.as_dict(),
+            "spans": [span.as_dict() for span in trace.spans],
+        }
+        self._pending.append(self.codec.dumps(record) + b"\n")
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        self._file.write(b"".join(self._pending))
+        self._file.flush()
+        self._pending = []
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        self.flush()
+        self._file.close()
+
+
+class OTLPExporter(BaseExporter):
+    """
+    Отправляет трассы коллектору OpenTelemetry по OTLP/HTTP в JSON-кодировке.
+    Span копятся и отправляются пачками через flush_interval секунд после первой трассы.
+    """
+
+    def __init__(
+        self,
+        url: str = "http://localhost:4318/v1/traces",
+        *,
+        service_name: str = "cba",
+        headers: Optional[dict] = None,
+        batch_size: int = 100,
+        flush_interval: float = 5.0,
+        max_queue: int = 10000,
+        client: Optional[httpx.AsyncClient] = None,
+        codec: JSONCodec = default_codec,
+    ):
+        """
+        :param url: адрес OTLP/HTTP коллектора
+        :param batch_size: сколько span отправлять одним запросом
+        :param max_queue: сколько span копить, если коллектор недоступен. Лишние трассы выбрасываются
+        """
+        self.url = url
+        self.service_name = service_name
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.codec = codec
+        self.dropped = 0
+        self._client = client
+        self._own_client = client is None
+        self._pending: List[dict] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient()
+        return self._client
+
+    def export(self, trace: Trace, root: Span):
+        if len(self._pending) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._pending.extend(_otlp_span(trace.trace_id, span) for span in (root, *trace.spans))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        while self._pending:
+            batch, self._pending = (
+                self._pending[: self.batch_size],
+                self._pending[self.batch_size :],
+            )
+            try:
+                response = await self.client.post(
+                    self.url, data=self.codec.dumps(self.payload(batch)), headers=self.headers
+                )
+                response.raise_for_status()
+            except (httpx.HTTPError, OSError) as err:
+                _LOGGER.warning("Can't export %d spans to %s: %r", len(batch), self.url, err)
+
+    def payload(self, spans: List[dict]) -> dict:
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes({"service.name": self.service_name})
+                    },
+                    "scopeSpans": [{"scope": {"name": "cba"}, "spans": spans}],
+                }
+            ]
+        }
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        if self._own_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> List[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def _otlp_span(trace_id: str, span: Span) -> dict:
+    otlp = {
+        "traceId": trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(int(span.start * 1e9)),
+        "endTimeUnixNano": str(int(span.end * 1e9)),
+        "attributes": _otlp_attributes(span.attributes),
+    }
+    if span.parent_id:
+        otlp["parentSpanId"] = span.parent_id
+    if span.error:
+        otlp["status"] = {"code": 2, "message": span.error}  # STATUS_CODE_ERROR
+    return otlp
+
+
+class Tracer:
+    """
+    Решает, какие эвенты трассировать, и отдает завершенные трассы экспортеру.
+    Трассируется доля sample_rate эвентов. Если задан slow_threshold,
+    трассируются все эвенты, но из невыбранных экспортируются только медленные.
+    """
+
+    def __init__(
+        self,
+        exporter: Optional[BaseExporter] = None,
+        *,
+        sample_rate: float = 1.0,
+        slow_threshold: Optional[float] = None,
+        random_: Callable[[], float] = random.random,
+    ):
+        """
+        :param exporter: куда отправлять трассы. По-умолчанию - в лог
+        :param sample_rate: доля трассируемых эвентов, от 0 до 1
+        :param slow_threshold: эвенты дольше стольких секунд экспортируются всегда
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.exporter = exporter if exporter is not None else LogExporter()
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self._random = random_
+        self.exported = 0
+
+    def start_trace(self) -> Optional[Trace]:
+        """Трасса нового эвента или None, если эвент не трассируется"""
+        sampled = self.sample_rate >= 1 or self._random() < self.sample_rate
+        if not sampled and self.slow_threshold is None:
+            return None
+        return Trace(sampled)
+
+    def finish(self, trace: Trace, **attributes) -> Optional[Span]:
+        """Завершает трассу эвента и экспортирует ее, если нужно"""
+        root = Span("event", trace.started, time.time(), "", trace.root_id, attributes)
+        if not trace.sampled and root.duration < self.slow_threshold:
+            return None
+        try:
+            self.exporter.export(trace, root)
+        except Exception:
+            _LOGGER.warning("Can't export trace %s", trace.trace_id, exc_info=True)
+            return None
+        self.exported += 1
+        return root
+
+    async def close(self):
+        await self.exporter.close()
@@ -0,0 +1,362 @@
+"""
+Многопроцессный режим актуатора: Actuator.run(workers=N).
+
+Родительский процесс получает и разбирает эвенты (консьюмер), а выполняют их N дочерних
+процессов, у каждого - свой event loop, CommandsDispatcher и паблишеры (копии родительских).
+Эвенты одного адресата всегда уходят в один и тот же процесс, поэтому
+с CommandsDispatcher(ordered_targets=True) их порядок сохраняется.
+
+Процессы создаются через fork (только Unix) и связаны с родителем парой сокетов.
+По сокету передаются кадры: длина (4 байта) и pickle сообщения:
+    родитель -> воркер: ("event", seq, состояние эвента), ("stop", timeout);
+    воркер -> родитель: ("done", seq) - эвент выполнен, ("metrics", снимок реестра метрик).
+Родитель подтверждает эвент источнику (event.ack) и освобождает место в очереди по "done".
+Упавший воркер перезапускается, а эвенты, переданные ему, но не выполненные, считаются потерянными
+и возвращаются источнику (event.nack) для повторной доставки.
+"""
+
+import asyncio
+import atexit
+import functools
+import itertools
+import logging
+import multiprocessing
+import pickle
+import signal
+import socket
+import struct
+import zlib
+
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from cba.consumers import ReconnectBackoff
+from cba.dispatcher import BaseDispatcherEvent
+from cba.metrics import MetricsRegistry, REGISTRY
+
+
+__all__ = ["WorkerPool"]
+
+_LOGGER = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")
+
+
+def _frame(message) -> bytes:
+    payload = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(payload)) + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader):
+    """Следующее сообщение или None, если другая сторона закрыла сокет"""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+        return pickle.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+def _event_state(event: BaseDispatcherEvent) -> tuple:
+    # ack остается в родителе: подтверждение источнику делает он
+    return event.command, event.target, event.args, event.behavior, event.id, event.ts, event.trace
+
+
+def _restore_event(state: tuple) -> BaseDispatcherEvent:
+    command, target, args, behavior, id_, ts, trace = state
+    event = BaseDispatcherEvent(command, target, args, behavior, id_, ts)
+    event.trace = trace
+    return event
+
+
+class _Worker:
+    """Состояние воркера в родителе. Переживает перезапуски процесса"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.sock: Optional[socket.socket] = None
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.sent: Dict[int, BaseDispatcherEvent] = {}  # Переданы процессу, но еще не выполнены
+        # Эвенты, пришедшие, пока процесс перезапускается
+        self.backlog: Deque[Tuple[int, bytes, BaseDispatcherEvent]] = deque()
+        self.task: Optional[asyncio.Future] = None
+
+
+class WorkerPool:
+    """Процессы-воркеры актуатора и раздача им эвентов"""
+
+    def __init__(
+        self,
+        actuator,
+        workers: int,
+        *,
+        metrics_interval: float = 5.0,
+        backoff: Optional[ReconnectBackoff] = None,
+        registry: MetricsRegistry = REGISTRY,
+        stop_grace: float = 5.0,
+    ):
+        """
+        :param actuator: актуатор, чей диспетчер и паблишеры копируются в воркеры
+        :param workers: число процессов
+        :param metrics_interval: как часто воркеры присылают метрики, с
+        :param backoff: задержка перезапуска воркера, который падает сразу после старта
+        :param stop_grace: сколько секунд сверх timeout остановки ждать воркер,
+            прежде чем убить его (например, если команда заблокировала его event loop)
+        """
+        if workers < 1:
+            raise ValueError("workers must be positive")
+        # fork: команды и middleware не обязаны быть импортируемыми и сериализуемыми
+        self._context = multiprocessing.get_context("fork")
+        self.actuator = actuator
+        self.size = workers
+        self.metrics_interval = metrics_interval
+        self.backoff = backoff if backoff is not None else ReconnectBackoff()
+        self.registry = registry
+        self.stop_grace = stop_grace
+        self.restarts = 0
+        self.lost = 0  # Эвенты, выполнение которых прервалось падением воркера
+        self._workers = [_Worker(index) for index in range(workers)]
+        self._seq = itertools.count()
+        self._events_queue: Optional[asyncio.Queue] = None
+        self._stopping = False
+        # Воркеры не демоны, и multiprocessing ждет их при выходе из интерпретатора.
+        # Если loop остановили без stop(), воркеры завершатся, получив EOF
+        atexit.register(self._close_sockets)
+
+    @property
+    def in_flight(self) -> int:
+        """Сколько эвентов передано воркерам и еще не выполнено"""
+        return sum(len(worker.sent) + len(worker.backlog) for worker in self._workers)
+
+    @property
+    def pids(self) -> List[Optional[int]]:
+        return [worker.process.pid if worker.process else None for worker in self._workers]
+
+    async def serve(self, events_queue: asyncio.Queue):
+        """Раздает эвенты из очереди воркерам. Заменяет CommandsDispatcher.events_reader"""
+        self._events_queue = events_queue
+        for worker in self._workers:
+            if worker.task is None:
+                worker.task = asyncio.ensure_future(self._supervise(worker))
+        while 1:
+            event = await events_queue.get()
+            await self._send(self._route(event), event)
+
+    def _route(self, event: BaseDispatcherEvent) -> _Worker:
+        key = f"{event.target.target_type}/{event.target.target_name}".encode()
+        return self._workers[zlib.crc32(key) % self.size]
+
+    async def _send(self, worker: _Worker, event: BaseDispatcherEvent):
+        seq = next(self._seq)
+        try:
+            frame = _frame(("event", seq, _event_state(event)))
+        except Exception:
+            _LOGGER.exception("Can't pass %r to a worker", event)
+            await self._finish(event)
+            return
+        if worker.writer is None:
+            worker.backlog.append((seq, frame, event))
+            return
+        worker.sent[seq] = event
+        worker.writer.write(frame)
+        try:
+            await worker.writer.drain()
+        except ConnectionError:
+            pass  # Процесс упал: его эвенты учтет _reap
+
+    async def _finish(self, event: BaseDispatcherEvent, ack: bool = True):
+        """Подтверждает эвент источнику или, если ack=False, возвращает его (nack)"""
+        try:
+            if ack and event.ack is not None:
+                await event.ack()
+            elif not ack and event.nack is not None:
+                await event.nack(True)
+        except Exception:
+            _LOGGER.warning("Can't settle %r", event, exc_info=True)
+        finally:
+            self._events_queue.task_done()
+
+    async def _supervise(self, worker: _Worker):
+        """Запускает процесс воркера и перезапускает его после падения"""
+        attempt = 0
+        while not self._stopping:
+            self._spawn(worker)
+            worker.reader, worker.writer = await asyncio.open_unix_connection(sock=worker.sock)
+            while worker.backlog:
+                seq, frame, event = worker.backlog.popleft()
+                worker.sent[seq] = event
+                worker.writer.write(frame)
+            healthy = await self._read(worker)
+            await self._reap(worker)
+            if self._stopping:
+                break
+            attempt = 0 if healthy else attempt + 1
+            self.restarts += 1
+            await asyncio.sleep(self.backoff.delay(attempt))
+
+    def _spawn(self, worker: _Worker):
+        parent_sock, child_sock = socket.socketpair()
+        # Дочерний процесс закрывает копии родительских сокетов, иначе воркеры
+        # не узнают о завершении родителя (EOF), а упавший воркер - о завершении соседа
+        inherited = [other.sock for other in self._workers if other.sock is not None]
+        inherited.append(parent_sock)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.actuator, child_sock, inherited, self.metrics_interval, self.registry),
+            name=f"{self.actuator.client_info.name}-worker-{worker.index}",
+            daemon=False,  # Воркер может запускать ProcessPoolExecutor для EXECUTOR = "process"
+        )
+        process.start()
+        child_sock.close()
+        worker.process, worker.sock = process, parent_sock
+        _LOGGER.info("Worker %d started, pid %d", worker.index, process.pid)
+
+    async def _read(self, worker: _Worker) -> bool:
+        """Читает ответы воркера до EOF. True, если воркер выполнил хотя бы один эвент"""
+        healthy = False
+        while 1:
+            message = await _read_frame(worker.reader)
+            if message is None:
+                return healthy
+            if message[0] == "done":
+                healthy = True
+                event = worker.sent.pop(message[1], None)
+                if event is not None:
+                    await self._finish(event)
+            elif message[0] == "metrics":
+                self.registry.set_remote(worker.index, message[1])
+
+    async def _reap(self, worker: _Worker):
+        process = worker.process
+        await asyncio.get_event_loop().run_in_executor(None, process.join)
+        worker.writer.close()
+        worker.sock = worker.reader = worker.writer = None
+        self.registry.retire_remote(worker.index)
+        lost, worker.sent = worker.sent, {}
+        if process.exitcode or lost:
+            _LOGGER.error(
+                "Worker %d (pid %d) exited with code %s, %d events lost",
+                worker.index,
+                process.pid,
+                process.exitcode,
+                len(lost),
+            )
+        # Без nack неподтвержденное сообщение AMQP занимало бы место prefetch до переподключения
+        self.lost += len(lost)
+        for event in lost.values():
+            await self._finish(event, ack=False)
+
+    def _close_sockets(self):
+        for worker in self._workers:
+            if worker.sock is not None:
+                worker.sock.close()
+
+    async def stop(self, timeout: float):
+        """
+        Останавливает воркеры: каждый выполняет уже переданные ему эвенты (не дольше timeout),
+        закрывает паблишеры и присылает последние метрики
+        """
+        self._stopping = True
+        tasks = [worker.task for worker in self._workers if worker.task is not None]
+        for worker in self._workers:
+            if worker.writer is not None:
+                worker.writer.write(_frame(("stop", timeout)))
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout + self.stop_grace)
+            for worker in self._workers:
+                if worker.task not in pending:
+                    continue
+                if worker.process is not None and worker.process.is_alive():
+                    # SIGKILL: SIGTERM воркеры игнорируют, а зависший loop не прочтет "stop"
+                    _LOGGER.warning("Worker %d did not stop in time, kill it", worker.index)
+                    worker.process.kill()
+                else:
+                    worker.task.cancel()  # Ждет перезапуска
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for worker in self._workers:
+            while worker.backlog:
+                await self._finish(worker.backlog.popleft()[2], ack=False)
+
+
+def _worker_main(actuator, sock, inherited, metrics_interval: float, registry: MetricsRegistry):
+    """Точка входа дочернего процесса (после fork)"""
+    for parent_sock in inherited:
+        parent_sock.close()
+    # Остановкой управляет родитель: сигналы терминала и SIGTERM приходят всей группе процессов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        signal.set_wakeup_fd(-1)  # Принадлежит event loop родителя
+    except ValueError:
+        pass
+    # Процесс создан из работающего event loop: он остался в копии потока
+    asyncio.events._set_running_loop(None)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    registry.reset()  # Значения родителя уже учтены в нем самом
+    for publisher in actuator.dispatcher.publishers:
+        publisher.after_fork()
+    try:
+        loop.run_until_complete(_serve_worker(actuator, sock, metrics_interval, registry))
+    finally:
+        loop.close()
+
+
+async def _serve_worker(actuator, sock, metrics_interval: float, registry: MetricsRegistry):
+    dispatcher = actuator.dispatcher
+    reader, writer = await asyncio.open_unix_connection(sock=sock)
+    queue = actuator.create_events_queue(maxsize=0)  # Размер ограничивает очередь родителя
+    actuator.set_gauges(lambda: dispatcher.waiting, lambda: dispatcher.in_flight)
+
+    async def done(seq: int):
+        writer.write(_frame(("done", seq)))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass  # Родитель завершился
+
+    async def push_metrics():
+        while 1:
+            await asyncio.sleep(metrics_interval)
+            writer.write(_frame(("metrics", registry.snapshot())))
+
+    reader_task = asyncio.ensure_future(dispatcher.events_reader(events_queue=queue))
+    metrics_task = asyncio.ensure_future(push_metrics())
+    timeout = actuator.shutdown_timeout  # Если родитель завершился без команды stop
+    while 1:
+        message = await _read_frame(reader)
+        if message is None:
+            break
+        if message[0] == "stop":
+            timeout = message[1]
+            break
+        _, seq, state = message
+        event = _restore_event(state)
+        event.ack = functools.partial(done, seq)
+        queue.put_nowait(event)
+
+    if queue.unfinished:
+        try:
+            await asyncio.wait_for(queue.join(), timeout)
+        except asyncio.TimeoutError:
+            _LOGGER.warning("%d events were not processed, cancel them", queue.unfinished)
+    for task in (metrics_task, reader_task):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    await dispatcher.cancel_pending()
+    dispatcher.executors.shutdown(wait=False)
+    for publisher in dispatcher.publishers:
+        try:
+            await publisher.close()
+        except Exception:
+            _LOGGER.warning("Can't close publisher %r", publisher, exc_info=True)
+    if dispatcher.tracer is not None:
+        await dispatcher.tracer.close()
+    try:
+        writer.write(_frame(("metrics", registry.snapshot())))
+        await writer.drain()
+        writer.close()
+    except ConnectionError:
+        pass
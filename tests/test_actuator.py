@@ -0,0 +1,142 @@
+import asyncio
+import json
+
+import pytest
+
+from cba.actuator import Actuator
+from cba.commands import BaseCommand
+from cba.consumers import AMQPConsumer
+from cba.dispatcher import CommandsDispatcher
+from cba.publishers import BasePublisher
+from cba.queues import OverloadPolicy
+from cba.testing import FakeAMQPBroker
+
+
+MESSAGE = json.dumps(
+    {
+        "command": "slow",
+        "target": {"target_type": "user", "target_name": "1"},
+        "behavior": "user",
+        "args": {},
+    }
+).encode()
+
+
+class ClosingPublisher(BasePublisher):
+    def __init__(self):
+        self.messages = []
+        self.closed = False
+
+    async def publish_message(self, message):
+        assert not self.closed
+        self.messages.append(message)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def actuator():
+    dispatcher = CommandsDispatcher()
+
+    @dispatcher.register_callable_command
+    class Slow(BaseCommand):
+        CMD = "slow"
+        delay = 0.05
+
+        async def _execute(self):
+            await asyncio.sleep(self.delay)
+            await self.send_message(text="done")
+
+    broker = FakeAMQPBroker()
+    actuator = Actuator(
+        "test",
+        consumer=AMQPConsumer(queue="commands", connect=broker.connect),
+        dispatcher=dispatcher,
+        publishers=ClosingPublisher(),
+    )
+    actuator.broker = broker
+    actuator.command = Slow
+    yield actuator
+
+
+async def wait_for(condition, timeout: float = 1):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_event_loop().time() < deadline
+        await asyncio.sleep(0.005)
+
+
+class TestShutdown:
+    @pytest.mark.asyncio
+    async def test_drains_in_flight_commands(self, actuator):
+        broker, publisher = actuator.broker, actuator.publishers
+        for _ in range(3):
+            broker.publish("commands", MESSAGE)
+        actuator.start()
+        await wait_for(lambda: actuator.dispatcher.in_flight == 3)
+
+        await actuator.shutdown(timeout=1)
+        assert len(publisher.messages) == 3
+        assert len(broker.acked) == 3
+        assert publisher.closed
+        assert not broker.connections
+        assert all(task.done() for task in actuator.tasks)
+
+        # После остановки новые сообщения не принимаются
+        broker.publish("commands", MESSAGE)
+        assert len(broker.queues["commands"]) == 1
+
+    @pytest.mark.asyncio
+    async def test_deadline_cancels_commands(self, actuator):
+        actuator.command.delay = 10
+        broker = actuator.broker
+        broker.publish("commands", MESSAGE)
+        actuator.start()
+        await wait_for(lambda: actuator.dispatcher.in_flight == 1)
+
+        await asyncio.wait_for(actuator.shutdown(timeout=0.05), 1)
+        assert not broker.acked
+        assert actuator.dispatcher.in_flight == 0
+        # Невыполненная команда вернулась в очередь для другой реплики
+        assert len(broker.queues["commands"]) == 1
+
+    @pytest.mark.asyncio
+    async def test_shutdown_is_shared(self, actuator):
+        actuator.start()
+        await asyncio.sleep(0.01)
+        await asyncio.gather(actuator.shutdown(), actuator.shutdown())
+        assert actuator.shutting_down
+
+
+@pytest.mark.parametrize(
+    "options", [{"prioritized": True}, {"overload_policy": OverloadPolicy.DROP_OLDEST}]
+)
+def test_ordered_targets_conflicts(options):
+    with pytest.raises(ValueError):
+        Actuator(
+            "test",
+            consumer=AMQPConsumer(queue="commands"),
+            dispatcher=CommandsDispatcher(ordered_targets=True),
+            **options,
+        )
+
+
+@pytest.mark.asyncio
+async def test_dropped_amqp_events_are_settled(actuator):
+    broker = actuator.broker
+    actuator.consumer = AMQPConsumer(queue="commands", connect=broker.connect, prefetch_count=3)
+    actuator.dispatcher.max_concurrency = 1
+    actuator.queue_maxsize = 2
+    actuator.overload_policy = OverloadPolicy.DROP_OLDEST
+    for _ in range(3):
+        broker.publish("commands", MESSAGE)
+    actuator.start()
+    await wait_for(lambda: len(broker.acked) == 2)
+
+    # Выброшенное сообщение отклонено, а не висит неподтвержденным, занимая место prefetch
+    assert actuator.events_queue.dropped == 1
+    assert broker.rejected == [MESSAGE]
+    assert not broker.queues["commands"]
+    assert not any(channel.unacked for channel in broker.connections[0].channels)
+    await actuator.shutdown(timeout=1)
@@ -0,0 +1,183 @@
+import asyncio
+
+import pytest
+
+from cba.caching import ResultCache, SingleFlight
+from cba.commands import BaseCommand
+from cba.dispatcher import BaseDispatcherEvent, CommandsDispatcher
+from cba.helpers import ClientInfo
+from cba.messages import MessageTarget
+from cba.publishers import BasePublisher
+
+
+class CollectingPublisher(BasePublisher):
+    def __init__(self):
+        self.messages = []
+
+    async def publish_message(self, message):
+        self.messages.append(message)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def setup(clock):
+    publisher = CollectingPublisher()
+    d = CommandsDispatcher(result_cache=ResultCache(max_entries=2, clock=clock))
+    d.introduce(ClientInfo("test"))
+    d.set_publishers(publisher)
+    calls = []
+
+    @d.register_callable_command
+    class Status(BaseCommand):
+        CMD = "status"
+        CACHE_TTL = 60
+
+        async def _execute(self):
+            calls.append(self.command_args)
+            await self.send_message(text=f"status {len(calls)}")
+
+    @d.register_callable_command
+    class Restart(BaseCommand):
+        CMD = "restart"
+        INVALIDATES = ("status",)
+
+        async def _execute(self):
+            ...
+
+    return d, publisher, calls
+
+
+def make_event(command: str, user: str = "1", **args):
+    return BaseDispatcherEvent(command, MessageTarget("user", user), args, "user")
+
+
+class TestResultCache:
+    @pytest.mark.asyncio
+    async def test_replay_to_new_target(self, setup):
+        d, publisher, calls = setup
+        await d.dispatch(make_event("status", "1"))
+        await d.dispatch(make_event("status", "2"))
+        assert len(calls) == 1
+        assert [m.target.target_name for m in publisher.messages] == ["1", "2"]
+        assert publisher.messages[0].payload["text"] == publisher.messages[1].payload["text"]
+        assert publisher.messages[0].payload["id"] != publisher.messages[1].payload["id"]
+        assert (d.result_cache.hits, d.result_cache.misses) == (1, 1)
+
+    @pytest.mark.asyncio
+    async def test_ttl_and_args(self, setup, clock):
+        d, publisher, calls = setup
+        await d.dispatch(make_event("status"))
+        await d.dispatch(make_event("status", host="db"))
+        assert len(calls) == 2
+        clock.now = 60
+        await d.dispatch(make_event("status"))
+        assert len(calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_lru(self, setup):
+        d, publisher, calls = setup
+        for host in ("a", "b", "a", "c", "a"):
+            await d.dispatch(make_event("status", host=host))
+        assert [args["host"] for args in calls] == ["a", "b", "c"]
+        assert len(d.result_cache) == 2
+
+    @pytest.mark.asyncio
+    async def test_invalidation(self, setup):
+        d, publisher, calls = setup
+        await d.dispatch(make_event("status"))
+        await d.dispatch(make_event("restart"))
+        await d.dispatch(make_event("status"))
+        assert len(calls) == 2
+        assert d.result_cache.invalidate() == 1
+        assert len(d.result_cache) == 0
+
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_coalescing(self):
+        publisher = CollectingPublisher()
+        d = CommandsDispatcher(coalesce=True)
+        d.introduce(ClientInfo("test"))
+        d.set_publishers(publisher)
+        release = asyncio.Event()
+        calls = []
+
+        @d.register_callable_command
+        class Alert(BaseCommand):
+            CMD = "alert"
+
+            async def _execute(self):
+                calls.append(self.target)
+                await release.wait()
+                await self.send_message(text="alert details")
+                return "done"
+
+        runs = [
+            asyncio.ensure_future(d.dispatch(make_event("alert", str(user)))) for user in range(10)
+        ]
+        await asyncio.sleep(0)
+        assert d.single_flight.in_flight == 1
+        release.set()
+        assert await asyncio.gather(*runs) == ["done"] * 10
+        assert len(calls) == 1
+        assert sorted(m.target.target_name for m in publisher.messages) == [
+            str(user) for user in range(10)
+        ]
+        assert d.single_flight.coalesced == 9
+        assert d.single_flight.in_flight == 0
+
+        # Новое выполнение после завершения предыдущего не объединяется
+        await d.dispatch(make_event("alert"))
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_leader_cancelled(self):
+        flight = SingleFlight()
+        release = asyncio.Event()
+        executed = []
+
+        async def execute(cmd):
+            executed.append(cmd)
+            await release.wait()
+            return cmd.CMD
+
+        first, second = make_command("1"), make_command("2")
+        leader = asyncio.ensure_future(flight.run(first, execute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.run(second, execute))
+        await asyncio.sleep(0)
+        assert len(executed) == 1
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        # Ожидавшая команда выполняется сама
+        assert await follower == "cmd"
+        assert executed == [first, second]
+
+
+class Cmd(BaseCommand):
+    CMD = "cmd"
+
+    async def _execute(self):
+        ...
+
+
+def make_command(user: str):
+    return Cmd(
+        target=MessageTarget("user", user),
+        client_info=ClientInfo("test"),
+        publishers=[],
+        command_args={},
+    )
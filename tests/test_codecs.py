@@ -0,0 +1,50 @@
+import pytest
+
+from cba.codecs import *
+from cba.consumers import ServerSentEvent, SSEEventParser
+from cba.messages import MessageTarget, TelegramMessage
+from cba.publishers import HTTPPublisher
+
+
+@pytest.fixture(params=available_codecs())
+def codec(request):
+    yield get_codec(request.param)
+
+
+class TestCodecs:
+    def test_roundtrip(self, codec: JSONCodec):
+        obj = {"text": "Привет", "images": ["aGVsbG8="], "nested": {"list": [1, 2.5, None]}}
+        encoded = codec.dumps(obj)
+        assert isinstance(encoded, bytes)
+        assert codec.loads(encoded) == obj
+        assert codec.loads(encoded.decode()) == obj
+
+    def test_decode_error(self, codec: JSONCodec):
+        with pytest.raises(DecodeError):
+            codec.loads(b'"client_name": "hentest"}')
+
+    def test_sse_data(self, codec: JSONCodec):
+        sse = ServerSentEvent("slave", b'{"command": "cmd"}', "", None)
+        assert SSEEventParser.from_sse(sse, codec).data == {"command": "cmd"}
+
+    def test_unknown_codec(self):
+        with pytest.raises(ValueError):
+            get_codec("pickle")
+
+    def test_default_is_fastest(self):
+        assert default_codec.name == available_codecs()[0]
+
+    @pytest.mark.asyncio
+    async def test_http_publisher_sends_bytes(self, codec: JSONCodec, mocker):
+        publisher = HTTPPublisher(url="", headers={"Authorization": "token"})
+        publisher.codec = codec
+        post = mocker.patch.object(HTTPPublisher, "_post_http")
+        message = TelegramMessage("1", "cmd", "test", target=MessageTarget("user", "1"), text="Hi")
+        await publisher.publish_message(message)
+
+        body = post.call_args.kwargs["data"]
+        assert codec.loads(body)["payload"] == message.payload
+        assert post.call_args.kwargs["headers"] == {
+            "Content-Type": "application/json",
+            "Authorization": "token",
+        }
@@ -1,9 +1,14 @@
 import asyncio
+import httpx
 import pytest
+import time
 
+from cba.commands import BaseCommand
 from cba.consumers import *
-from cba.dispatcher import BaseDispatcherEvent
+from cba.dispatcher import BaseDispatcherEvent, CommandsDispatcher
+from cba.helpers import ClientInfo
 from cba.messages import MessageTarget
+from cba.testing import FakeAMQPBroker, FakeControlBot
 
 
 class TestSseEventParser:
@@ -90,3 +95,367 @@ class TestSseConsumer:
             return events_queue
 
         yield _get_events
+
+
+class TestSseStreamParser:
+
+    test_event = TestSseConsumer.test_event
+
+    @pytest.mark.parametrize("line_end", ["\r\n", "\n", "\r"])
+    def test_line_endings(self, line_end: str):
+        raw = self.test_event.replace("\r\n", line_end) + line_end * 2
+        events = SSEStreamParser().feed(raw.encode())
+        assert len(events) == 1
+        assert events[0].event == "slave"
+        assert SSEEventParser.from_sse(events[0])().args == {"arg1": "321", "arg2": "qwerty"}
+
+    @pytest.mark.parametrize("chunk_size", [1, 2, 7, 64])
+    def test_event_split_between_chunks(self, chunk_size: int):
+        raw = ((self.test_event + "\r\n\r\n") * 3).encode()
+        parser = SSEStreamParser()
+        events = []
+        for i in range(0, len(raw), chunk_size):
+            events.extend(parser.feed(raw[i : i + chunk_size]))
+        assert len(events) == 3
+        assert all(
+            SSEEventParser.from_sse(event)().command == "HumanCallableArgs" for event in events
+        )
+
+    def test_multibyte_symbol_split_between_chunks(self):
+        raw = 'event: slave\ndata: {"text": "Привет"}\n\n'.encode()
+        parser = SSEStreamParser()
+        events = parser.feed(raw[:30]) + parser.feed(raw[30:])
+        assert events[0].data.decode() == '{"text": "Привет"}'
+
+    def test_id_retry_and_comments(self):
+        parser = SSEStreamParser()
+        events = parser.feed(
+            b": heartbeat\n\nid: 42\nretry: 3000\nevent: start\ndata: a\ndata: b\n\n"
+        )
+        assert events == [ServerSentEvent("start", b"a\nb", "42", 3000)]
+        assert parser.last_event_id == "42"
+        assert parser.retry == 3000
+
+    def test_incomplete_event_is_kept(self):
+        parser = SSEStreamParser()
+        assert parser.feed(b"event: slave\ndata: 1") == []
+        assert parser.feed(b"\n\n") == [ServerSentEvent("slave", b"1", "", None)]
+
+
+class TestProcessedEvents:
+    def test_lru_limit(self):
+        processed = ProcessedEvents(limit=2)
+        for event_id in ("1", "2", "3"):
+            processed.add(event_id)
+        assert "1" not in processed
+        assert "3" in processed
+        assert processed.last == "3"
+
+    def test_persistence(self, tmp_path):
+        file_name = str(tmp_path / "processed.txt")
+        processed = ProcessedEvents(limit=3, file_name=file_name)
+        for event_id in range(10):  # Файл несколько раз сожмется
+            processed.add(str(event_id))
+
+        restored = ProcessedEvents(limit=3, file_name=file_name)
+        assert len(restored) == 3
+        assert "9" in restored and "6" not in restored
+        assert restored.last == "9"
+
+    @pytest.mark.asyncio
+    async def test_batched_writes(self, tmp_path):
+        file_name = tmp_path / "processed.txt"
+        processed = ProcessedEvents(limit=10, file_name=str(file_name), flush_interval=0.01)
+        for event_id in ("1", "2", "3"):
+            processed.add(event_id)
+        assert not file_name.exists()  # Запись отложена и делается одной пачкой
+
+        await asyncio.sleep(0.05)
+        assert file_name.read_text() == "1\n2\n3\n"
+        file = processed._file
+        processed.add("4")
+        await processed.close()
+        assert file_name.read_text() == "1\n2\n3\n4\n"
+        assert file.closed
+
+
+class TestSseConsumerResume:
+    @staticmethod
+    def sse_event(event_id: str) -> ServerSentEvent:
+        return ServerSentEvent(
+            "slave", TestSseConsumer.test_event.split("data: ")[1], event_id, None
+        )
+
+    @pytest.mark.asyncio
+    async def test_duplicate_events_skipped(self):
+        consumer = SSEConsumer("")
+        queue = asyncio.Queue()
+        for event_id in ("1", "2", "1"):
+            await consumer.callback(self.sse_event(event_id), queue)
+        assert queue.qsize() == 2
+        assert consumer.last_event_id == "2"
+        assert consumer._request_headers() == {"Last-Event-ID": "2"}
+
+    @pytest.mark.asyncio
+    async def test_events_without_id_not_deduplicated(self):
+        consumer = SSEConsumer("")
+        queue = asyncio.Queue()
+        for _ in range(2):
+            await consumer.callback(self.sse_event(""), queue)
+        assert queue.qsize() == 2
+        assert consumer._request_headers() == {}
+
+    @pytest.mark.asyncio
+    async def test_resume_after_restart(self, tmp_path):
+        file_name = str(tmp_path / "processed.txt")
+        consumer = SSEConsumer("", processed_events_file=file_name)
+        await consumer.callback(self.sse_event("7"), asyncio.Queue())
+        await consumer.close()
+
+        restarted = SSEConsumer("", processed_events_file=file_name)
+        queue = asyncio.Queue()
+        await restarted.callback(self.sse_event("7"), queue)
+        assert queue.empty()
+        assert restarted.last_event_id == "7"
+
+
+class TestReconnect:
+    def test_backoff(self):
+        backoff = ReconnectBackoff(first_delay=0.5, base_delay=1, max_delay=5, factor=2, jitter=0.5)
+        assert 0 <= backoff.delay(0) <= 0.5
+        assert 2 <= backoff.delay(3) <= 4
+        assert 2.5 <= backoff.delay(10) <= 5
+        assert 1.5 <= backoff.delay(1, base_delay=3) <= 3
+
+    def test_stats(self):
+        stats = ConnectionStats()
+        stats.on_connected()
+        stats.on_disconnected()
+        stats.on_reconnect_attempt()
+        stats.on_disconnected()  # Неудачная попытка - тот же инцидент
+        stats.on_reconnect_attempt()
+        assert not stats.connected
+        stats.on_connected()
+        assert stats.connected
+        assert stats.disconnects == 1
+        assert stats.reconnect_attempts == 2
+        assert stats.last_incident.attempts == 2
+        assert stats.total_downtime == stats.last_incident.downtime >= 0
+
+    @pytest.mark.asyncio
+    async def test_listen_reconnects_with_one_client(self):
+        requests_headers = []
+
+        async def app(scope, receive, send):
+            requests_headers.append(dict(scope["headers"]))
+            body = f"id: {len(requests_headers)}\r\n{TestSseConsumer.test_event}\r\n\r\n"
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": body.encode()})
+
+        client = httpx.AsyncClient(app=app, base_url="http://test")
+        consumer = SSEConsumer(
+            "http://test/sse/test/events",
+            client=client,
+            backoff=ReconnectBackoff(first_delay=0, base_delay=0),
+        )
+        queue = asyncio.Queue()
+        listen = asyncio.ensure_future(consumer.listen(queue))
+        for _ in range(3):
+            await asyncio.wait_for(queue.get(), 1)
+        listen.cancel()
+        await client.aclose()
+
+        assert b"last-event-id" not in requests_headers[0]
+        assert requests_headers[2][b"last-event-id"] == b"2"
+        assert consumer.client is client
+        assert consumer.stats.connects >= 3
+        assert consumer.stats.reconnect_attempts >= 2
+
+
+class TestSseConsumerPool:
+    @pytest.mark.asyncio
+    async def test_events_routed_to_own_queues(self):
+        async def app(scope, receive, send):
+            actuator_name = scope["path"].split("/")[2]
+            event = TestSseConsumer.test_event.replace("HumanCallableArgs", actuator_name)
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": f"{event}\r\n\r\n".encode()})
+
+        client = httpx.AsyncClient(app=app)
+        pool = SSEConsumerPool("http://test/sse/{}/events", client=client)
+        queues = {name: asyncio.Queue() for name in ("first", "second")}
+        tasks = [
+            asyncio.ensure_future(pool.consumer(name).listen(queue))
+            for name, queue in queues.items()
+        ]
+        for name, queue in queues.items():
+            event = await asyncio.wait_for(queue.get(), 1)
+            assert event.command == name
+        for task in tasks:
+            task.cancel()
+        await pool.close()
+        await client.aclose()
+
+        assert all(consumer.client is client for consumer in pool.consumers)
+
+    def test_consumer_url(self):
+        pool = SSEConsumerPool("http://localhost:8081/sse/{}/events", http2=False)
+        assert pool.consumer("echo").url == "http://localhost:8081/sse/echo/events"
+        assert pool.consumer(sse_url="http://other/").url == "http://other/"
+
+
+class TestParseEvent:
+    def test_command_event(self):
+        sse = SSEStreamParser().feed(f"id: 5\r\n{TestSseConsumer.test_event}\r\n\r\n".encode())[0]
+        event = parse_event(sse)
+        assert isinstance(event, BaseDispatcherEvent)
+        assert event.command == "HumanCallableArgs"
+        assert event.target == MessageTarget("user", "172698654")
+        assert event.args == {"arg1": "321", "arg2": "qwerty"}
+        assert event.behavior == "user"
+        assert event.id == "5"
+
+    @pytest.mark.parametrize(
+        "sse",
+        [
+            ServerSentEvent("message", b'{"command": "cmd"}', "", None),
+            ServerSentEvent("slave", b'"client_name": "hentest"}', "", None),
+        ],
+    )
+    def test_not_command_event(self, sse: ServerSentEvent):
+        assert parse_event(sse) is None
+
+    def test_event_has_no_dict(self):
+        event = BaseDispatcherEvent("cmd", MessageTarget("user", "1"), {}, "user")
+        assert not hasattr(event, "__dict__")
+
+    def test_long_line_in_many_chunks(self):
+        image = "A" * 100000
+        raw = f'event: slave\ndata: {{"image": "{image}"}}\n\n'.encode()
+        parser = SSEStreamParser()
+        events = []
+        for i in range(0, len(raw), 1000):
+            events.extend(parser.feed(raw[i : i + 1000]))
+        assert SSEEventParser.from_sse(events[0]).data == {"image": image}
+
+
+class TestStreamHealth:
+    @pytest.mark.asyncio
+    async def test_lag(self):
+        consumer = SSEConsumer("")
+        data = TestSseConsumer.test_event.split("data: ")[1][:-1] + f', "ts": {time.time() - 5}}}'
+        await consumer.callback(ServerSentEvent("slave", data.encode(), "", None), asyncio.Queue())
+        assert 5 <= consumer.stats.last_lag < 6
+        assert consumer.stats.max_lag == consumer.stats.avg_lag == consumer.stats.last_lag
+        assert consumer.seconds_since_last_event < 1
+
+    @pytest.mark.asyncio
+    async def test_stalled_stream_reconnected(self):
+        async with FakeControlBot(rate=0, heartbeat=60) as bot:
+            consumer = SSEConsumer(
+                bot.sse_url("test"),
+                stall_timeout=0.2,
+                backoff=ReconnectBackoff(first_delay=0, base_delay=0),
+            )
+            listen = asyncio.ensure_future(consumer.listen(asyncio.Queue()))
+            await asyncio.sleep(0.7)
+            listen.cancel()
+            await consumer.close()
+        assert consumer.stats.stalls >= 2
+        assert consumer.stats.connects >= 2
+
+    @pytest.mark.asyncio
+    async def test_heartbeats_keep_stream_alive(self):
+        async with FakeControlBot(rate=0, heartbeat=0.05) as bot:
+            consumer = SSEConsumer(bot.sse_url("test"), stall_timeout=0.3)
+            listen = asyncio.ensure_future(consumer.listen(asyncio.Queue()))
+            await asyncio.sleep(0.7)
+            listen.cancel()
+            await consumer.close()
+        assert consumer.stats.stalls == 0
+        assert consumer.stats.heartbeats > 0
+        assert consumer.seconds_since_last_byte < 0.3
+
+
+class TestAMQPConsumer:
+    message = TestSseConsumer.test_event.split("data: ")[1].replace("HumanCallableArgs", "amqpTest")
+
+    @pytest.fixture
+    def dispatcher(self):
+        d = CommandsDispatcher()
+        d.introduce(ClientInfo("test"))
+
+        @d.register_callable_command
+        class AmqpTestCommand(BaseCommand):
+            """Команда для тестов AMQPConsumer"""
+
+            CMD = "amqpTest"
+            executed = []
+            delay = 0.02
+
+            async def _execute(self):
+                await asyncio.sleep(self.delay)
+                self.executed.append(self.command_args)
+
+        d.test_command = AmqpTestCommand
+        yield d
+
+    @staticmethod
+    async def run(consumer: AMQPConsumer, dispatcher: CommandsDispatcher, until, timeout=2):
+        queue = asyncio.Queue()
+        tasks = [
+            asyncio.ensure_future(consumer.listen(queue)),
+            asyncio.ensure_future(dispatcher.events_reader(queue)),
+        ]
+        deadline = time.monotonic() + timeout
+        while not until() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await consumer.close()
+
+    @pytest.mark.asyncio
+    async def test_prefetch_and_ack_after_execute(self, dispatcher):
+        broker = FakeAMQPBroker()
+        for number in range(6):
+            broker.publish("commands", self.message.encode(), message_id=str(number))
+        consumer = AMQPConsumer(queue="commands", prefetch_count=2, connect=broker.connect)
+
+        await self.run(consumer, dispatcher, lambda: len(broker.acked) == 6)
+
+        assert len(dispatcher.test_command.executed) == 6
+        assert broker.max_unacked == 2
+        assert not broker.queues["commands"]
+
+    @pytest.mark.asyncio
+    async def test_unfinished_command_redelivered(self, dispatcher):
+        dispatcher.test_command.delay = 0.2
+        broker = FakeAMQPBroker()
+        broker.publish("commands", self.message.encode())
+        consumer = AMQPConsumer(
+            queue="commands",
+            connect=broker.connect,
+            backoff=ReconnectBackoff(first_delay=0, base_delay=0),
+        )
+
+        def crash_once():
+            if broker.connections and broker.connections[0].channels[0].unacked:
+                if consumer.stats.connects == 1:
+                    broker.connections[0]._lost()  # Актуатор упал во время выполнения
+            return len(broker.acked) == 1
+
+        await self.run(consumer, dispatcher, crash_once)
+
+        assert consumer.stats.connects == 2
+        assert len(broker.acked) == 1
+
+    @pytest.mark.asyncio
+    async def test_bad_message_rejected(self, dispatcher):
+        broker = FakeAMQPBroker()
+        broker.publish("commands", b"not json")
+        consumer = AMQPConsumer(queue="commands", connect=broker.connect)
+
+        await self.run(consumer, dispatcher, lambda: broker.rejected)
+
+        assert broker.rejected == [b"not json"]
+        assert not dispatcher.test_command.executed
@@ -1,15 +1,23 @@
+import asyncio
 import pytest
 from typing import Type
 
 from cba.commands import (
+    Busy,
     WrongCommand,
     NotEnoughArguments,
     WrongArguments,
     BadJSONTemplateCommand,
     InternalError,
+    Priority,
+    CommandTimeout,
+    Throttled,
 )
 from cba.dispatcher import CommandsDispatcher, ClientInfo, BaseDispatcherEvent, Introduce
-from cba.exceptions import BadCommandTemplateException
+from cba.exceptions import BadCommandTemplateException, DuplicateCommandError
+from cba.messages import MessageTarget, TelegramMessage
+from cba.throttling import RateLimit, RateLimiter
+from cba.queues import EventsQueue
 from conftest import *
 
 
@@ -49,6 +57,40 @@ class TestDispatcher:
 
         assert Cmd in d.service_commands
 
+    def test_register_duplicate_command(self):
+        d = CommandsDispatcher()
+
+        @d.register_callable_command
+        class Cmd(BaseCommand):
+            CMD = "cmd"
+
+        d.register_callable_command(Cmd)
+        assert d.callable_commands.count(Cmd) == 1
+
+        with pytest.raises(DuplicateCommandError):
+
+            @d.register_service_command
+            class OtherCmd(BaseCommand):
+                CMD = "cmd"
+
+    def test_find_command_admin_behavior(self):
+        d = CommandsDispatcher()
+
+        @d.register_callable_command
+        class Cmd(BaseCommand):
+            CMD = "cmdWithBehavior"
+
+        assert d._find_command("cmdWithBehavior", "admin") is Cmd
+        assert d._find_command("unknown", "user") is None
+
+        @Cmd.admin_behavior
+        class CmdAdmin(BaseCommand):
+            ...
+
+        # Индекс поведения сбрасывается при изменении описания команд
+        assert d._find_command("cmdWithBehavior", "admin") is CmdAdmin
+        assert d._find_command("cmdWithBehavior", "user") is Cmd
+
     @pytest.mark.parametrize("str_event, cmd_class", test_str_events)
     def test_get_command(self, str_event: str, cmd_class: Type[BaseCommand]):
         cmd_kwargs, event = get_event_and_cmd_kwargs(str_event)
@@ -104,3 +146,269 @@ class TestDispatcher:
         await dispatcher.dispatch(event_introduce_cmd)
         assert spy.call_count == 1
         assert "commands_" in spy.call_args.kwargs.keys()
+
+    @pytest.mark.asyncio
+    async def test_reject(self, mocker):
+        mocker.patch(f"{Busy.__module__}.{Busy.__name__}._execute")
+        await dispatcher.reject(event_internal_error)
+        Busy._execute.assert_called()
+
+    @pytest.mark.asyncio
+    async def test_events_reader_marks_event_done_after_dispatch(self, mocker):
+        mocker.patch(f"{Introduce.__module__}.{Introduce.__name__}._execute")
+        queue = EventsQueue(1)
+        await queue.put(event_introduce_cmd)
+        reader = asyncio.ensure_future(dispatcher.events_reader(queue))
+        await asyncio.wait_for(queue.join(), 1)
+        reader.cancel()
+        Introduce._execute.assert_called()
+
+    @pytest.mark.asyncio
+    async def test_events_reader_max_concurrency(self):
+        release = asyncio.Event()
+        running = []
+
+        class SlowDispatcher(CommandsDispatcher):
+            async def dispatch(self, event):
+                running.append(event)
+                await release.wait()
+
+        d = SlowDispatcher(max_concurrency=2)
+        queue = EventsQueue()
+        for _ in range(5):
+            await queue.put(event_introduce_cmd)
+        reader = asyncio.ensure_future(d.events_reader(queue))
+        await asyncio.sleep(0.01)
+        assert len(running) == 2
+        assert d.in_flight == 2
+        assert d.waiting == 3
+
+        release.set()
+        await asyncio.wait_for(queue.join(), 1)
+        assert len(running) == 5
+        assert d.in_flight == 0
+        assert d.waiting == 0
+        reader.cancel()
+
+    def test_bad_max_concurrency(self):
+        with pytest.raises(ValueError):
+            CommandsDispatcher(max_concurrency=0)
+
+    @pytest.mark.asyncio
+    async def test_events_reader_ordered_targets(self):
+        started = []
+        finished = []
+
+        class SlowDispatcher(CommandsDispatcher):
+            async def dispatch(self, event):
+                started.append(event.args["n"])
+                # Первый эвент каждого адресата выполняется дольше следующих
+                await asyncio.sleep(0.02 if event.args["n"] % 10 == 0 else 0)
+                finished.append(event.args["n"])
+
+        def make_event(target_name: str, n: int):
+            return BaseDispatcherEvent("cmd", MessageTarget("user", target_name), {"n": n}, "user")
+
+        d = SlowDispatcher(ordered_targets=True)
+        queue = EventsQueue()
+        for n in range(3):
+            await queue.put(make_event("first", n))
+            await queue.put(make_event("second", 10 + n))
+        reader = asyncio.ensure_future(d.events_reader(queue))
+        await asyncio.sleep(0.005)
+        # Адресаты выполняются параллельно, но эвенты адресата - по одному
+        assert sorted(started) == [0, 10]
+        assert d.in_flight == 2
+        assert d.waiting == 4
+        assert d.lanes == 2
+
+        await asyncio.wait_for(queue.join(), 1)
+        assert [n for n in finished if n < 10] == [0, 1, 2]
+        assert [n for n in finished if n >= 10] == [10, 11, 12]
+        assert d.lanes == 0
+        assert d.waiting == 0
+        reader.cancel()
+
+    def test_event_priority(self):
+        d = CommandsDispatcher()
+
+        @d.register_callable_command
+        class Cmd(BaseCommand):
+            CMD = "cmdWithPriority"
+
+        def make_event(command: str, behavior: str = "user"):
+            return BaseDispatcherEvent(command, MessageTarget("user", "1"), {}, behavior)
+
+        assert d.event_priority(make_event("cmdWithPriority")) == Priority.NORMAL
+        assert d.event_priority(make_event("cmdWithPriority", "admin")) == Priority.HIGH
+        assert d.event_priority(make_event("getAvailableMethods")) == Priority.SERVICE
+        assert d.event_priority(make_event("unknown")) == Priority.NORMAL
+
+    @pytest.mark.asyncio
+    async def test_command_timeout(self, mocker):
+        mocker.patch(f"{CommandTimeout.__module__}.{CommandTimeout.__name__}._execute")
+        cancelled = []
+        d = CommandsDispatcher(command_timeout=0.01)
+        d.introduce(ClientInfo("test"))
+
+        @d.register_callable_command
+        class Hung(BaseCommand):
+            CMD = "hung"
+
+            async def _execute(self):
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append(self.CMD)
+                    raise
+
+        @d.register_callable_command
+        class Patient(BaseCommand):
+            CMD = "patient"
+            TIMEOUT = 0
+
+            async def _execute(self):
+                await asyncio.sleep(0.02)
+                return "done"
+
+        def make_event(command: str):
+            return BaseDispatcherEvent(command, MessageTarget("user", "1"), {}, "user")
+
+        assert await d.dispatch(make_event("hung")) is None
+        assert cancelled == ["hung"]
+        assert d.timeouts == {"hung": 1}
+        CommandTimeout._execute.assert_called_once()
+        assert await d.dispatch(make_event("patient")) == "done"
+
+    @pytest.mark.asyncio
+    async def test_rate_limiter(self, mocker):
+        mocker.patch(f"{Throttled.__module__}.{Throttled.__name__}._execute")
+        get_command = mocker.spy(CommandsDispatcher, "_get_command")
+        d = CommandsDispatcher(rate_limiter=RateLimiter(per_target=RateLimit(1, burst=1)))
+        d.introduce(ClientInfo("test"))
+
+        @d.register_callable_command
+        class Tap(BaseCommand):
+            CMD = "tap"
+
+            async def _execute(self):
+                return "done"
+
+        event = BaseDispatcherEvent("tap", MessageTarget("user", "1"), {}, "user")
+        assert await d.dispatch(event) == "done"
+        for _ in range(3):
+            assert await d.dispatch(event) is None
+        # Отклоненные эвенты не создают команд, а уведомление уходит один раз
+        assert get_command.call_count == 1
+        Throttled._execute.assert_called_once()
+
+    def test_commands_catalog(self):
+        d = CommandsDispatcher()
+        d.introduce(ClientInfo("test"))
+
+        @d.register_callable_command
+        class Cmd(BaseCommand):
+            """Команда"""
+
+            CMD = "catalogCmd"
+
+        catalog, version = d.commands_catalog()
+        assert list(catalog) == ["catalogCmd"]
+        # Без изменений описание не пересчитывается
+        assert d.commands_catalog() == (catalog, version)
+        assert d.commands_catalog()[0] is catalog
+
+        Cmd.hide()
+        hidden_catalog, hidden_version = d.commands_catalog()
+        assert hidden_catalog["catalogCmd"]["hidden"]
+        assert hidden_version != version
+
+        Cmd.show()
+        assert d.commands_catalog()[1] == version
+
+        @d.register_callable_command
+        class OtherCmd(BaseCommand):
+            """Другая команда"""
+
+            CMD = "otherCatalogCmd"
+
+        assert list(d.commands_catalog()[0]) == ["catalogCmd", "otherCatalogCmd"]
+
+    @pytest.mark.asyncio
+    async def test_introduce_commands_version(self, mocker, test_publisher):
+        publish = mocker.patch.object(test_publisher, "publish_message")
+        d = CommandsDispatcher()
+        d.introduce(ClientInfo("test"))
+        d.set_publishers(test_publisher)
+
+        @d.register_callable_command
+        class Cmd(BaseCommand):
+            """Команда"""
+
+            CMD = "versionedCmd"
+
+        await d.dispatch(event_introduce_cmd)
+        payload = publish.call_args.args[0].payload
+        assert payload["commands_version"] == d.commands_catalog()[1]
+
+    @pytest.mark.asyncio
+    async def test_middlewares(self, mocker, test_publisher):
+        publish = mocker.patch.object(test_publisher, "publish_message")
+        mocker.patch(f"{WrongCommand.__module__}.{WrongCommand.__name__}._execute")
+        calls = []
+
+        async def outer(event, call_next):
+            calls.append("outer")
+            result = await call_next(event)
+            calls.append(f"outer {result}")
+            return result
+
+        d = CommandsDispatcher(middlewares=[outer])
+        d.introduce(ClientInfo("test"))
+        d.set_publishers(test_publisher)
+        compose = mocker.spy(d, "_compose")
+
+        @d.add_middleware
+        async def auth(event, call_next):
+            calls.append("auth")
+            if event.target.target_name == "stranger":
+                return WrongCommand
+            if event.target.target_name == "guest":
+                return TelegramMessage("1", event.command, "test", target=event.target, text="No")
+            return await call_next(event)
+
+        @d.register_callable_command
+        class Greet(BaseCommand):
+            CMD = "greet"
+
+            async def _execute(self):
+                calls.append("greet")
+                return "hi"
+
+        def make_event(target_name: str):
+            return BaseDispatcherEvent("greet", MessageTarget("user", target_name), {}, "user")
+
+        assert await d.dispatch(make_event("friend")) == "hi"
+        assert calls == ["outer", "auth", "greet", "outer hi"]
+
+        # Ответ middleware вместо выполнения команды
+        assert await d.dispatch(make_event("stranger")) is None
+        WrongCommand._execute.assert_called_once()
+        assert await d.dispatch(make_event("guest")) is None
+        assert publish.call_args.args[0].payload["text"].endswith("No")
+        assert calls.count("greet") == 1
+        # Цепочка собирается один раз
+        assert compose.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_middleware_error(self, mocker):
+        mocker.patch(f"{InternalError.__module__}.{InternalError.__name__}._execute")
+
+        async def broken(event, call_next):
+            raise RuntimeError("broken middleware")
+
+        d = CommandsDispatcher(middlewares=[broken])
+        d.introduce(ClientInfo("test"))
+        with pytest.raises(RuntimeError):
+            await d.dispatch(BaseDispatcherEvent("any", MessageTarget("user", "1"), {}, "user"))
+        InternalError._execute.assert_called_once()
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from cba.commands import BaseCommand, HumanCallableCommandWithArgs, arguments
+from cba.executors import CommandExecutors
+from cba.helpers import ClientInfo
+from cba.messages import MessageTarget
+from cba.publishers import BasePublisher
+from cba.tracing import Trace
+
+
+class CollectingPublisher(BasePublisher):
+    def __init__(self):
+        self.messages = []
+        self.threads = []
+
+    async def publish_message(self, message):
+        self.messages.append(message)
+        self.threads.append(threading.get_ident())
+
+
+class BlockingCommand(BaseCommand):
+    CMD = "blocking"
+    EXECUTOR = "thread"
+
+    async def _execute(self):
+        time.sleep(0.05)  # Синхронный SDK
+        await self.send_message(text=f"thread={threading.get_ident()};")
+        return "done"
+
+
+class HeavyCommand(HumanCallableCommandWithArgs):
+    CMD = "heavy"
+    EXECUTOR = "process"
+    ARGS = (arguments.Integer("n", "n"),)
+
+    async def _execute(self):
+        await self.send_message(text=f"pid={os.getpid()};")
+        return sum(range(self.n))
+
+
+class BrokenCommand(BaseCommand):
+    CMD = "broken"
+    EXECUTOR = "thread"
+
+    async def _execute(self):
+        raise RuntimeError("broken")
+
+
+def make_command(cmd_type, publisher, **command_args):
+    return cmd_type(
+        target=MessageTarget("user", "1"),
+        client_info=ClientInfo("test"),
+        publishers=[publisher],
+        command_args=command_args,
+    )
+
+
+@pytest.fixture
+def executors():
+    executors = CommandExecutors(thread_workers=2, process_workers=1)
+    yield executors
+    executors.shutdown()
+
+
+class TestCommandExecutors:
+    @pytest.mark.asyncio
+    async def test_thread_does_not_block_loop(self, executors):
+        publisher = CollectingPublisher()
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while 1:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker_task = asyncio.ensure_future(ticker())
+        results = await asyncio.gather(
+            *(executors.execute(make_command(BlockingCommand, publisher)) for _ in range(2))
+        )
+        ticker_task.cancel()
+        assert results == ["done", "done"]
+        assert ticks > 3
+        # Команда выполнялась в потоке пула, а сообщения публиковались из loop
+        assert publisher.threads == [threading.get_ident()] * 2
+        for message in publisher.messages:
+            assert f"thread={threading.get_ident()};" not in message.payload["text"]
+        stats = executors.stats["thread"]
+        assert stats.completed == 2
+        assert stats.max_in_flight == 2
+        assert stats.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_thread_is_silenced(self, executors):
+        publisher = CollectingPublisher()
+        command = make_command(BlockingCommand, publisher)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(executors.execute(command), 0.01)
+        assert command.publishers == [publisher]
+        # Поток дорабатывает, но его сообщение уже не публикуется
+        await asyncio.sleep(0.1)
+        assert not publisher.messages
+
+    @pytest.mark.asyncio
+    async def test_process(self, executors):
+        publisher = CollectingPublisher()
+        command = make_command(HeavyCommand, publisher, n=10)
+        assert await executors.execute(command) == 45
+        assert len(publisher.messages) == 1
+        assert f"pid={os.getpid()};" not in publisher.messages[0].payload["text"]
+        assert command.publishers == [publisher]
+        assert executors.stats["process"].completed == 1
+
+    @pytest.mark.asyncio
+    async def test_process_trace(self, executors):
+        command = make_command(HeavyCommand, CollectingPublisher(), n=10)
+        command.trace = Trace()
+        await executors.execute(command)
+        # Этапы из дочернего процесса попадают в трассу эвента
+        assert [span.name for span in command.trace.spans] == ["publish", "execute"]
+        assert command.trace.spans[1].attributes == {"cmd": "heavy"}
+
+    @pytest.mark.asyncio
+    async def test_error(self, executors):
+        with pytest.raises(RuntimeError):
+            await executors.execute(make_command(BrokenCommand, CollectingPublisher()))
+        assert executors.stats["thread"].failed == 1
+
+    @pytest.mark.asyncio
+    async def test_unknown_executor(self, executors):
+        command = make_command(BlockingCommand, CollectingPublisher())
+        command.EXECUTOR = "gpu"
+        with pytest.raises(ValueError):
+            await executors.execute(command)
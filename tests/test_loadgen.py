@@ -0,0 +1,28 @@
+import httpx
+import pytest
+
+from cba.testing import FakeControlBot
+from cba.testing.loadgen import percentile, run_load
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 99) == 0
+
+
+@pytest.mark.asyncio
+async def test_fake_bot_not_found():
+    async with FakeControlBot() as bot:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"{bot.url}/unknown")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_run_load():
+    report = await run_load(rate=50, duration=0.4, payload_size=32, actuators=2)
+    assert report.events_sent == 40
+    assert report.messages_received == 40
+    assert 0 < report.p50 <= report.p95 <= report.p99
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from cba.commands import BaseCommand
+from cba.dispatcher import BaseDispatcherEvent, CommandsDispatcher
+from cba.helpers import ClientInfo
+from cba.messages import MessageTarget
+from cba.metrics import *
+from cba.publishers import BasePublisher
+
+
+class CountingPublisher(BasePublisher):
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.messages = []
+
+    async def publish_message(self, message):
+        if self.fail:
+            raise ConnectionError
+        self.messages.append(message)
+        self._count_bytes(10)
+
+
+class DerivedPublisher(CountingPublisher):
+    async def publish_message(self, message):
+        await super().publish_message(message)
+
+
+class TestRegistry:
+    def test_counter_and_gauge(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("events_total", "Events", ("cmd",))
+        counter.labels("echo").inc()
+        counter.labels("echo").inc(2)
+        assert counter.labels("echo") is counter.labels("echo")
+        gauge = registry.gauge("depth", "Depth")
+        gauge.set(5)
+        live = registry.gauge("live", "Live", ("name",))
+        live.labels('a"b').set_function(lambda: 7)
+
+        text = registry.render()
+        assert '# TYPE events_total counter\nevents_total{cmd="echo"} 3\n' in text
+        assert "depth 5\n" in text
+        assert 'live{name="a\\"b"} 7\n' in text
+
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency", "Latency", buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        text = registry.render()
+        assert 'latency_bucket{le="0.1"} 2\n' in text
+        assert 'latency_bucket{le="1"} 3\n' in text
+        assert 'latency_bucket{le="+Inf"} 4\n' in text
+        assert "latency_sum 3.65\n" in text
+        assert "latency_count 4\n" in text
+
+    def test_reregistration(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("c", "C", ("cmd",))
+        assert registry.counter("c", "C", ("cmd",)) is counter
+        with pytest.raises(ValueError):
+            registry.gauge("c", "C", ("cmd",))
+        with pytest.raises(ValueError):
+            counter.labels("a", "b")
+
+
+class TestWiring:
+    @pytest.mark.asyncio
+    async def test_publisher(self):
+        seconds = REGISTRY.get("cba_publish_seconds")
+        errors = REGISTRY.get("cba_publish_errors_total")
+        sent = REGISTRY.get("cba_publish_bytes_total")
+        before = seconds.labels("DerivedPublisher").count
+        await DerivedPublisher().publish_message(None)
+        # Вызов super().publish_message не учитывается второй раз
+        assert seconds.labels("DerivedPublisher").count == before + 1
+        assert sent.labels("DerivedPublisher").value >= 10
+
+        failed = errors.labels("CountingPublisher").value
+        with pytest.raises(ConnectionError):
+            await CountingPublisher(fail=True).publish_message(None)
+        assert errors.labels("CountingPublisher").value == failed + 1
+
+    @pytest.mark.asyncio
+    async def test_dispatch(self):
+        d = CommandsDispatcher()
+        d.introduce(ClientInfo("test"))
+        d.set_publishers(CountingPublisher())
+
+        @d.register_callable_command
+        class MetricsCommand(BaseCommand):
+            CMD = "metricsCommand"
+
+            async def _execute(self):
+                await asyncio.sleep(0)
+
+        dispatched = REGISTRY.get("cba_dispatch_seconds").labels("metricsCommand", "user")
+        executed = REGISTRY.get("cba_command_seconds").labels("metricsCommand")
+        before = dispatched.count, executed.count
+        event = BaseDispatcherEvent("metricsCommand", MessageTarget("user", "1"), {}, None)
+        await d.dispatch(event)
+        assert (dispatched.count, executed.count) == (before[0] + 1, before[1] + 1)
+        assert 'cba_dispatch_seconds_count{cmd="metricsCommand",behavior="user"}' in (
+            REGISTRY.render()
+        )
+
+
+@pytest.mark.asyncio
+async def test_metrics_server():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc()
+    server = MetricsServer(0, "127.0.0.1", registry)
+    await server.start()
+    try:
+        for path, status in (("/metrics", b"200"), ("/", b"404")):
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            response = await reader.read()
+            writer.close()
+            assert response.split(b"\r\n")[0].split()[1] == status
+            if status == b"200":
+                assert response.endswith(b"requests_total 1\n")
+    finally:
+        await server.close()
@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+
+from cba.queues import *
+
+
+class TestEventsQueue:
+    @pytest.mark.asyncio
+    async def test_block(self):
+        queue = EventsQueue(1)
+        await queue.put(1)
+        queue.get_nowait()  # Эвент взят в работу, но еще не обработан
+        put = asyncio.ensure_future(queue.put(2))
+        await asyncio.sleep(0)
+        assert not put.done()
+
+        queue.task_done()
+        await asyncio.wait_for(put, 1)
+        assert queue.get_nowait() == 2
+
+    @pytest.mark.asyncio
+    async def test_drop_oldest(self):
+        dropped = []
+
+        async def on_drop(event):
+            dropped.append(event)
+
+        queue = EventsQueue(2, overload_policy=OverloadPolicy.DROP_OLDEST, on_drop=on_drop)
+        for event in range(3):
+            await queue.put(event)
+        assert [queue.get_nowait(), queue.get_nowait()] == [1, 2]
+        assert queue.dropped == 1
+        assert dropped == [0]
+
+    @pytest.mark.asyncio
+    async def test_reject(self):
+        rejected = []
+
+        async def on_reject(event):
+            rejected.append(event)
+
+        queue = EventsQueue(1, overload_policy="reject", on_reject=on_reject)
+        await queue.put(1)
+        await queue.put(2)
+        assert queue.qsize() == 1
+        assert rejected == [2]
+        assert queue.rejected == 1
+
+    @pytest.mark.asyncio
+    async def test_high_water_mark(self):
+        queue = EventsQueue()
+        for event in range(3):
+            await queue.put(event)
+        queue.get_nowait()
+        queue.task_done()
+        assert queue.high_water_mark == 3
+        assert queue.reset_high_water_mark() == 3
+        assert queue.high_water_mark == 2
+
+
+class TestPriorityEventsQueue:
+    @pytest.mark.asyncio
+    async def test_priority(self):
+        queue = PriorityEventsQueue(priority=lambda event: event[0])
+        for event in [(0, "a"), (2, "b"), (1, "c"), (2, "d")]:
+            await queue.put(event)
+        assert queue.qsize() == 4
+        assert [queue.get_nowait()[1] for _ in range(4)] == ["b", "d", "c", "a"]
+        assert queue.empty()
+
+    @pytest.mark.asyncio
+    async def test_aging(self, mocker):
+        now = mocker.patch("cba.queues.time.monotonic", return_value=100.0)
+        queue = PriorityEventsQueue(priority=lambda event: event[0], aging=1.0)
+        await queue.put((0, "old"))
+        now.return_value = 103.0
+        await queue.put((2, "new"))
+        # За 3 секунды ожидания приоритет старого эвента вырос до 3
+        assert queue.get_nowait()[1] == "old"
+
+    @pytest.mark.asyncio
+    async def test_drop_lowest(self):
+        queue = PriorityEventsQueue(
+            2, priority=lambda event: event[0], overload_policy=OverloadPolicy.DROP_OLDEST
+        )
+        for event in [(2, "a"), (0, "b"), (1, "c")]:
+            await queue.put(event)
+        assert [queue.get_nowait()[1], queue.get_nowait()[1]] == ["a", "c"]
+        assert queue.dropped == 1
@@ -0,0 +1,64 @@
+import pytest
+
+from cba.throttling import *
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBuckets:
+    def test_refill(self):
+        buckets = TokenBuckets(RateLimit(2, burst=2))
+        assert buckets.acquire("a", 0)
+        assert buckets.acquire("a", 0)
+        assert not buckets.acquire("a", 0)
+        assert buckets.acquire("a", 0.5)
+        assert buckets.tokens("a", 10) == 2
+
+    def test_lru_eviction(self):
+        buckets = TokenBuckets(RateLimit(1), max_buckets=2)
+        for key in "abc":
+            buckets.acquire(key, 0)
+        assert len(buckets) == 2
+        # Ведро "a" вытеснено и создается заново полным
+        assert buckets.acquire("a", 0)
+        assert not buckets.acquire("c", 0)
+
+    def test_bad_limit(self):
+        with pytest.raises(ValueError):
+            RateLimit(0)
+
+
+class TestRateLimiter:
+    def test_scopes(self):
+        clock = FakeClock()
+        limiter = RateLimiter(
+            per_target=RateLimit(1, burst=2),
+            per_command={"report": RateLimit(1, burst=1)},
+            global_limit=RateLimit(10, burst=3),
+            clock=clock,
+        )
+        user, other = ("user", "1"), ("user", "2")
+        assert limiter.check("report", user) is None
+        assert limiter.check("report", other) == RateLimiter.COMMAND
+        assert limiter.check("echo", user) is None
+        assert limiter.check("echo", user) == RateLimiter.TARGET
+        assert limiter.check("echo", other) is None
+        assert limiter.check("echo", ("user", "3")) == RateLimiter.GLOBAL
+        assert limiter.rejected == {"command": 1, "target": 1, "global": 1}
+
+        clock.now = 1
+        assert limiter.check("report", other) is None
+
+    def test_notices(self):
+        clock = FakeClock()
+        limiter = RateLimiter(per_target=RateLimit(1), notice_interval=10, clock=clock)
+        assert limiter.should_notify(("user", "1"))
+        assert not limiter.should_notify(("user", "1"))
+        clock.now = 10
+        assert limiter.should_notify(("user", "1"))
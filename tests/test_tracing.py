@@ -0,0 +1,173 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from cba.commands import BaseCommand, ServiceCommand
+from cba.consumers import ServerSentEvent, SSEConsumer
+from cba.dispatcher import CommandsDispatcher
+from cba.helpers import ClientInfo
+from cba.publishers import BasePublisher
+from cba.tracing import *
+
+
+class CollectingExporter(BaseExporter):
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace, root):
+        self.traces.append((trace, root))
+
+
+class CollectingPublisher(BasePublisher):
+    def __init__(self):
+        self.messages = []
+
+    async def publish_message(self, message):
+        self.messages.append(message)
+
+
+def make_sse(command: str, **data) -> ServerSentEvent:
+    data = {"command": command, "target": {"target_type": "user", "target_name": "1"}, **data}
+    return ServerSentEvent("start", json.dumps(data).encode(), "1", None)
+
+
+class TestTracer:
+    def test_sampling(self):
+        exporter = CollectingExporter()
+        assert Tracer(exporter, sample_rate=0).start_trace() is None
+        tracer = Tracer(exporter, sample_rate=0.5, random_=lambda: 0.3)
+        assert tracer.start_trace().sampled
+        with pytest.raises(ValueError):
+            Tracer(exporter, sample_rate=2)
+
+    def test_slow_threshold(self):
+        exporter = CollectingExporter()
+        tracer = Tracer(exporter, sample_rate=0, slow_threshold=1)
+        fast, slow = tracer.start_trace(), tracer.start_trace()
+        assert not fast.sampled
+        slow.started -= 2
+        assert tracer.finish(fast) is None
+        assert tracer.finish(slow).duration >= 2
+        assert [trace for trace, _ in exporter.traces] == [slow]
+
+    def test_span_error(self):
+        trace = Trace()
+        with pytest.raises(KeyError):
+            with trace.span("execute", cmd="echo"):
+                raise KeyError("x")
+        (span,) = trace.spans
+        assert span.parent_id == trace.root_id
+        assert span.error == "KeyError('x')"
+
+
+@pytest.mark.asyncio
+async def test_event_pipeline():
+    exporter = CollectingExporter()
+    tracer = Tracer(exporter)
+    publisher = CollectingPublisher()
+    dispatcher = CommandsDispatcher(tracer=tracer)
+    dispatcher.introduce(ClientInfo("test"))
+    dispatcher.set_publishers(publisher)
+
+    class Child(ServiceCommand):
+        CMD = "child"
+
+        async def _execute(self):
+            await self.send_message(text="child")
+
+    @dispatcher.register_callable_command
+    class Parent(BaseCommand):
+        CMD = "parent"
+
+        async def _execute(self):
+            await self.create_subcommand(Child).execute()
+
+    consumer = SSEConsumer("http://localhost/sse")
+    consumer.tracer = tracer
+    queue = asyncio.Queue()
+    await consumer.callback(make_sse("parent", ts=time.time() - 1), queue)
+    await dispatcher.process_event(queue.get_nowait())
+
+    ((trace, root),) = exporter.traces
+    assert root.attributes["command"] == "parent"
+    spans = {span.name + span.attributes.get("cmd", ""): span for span in trace.spans}
+    assert set(spans) == {
+        "delivery",
+        "parse",
+        "queue",
+        "resolve",
+        "executeparent",
+        "executechild",
+        "publish",
+    }
+    assert spans["delivery"].duration >= 0.9
+    assert spans["executeparent"].parent_id == trace.root_id
+    assert spans["executechild"].parent_id == spans["executeparent"].span_id
+    assert spans["publish"].parent_id == spans["executechild"].span_id
+    assert spans["publish"].attributes["publisher"] == "CollectingPublisher"
+
+
+@pytest.mark.asyncio
+async def test_jsonl_exporter(tmp_path):
+    file_name = tmp_path / "traces.jsonl"
+    exporter = JSONLExporter(str(file_name))
+    tracer = Tracer(exporter)
+    for _ in range(2):
+        trace = tracer.start_trace()
+        trace.add_span("queue", trace.started, trace.started + 0.5)
+        tracer.finish(trace, command="echo")
+    await exporter.close()
+
+    records = [json.loads(line) for line in file_name.read_text().splitlines()]
+    assert len(records) == 2
+    assert records[0]["attributes"] == {"command": "echo"}
+    assert records[0]["spans"][0]["duration_ms"] == 500
+
+
+@pytest.mark.asyncio
+async def test_jsonl_exporter_batches(tmp_path):
+    file_name = tmp_path / "traces.jsonl"
+    exporter = JSONLExporter(str(file_name), batch_size=3, flush_interval=0.01)
+    tracer = Tracer(exporter)
+
+    def export(count):
+        for _ in range(count):
+            tracer.finish(tracer.start_trace(), command="echo")
+
+    export(2)
+    assert file_name.read_bytes() == b""  # Запись отложена
+    await asyncio.sleep(0.05)
+    assert len(file_name.read_bytes().splitlines()) == 2
+
+    export(3)  # Полная пачка пишется сразу
+    assert len(file_name.read_bytes().splitlines()) == 5
+    await exporter.close()
+
+
+@pytest.mark.asyncio
+async def test_otlp_payload():
+    exporter = OTLPExporter(service_name="actuator", flush_interval=60)
+    trace = Trace()
+    trace.add_span("queue", trace.started, trace.started + 0.001)
+    with pytest.raises(RuntimeError):
+        with trace.span("execute", cmd="echo"):
+            raise RuntimeError
+    Tracer(exporter).finish(trace, command="echo")
+
+    payload = exporter.payload(exporter._pending)
+    resource = payload["resourceSpans"][0]
+    assert resource["resource"]["attributes"][0]["value"] == {"stringValue": "actuator"}
+    root, queue, execute = resource["scopeSpans"][0]["spans"]
+    assert root["traceId"] == trace.trace_id and len(root["traceId"]) == 32
+    assert "parentSpanId" not in root
+    assert queue["parentSpanId"] == root["spanId"] and len(queue["spanId"]) == 16
+    assert int(queue["endTimeUnixNano"]) - int(queue["startTimeUnixNano"]) == pytest.approx(
+        1e6, 1e-3
+    )
+    assert execute["status"]["code"] == 2
+    assert execute["attributes"] == [{"key": "cmd", "value": {"stringValue": "echo"}}]
+
+    exporter._pending.clear()
+    await exporter.close()
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+from cba.actuator import Actuator
+from cba.commands import BaseCommand, HumanCallableCommandWithArgs, arguments
+from cba.consumers import AMQPConsumer, ReconnectBackoff
+from cba.dispatcher import CommandsDispatcher
+from cba.metrics import MetricsRegistry, REGISTRY
+from cba.publishers import BasePublisher
+from cba.testing import FakeAMQPBroker
+
+
+class FilePublisher(BasePublisher):
+    """Сообщения воркеров видны тесту только через файл"""
+
+    def __init__(self, path):
+        self.path = path
+
+    async def publish_message(self, message):
+        with open(self.path, "a") as file:
+            file.write(f"{os.getpid()} {message.payload['text'].rsplit('>', 1)[-1]}\n")
+
+
+def make_message(command: str, target: str, n: int = 0) -> bytes:
+    return json.dumps(
+        {
+            "command": command,
+            "target": {"target_type": "user", "target_name": target},
+            "behavior": "user",
+            "args": {"n": str(n)},
+        }
+    ).encode()
+
+
+def command_count(cmd: str) -> int:
+    prefix = f'cba_command_seconds_count{{cmd="{cmd}"}} '
+    for line in REGISTRY.render().splitlines():
+        if line.startswith(prefix):
+            return int(line[len(prefix) :])
+    return 0
+
+
+async def wait_for(condition, timeout: float = 5):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_event_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def actuator(tmp_path):
+    dispatcher = CommandsDispatcher(ordered_targets=True)
+
+    @dispatcher.register_callable_command
+    class WorkerWrite(HumanCallableCommandWithArgs):
+        CMD = "workerWrite"
+        ARGS = (arguments.String("n", "number"),)
+
+        async def _execute(self):
+            await asyncio.sleep(0.001 * (int(self.n) % 3))
+            await self.send_message(text=f"{self.target.target_name}:{self.n}")
+
+    @dispatcher.register_callable_command
+    class WorkerCrash(BaseCommand):
+        CMD = "workerCrash"
+
+        async def _execute(self):
+            os._exit(3)
+
+    @dispatcher.register_callable_command
+    class WorkerHang(BaseCommand):
+        CMD = "workerHang"
+
+        async def _execute(self):
+            time.sleep(30)  # Блокирует event loop воркера
+
+    broker = FakeAMQPBroker()
+    actuator = Actuator(
+        "workers",
+        consumer=AMQPConsumer(queue="commands", connect=broker.connect),
+        dispatcher=dispatcher,
+        publishers=FilePublisher(str(tmp_path / "messages")),
+    )
+    actuator.broker = broker
+    actuator.output = tmp_path / "messages"
+    yield actuator
+
+
+def read_output(actuator):
+    lines = [line.split() for line in actuator.output.read_text().splitlines()]
+    return [(int(pid), text) for pid, text in lines]
+
+
+@pytest.mark.asyncio
+async def test_targets_stay_in_order(actuator):
+    broker = actuator.broker
+    for n in range(10):
+        for target in "abcd":
+            broker.publish("commands", make_message("workerWrite", target, n))
+    counted = command_count("workerWrite")
+    actuator.start(workers=2)
+    pool = actuator.worker_pool
+    pool.metrics_interval = 0.05
+    try:
+        await wait_for(lambda: len(broker.acked) == 40)
+        await wait_for(lambda: command_count("workerWrite") == counted + 40)
+
+        messages = read_output(actuator)
+        assert os.getpid() not in {pid for pid, _ in messages}
+        for target in "abcd":
+            received = [(pid, text) for pid, text in messages if text.startswith(target)]
+            # Один адресат - один процесс, и порядок сохраняется
+            assert len({pid for pid, _ in received}) == 1
+            assert [text for _, text in received] == [f"{target}:{n}" for n in range(10)]
+    finally:
+        await actuator.shutdown(timeout=1)
+    assert not any(pid and os.path.exists(f"/proc/{pid}") for pid in pool.pids)
+    # Метрики остановленных воркеров остаются в суммах
+    assert command_count("workerWrite") == counted + 40
+
+
+@pytest.mark.asyncio
+async def test_crashed_worker_restarts(actuator):
+    broker = actuator.broker
+    actuator.start(workers=1)
+    pool = actuator.worker_pool
+    pool.backoff = ReconnectBackoff(first_delay=0, base_delay=0.01)
+    try:
+        await wait_for(lambda: pool.pids[0] is not None)
+        first_pid = pool.pids[0]
+
+        broker.publish("commands", make_message("workerCrash", "a"))
+        await wait_for(lambda: broker.rejected)
+        # Эвент упавшего воркера не подтвержден, но место в очереди освобождено
+        await wait_for(lambda: actuator.events_queue.unfinished == 0)
+        assert pool.restarts == pool.lost == 2
+        assert not broker.acked
+
+        broker.publish("commands", make_message("workerWrite", "a", 1))
+        await wait_for(lambda: len(broker.acked) == 1)
+        assert read_output(actuator) == [(pool.pids[0], "a:1")]
+        assert pool.pids[0] != first_pid
+    finally:
+        await actuator.shutdown(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_lost_events_are_returned(tmp_path, actuator):
+    # prefetch 1: неподтвержденное сообщение упавшего воркера остановило бы всю доставку
+    broker = FakeAMQPBroker()
+    actuator.consumer = AMQPConsumer(queue="commands", connect=broker.connect, prefetch_count=1)
+    broker.publish("commands", make_message("workerCrash", "a"))
+    broker.publish("commands", make_message("workerWrite", "b", 1))
+    actuator.start(workers=1)
+    pool = actuator.worker_pool
+    pool.backoff = ReconnectBackoff(first_delay=0, base_delay=0.01)
+    try:
+        await wait_for(lambda: len(broker.acked) == 1)
+        # Сообщение вернулось в очередь один раз, после второго падения - отклонено
+        assert pool.lost == 2
+        assert broker.rejected == [make_message("workerCrash", "a")]
+        assert broker.acked == [make_message("workerWrite", "b", 1)]
+    finally:
+        await actuator.shutdown(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_hung_worker_is_killed(actuator):
+    broker = actuator.broker
+    actuator.start(workers=1)
+    pool = actuator.worker_pool
+    pool.stop_grace = 0.2
+    broker.publish("commands", make_message("workerHang", "a"))
+    await wait_for(lambda: pool.in_flight == 1 and pool._workers[0].sent)
+    process = pool._workers[0].process
+
+    started = time.monotonic()
+    await asyncio.wait_for(actuator.shutdown(timeout=0.3), 5)
+    assert time.monotonic() - started < 3
+    assert not process.is_alive()
+    assert pool.lost == 1
+    assert not broker.acked
+
+
+def test_registry_merges_remote_snapshots():
+    local, remote = MetricsRegistry(), MetricsRegistry()
+    for registry in (local, remote):
+        registry.counter("events_total", "Events", ("cmd",)).labels("echo").inc(2)
+        registry.gauge("running", "Running").set(1)
+        registry.histogram("seconds", "Seconds", buckets=(1,)).observe(0.5)
+    local.set_remote(1, remote.snapshot())
+    text = local.render()
+    assert 'events_total{cmd="echo"} 4' in text
+    assert "running 2" in text
+    assert 'seconds_bucket{le="1"} 2' in text
+
+    # Счетчики завершившегося процесса сохраняются, измерители - нет
+    local.retire_remote(1)
+    text = local.render()
+    assert 'events_total{cmd="echo"} 4' in text
+    assert "running 1" in text
+    assert "seconds_count 2" in text